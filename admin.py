@@ -1,8 +1,19 @@
 import os
 import sqlite3
+import io
 import json
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context
+from search import init_search, register_compact, search_rooms, SEARCH_LIMIT
+from sqlite_pool import SQLitePool
+from bulk import detect_format, iter_manifest, import_rooms, export_rooms
+from video import init_video, video_url
+from uploads import init_uploads, finalize_upload, save_video, UploadError
+from profiling import init_profiling
+from passwords import hasher, init_proxies, login_allowed, login_succeeded, PasswordBusy
+from routing import init_routing, import_graph, load_graph, graph_revision, Router, ROUTE_ENTRANCE
+from pagecache import PageCache, render_rows
+from tables import index_for, init_tables, query_table
+from startup import init_startup, STARTUP_WARM
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
@@ -12,6 +23,7 @@ json_file = 'data.json'
 
 def init_db():
     with sqlite3.connect(db_path) as conn:
+        register_compact(conn)
         cursor = conn.cursor()
         cursor.execute('''CREATE TABLE IF NOT EXISTS admins (
                             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -29,16 +41,38 @@ def init_db():
         cursor.execute("SELECT COUNT(*) FROM rooms")
         if cursor.fetchone()[0] == 0:
             with open(json_file, 'r') as f:
-                rooms = json.load(f)
-                cursor.executemany("INSERT INTO rooms (id, name, video) VALUES (?, ?, ?)",
-                                   [(room['id'], room['name'], room['video']) for room in rooms])
-                conn.commit()
-init_db()
+                import_rooms(conn, iter_manifest(f, detect_format(json_file)))
+
+        # Bumped by every change to rooms (so rendered pages can be cached per revision)
+        # and by every graph import (the 'nav' row, see init_routing)
+        cursor.execute("CREATE TABLE IF NOT EXISTS revisions (name TEXT PRIMARY KEY, rev INTEGER NOT NULL)")
+        cursor.execute("INSERT OR IGNORE INTO revisions (name, rev) VALUES ('rooms', 0)")
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS rooms_rev_{event.lower()} AFTER {event} ON rooms
+                               BEGIN UPDATE revisions SET rev = rev + 1 WHERE name = 'rooms'; END""")
+
+        init_search(conn)
+        init_routing(conn)
+pool = SQLitePool(db_path, app, on_connect=register_compact)
+router = Router(lambda: load_graph(pool.read()), revision=lambda: graph_revision(pool.read()))
 
 UPLOAD_FOLDER = 'static/uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+init_video(app)
+init_profiling(app, is_admin=lambda: 'admin' in session)
+init_proxies(app)
+init_tables(app)
+page_cache = PageCache(app)
+
+def upload_guard():
+    if 'admin' not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+def upload_complete(room_id, video_filename):
+    with pool.write() as conn:
+        conn.execute("UPDATE rooms SET video = ? WHERE id = ?", (video_filename, room_id))
+
+init_uploads(app, upload_guard, upload_complete, filename='{room_id}.mp4')
 
 @app.route('/')
 def home():
@@ -50,25 +84,26 @@ def admin():
         flash('Unauthorized access!', 'danger')
         return redirect(url_for('login'))
     
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM rooms")
-        rooms = cursor.fetchall()
+    cursor = pool.read().cursor()
+    cursor.execute("SELECT * FROM rooms")
+    rooms = cursor.fetchall()
     
     if request.method == 'POST':
         room_id = request.form['room_id'].strip()
         room_name = request.form['room_name'].strip()
-        video = request.files['video']
+        video = request.files.get('video')
+        upload_id = request.form.get('upload_id', '').strip()
 
-        if room_id and room_name and video:
-            video_filename = f"{room_id}.mp4"
-            video_path = os.path.join(app.config['UPLOAD_FOLDER'], video_filename)
-            video.save(video_path)
+        if room_id and room_name and (video or upload_id):
+            try:
+                video_filename = finalize_upload(upload_id, room_id) if upload_id else save_video(video, room_id)
+            except UploadError as e:
+                flash(f'Video upload failed: {e}', 'danger')
+                return redirect(url_for('admin'))
             
-            with sqlite3.connect(db_path) as conn:
+            with pool.write() as conn:
                 cursor = conn.cursor()
                 cursor.execute("INSERT INTO rooms (id, name, video) VALUES (?, ?, ?)", (room_id, room_name, video_filename))
-                conn.commit()
                 flash('Room added successfully!', 'success')
             return redirect(url_for('admin'))
     
@@ -79,17 +114,18 @@ def signup():
     if request.method == 'POST':
         email = request.form['email']
         password = request.form['password']
-        hashed_password = generate_password_hash(password)
 
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            try:
+        try:
+            hashed_password = hasher.hash(password)
+            with pool.write() as conn:
+                cursor = conn.cursor()
                 cursor.execute("INSERT INTO admins (email, password) VALUES (?, ?)", (email, hashed_password))
-                conn.commit()
-                flash('Signup successful! Please login.', 'success')
-                return redirect(url_for('login'))
-            except sqlite3.IntegrityError:
-                flash('Email already registered!', 'danger')
+            flash('Signup successful! Please login.', 'success')
+            return redirect(url_for('login'))
+        except sqlite3.IntegrityError:
+            flash('Email already registered!', 'danger')
+        except PasswordBusy:
+            flash('The server is busy, please try again in a moment.', 'danger')
     
     return render_template('signup.html')
 
@@ -99,17 +135,32 @@ def login():
         email = request.form['email']
         password = request.form['password']
 
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM admins WHERE email = ?", (email,))
-            user = cursor.fetchone()
+        allowed, retry_after = login_allowed(request.remote_addr, email)
+        if not allowed:
+            flash(f'Too many login attempts, try again in {retry_after} seconds.', 'danger')
+            return render_template('login.html'), 429
 
-            if user and check_password_hash(user[2], password):
-                session['admin'] = user[0]
-                flash('Login successful!', 'success')
-                return redirect(url_for('admin'))
-            else:
-                flash('Invalid credentials!', 'danger')
+        cursor = pool.read().cursor()
+        cursor.execute("SELECT * FROM admins WHERE email = ?", (email,))
+        user = cursor.fetchone()
+
+        try:
+            # Unknown emails are checked against a dummy hash, so the response time doesn't reveal accounts
+            valid, new_hash = hasher.verify(user[2] if user else None, password)
+        except PasswordBusy:
+            flash('The server is busy, please try again in a moment.', 'danger')
+            return render_template('login.html'), 503
+        if valid:
+            if new_hash:
+                # Upgrade hashes made with an older method or cost
+                with pool.write() as conn:
+                    conn.execute("UPDATE admins SET password = ? WHERE id = ?", (new_hash, user[0]))
+            login_succeeded(request.remote_addr, email)
+            session['admin'] = user[0]
+            flash('Login successful!', 'success')
+            return redirect(url_for('admin'))
+        else:
+            flash('Invalid credentials!', 'danger')
     
     return render_template('login.html')
 
@@ -119,38 +170,147 @@ def logout():
     flash('Logged out successfully!', 'success')
     return redirect(url_for('login'))
 
+def room_dicts(rows):
+    return [{"id": row[0], "name": row[1], "video": row[2]} for row in rows]
+
+def render_user(rooms, total, api=None):
+    tables = {"rooms": {"api": api, "total": total},
+              "timetable": {"api": None, "total": 0}, "exams": {"api": None, "total": 0}}
+    return render_template('user.html', fragments={"rooms": rooms, "timetable": "", "exams": ""},
+                           tables=tables, rev=None)
+
+def rooms_revision(conn):
+    return conn.execute("SELECT rev FROM revisions WHERE name = 'rooms'").fetchone()[0]
+
+def load_rooms(conn):
+    return room_dicts(conn.execute("SELECT id, name, video FROM rooms").fetchall())
+
 @app.route('/user', methods=['GET', 'POST'])
 def user():
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM rooms")
-        rooms = cursor.fetchall()
-
+    conn = pool.read()
     if request.method == 'POST':
-        search_query = request.form['search_query'].strip().lower()
-        rooms = [room for room in rooms if search_query in room[1].lower() or search_query in room[0].lower()]
+        search_query = request.form['search_query'].strip()
+        limit = request.form.get('limit', SEARCH_LIMIT, type=int)
+        rooms = room_dicts(search_rooms(conn, search_query, limit))
+        return render_user(render_rows("rooms", rooms), len(rooms))
+
+    rev = rooms_revision(conn)
 
-    return render_template('user.html', rooms=rooms)
+    def render():
+        # First window only; the page scrolls and searches through /tables/rooms
+        rooms, total = index_for("rooms", rev, lambda: load_rooms(conn)).query()
+        fragment = page_cache.fragment("rooms", rev, lambda: render_rows("rooms", rooms))
+        return render_user(fragment, total, url_for('rooms_table'))
+
+    return page_cache.page("user", rev, render)
+
+@app.route('/tables/rooms')
+def rooms_table():
+    conn = pool.read()
+    rev = rooms_revision(conn)
+    try:
+        return jsonify(query_table("rooms", rev, lambda: load_rooms(conn), request.args))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
 
 @app.route('/delete_room/<room_id>', methods=['POST'])
 def delete_room(room_id):
-    with sqlite3.connect(db_path) as conn:
+    with pool.write() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM rooms WHERE id = ?", (room_id,))
-        conn.commit()
     flash('Room deleted successfully!', 'success')
     return redirect(url_for('admin'))
 
+@app.route('/admin/rooms/import', methods=['POST'])
+def import_rooms_manifest():
+    if 'admin' not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    manifest = request.files.get('manifest')
+    if not manifest:
+        return jsonify({"success": False, "message": "No manifest uploaded"}), 400
+
+    fmt = request.form.get('format') or detect_format(manifest.filename)
+    stream = io.TextIOWrapper(manifest.stream, encoding='utf-8', newline='')
+    try:
+        with pool.write() as conn:
+            report = import_rooms(conn, iter_manifest(stream, fmt))
+    except (ValueError, KeyError, AttributeError) as e:
+        return jsonify({"success": False, "message": f"Invalid manifest: {e}"}), 400
+    return jsonify({"success": True, **report})
+
+@app.route('/admin/rooms/export', methods=['GET'])
+def export_rooms_manifest():
+    if 'admin' not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    fmt = 'csv' if request.args.get('format') == 'csv' else 'jsonl'
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_rooms(pool.read(), fmt)), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=rooms.{fmt}"})
+
 @app.route('/voice_search', methods=['GET'])
 def voice_search():
-    query = request.args.get('q', '').lower()
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM rooms")
-        rooms = cursor.fetchall()
-    
-    filtered_rooms = [room for room in rooms if query in room[1].lower() or query in room[0].lower()]
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', SEARCH_LIMIT, type=int)
+    filtered_rooms = search_rooms(pool.read(), query, limit)
     return jsonify({"rooms": filtered_rooms})
 
+@app.route('/route', methods=['GET'])
+def route():
+    """Shortest walking route between two nodes as an ordered list of video steps."""
+    source = request.args.get('from', ROUTE_ENTRANCE)
+    target = request.args.get('to', '')
+    found = router.route(source, target)
+    if found is None:
+        # No graph for this building yet: fall back to the room's entrance video
+        cursor = pool.read().cursor()
+        cursor.execute("SELECT id, name, video FROM rooms WHERE id = ?", (target.strip(),))
+        room = cursor.fetchone()
+        if room is None or source != ROUTE_ENTRANCE:
+            return jsonify({"success": False, "message": f"No route from {source} to {target}"}), 404
+        found = {"from": source, "to": room[0], "distance": None,
+                 "steps": [{"from": source, "to": room[0], "kind": "walk", "distance": None, "floor": None,
+                            "video": room[2], "instruction": f"Go to {room[1]}"}]}
+    for step in found["steps"]:
+        step["video_url"] = video_url(step["video"])
+    return jsonify({"success": True, **found})
+
+@app.route('/admin/graph/import', methods=['POST'])
+def import_graph_manifest():
+    if 'admin' not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    manifest = request.files.get('manifest')
+    if not manifest:
+        return jsonify({"success": False, "message": "No graph uploaded"}), 400
+    try:
+        with pool.write() as conn:
+            report = import_graph(conn, json.load(manifest.stream))
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"success": False, "message": f"Invalid graph: {e}"}), 400
+    router.invalidate()
+    return jsonify({"success": True, **report})
+
+# ---------------- STARTUP ---------------- #
+def start():
+    init_db()
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+def warm_graph():
+    with app.app_context():
+        router.graph()
+
+startup = init_startup(app, start, warm={
+    "graph": warm_graph,
+    "password pool": lambda: hasher.method_prefix,
+    "user page": '/user',
+})
+
+def create_app(warm=STARTUP_WARM):
+    """Set up the database and warm caches before serving, e.g. gunicorn 'admin:create_app()'."""
+    startup.run(warm)
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5002)
+    create_app().run(debug=True, port=5002)
@@ -1,15 +1,24 @@
 import os
-import firebase_admin
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from firebase_admin import credentials, firestore, auth
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+import time
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context, make_response
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 from datetime import datetime
 from dotenv import load_dotenv
+from markupsafe import escape
+from cache import collection_cache, CollectionCache
+from bulk import export_rows, FIRESTORE_COLLECTIONS
+from video import init_video, video_url
+from uploads import init_uploads, finalize_upload, save_video, UploadError
+from transcode import TranscodeQueue
+from fanout import fetch_all
+from schedule import ScheduleIndex, DAYS
+from profiling import init_profiling
+from passwords import hasher, init_proxies, login_allowed, login_succeeded, PasswordBusy
+from outbox import Outbox, SMTPPool
+from storage import open_storage, AccountExists, DELETE, StorageError
+from materialize import room_key, week_view_id
+from startup import init_startup, STARTUP_WARM
+from pagecache import init_row_macros
 
 # Load environment variables
 load_dotenv()
@@ -18,65 +27,145 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'your_flask_secret_here_123')
 
-# Firebase Setup
-cred = credentials.Certificate(os.getenv("FIREBASE_CRED"))
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# Rooms, timetable, exams and users in Firestore or local SQLite (STORAGE_BACKEND); connects on first use
+store = open_storage()
 
 # Email configuration
 EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
 EMAIL_PORT = int(os.getenv('EMAIL_PORT', 587))
 EMAIL_USERNAME = os.getenv('EMAIL_USERNAME')
 EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
+EMAIL_FROM = os.getenv('EMAIL_FROM', EMAIL_USERNAME)
+
+# Shares templates/ with user.py; _user_rows.html needs its filters to compile
+init_row_macros(app)
 
 # File Paths
 UPLOAD_FOLDER = 'static/uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+init_video(app)
 
 # Flask-Login Setup
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Client addresses (login rate limits) behind TRUSTED_PROXIES reverse proxies
+init_proxies(app)
+
+# Request metrics on /metrics and ?__profile=1 for signed-in admins (or METRICS_TOKEN / PROFILE_TOKEN)
+init_profiling(app, is_admin=lambda: current_user.is_authenticated)
+
+# Chunked video uploads
+# Fields cleared when a room gets a new video, until it is transcoded again
+def stale_renditions():
+    return {field: DELETE for field in ("renditions", "hls", "poster")}
+
+def upload_guard():
+    if not current_user.is_authenticated:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+def upload_complete(room_id, video_filename):
+    if store.rooms.get(room_id) is not None:
+        store.rooms.update(room_id, {"video": video_filename, **stale_renditions()})
+        collection_cache.invalidate("rooms")
+        queue_transcode(room_id, video_filename)
+
+init_uploads(app, upload_guard, upload_complete)
+
+# Background video transcoding
+def save_renditions(room_id, result):
+    """Record rendition metadata produced by the transcode queue on the room."""
+    prefix = f"renditions/{room_id}/"
+    if store.rooms.get(room_id) is None:
+        return
+    store.rooms.update(room_id, {
+        "renditions": [{**r, "file": prefix + r["file"]} for r in result["renditions"]],
+        "hls": prefix + result["hls"],
+        "poster": prefix + result["poster"],
+    })
+    collection_cache.invalidate("rooms")
+
+def queue_transcode(room_id, video_filename):
+    transcode_queue.enqueue(room_id, os.path.join(UPLOAD_FOLDER, video_filename))
+
+transcode_queue = TranscodeQueue(UPLOAD_FOLDER, on_done=save_renditions)
+
 # User Class for Flask-Login
 class User(UserMixin):
-    def __init__(self, id, username, email):
+    def __init__(self, id, username, email, role=None):
         self.id = id
         self.username = username
         self.email = email
+        self.role = role
+
+# Identity claims per user, so @login_required routes don't read storage every request
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 300))
+user_cache = CollectionCache(ttl=USER_CACHE_TTL, max_entries=int(os.getenv('USER_CACHE_MAX_ENTRIES', 1024)))
+# SESSION_CLAIMS=1 also keeps the claims in the signed session cookie, re-read after SESSION_CLAIMS_TTL
+SESSION_CLAIMS = os.getenv('SESSION_CLAIMS', '').lower() in ('1', 'true', 'yes')
+SESSION_CLAIMS_TTL = float(os.getenv('SESSION_CLAIMS_TTL', 900))
+
+def user_claims(user_data):
+    return {
+        "username": user_data.get('username'),
+        "email": user_data.get('email'),
+        "role": user_data.get('role')
+    }
+
+def _fetch_claims(user_id):
+    user_data = store.users.get(user_id)
+    return user_claims(user_data) if user_data is not None else None
+
+def remember_user(user_id, claims):
+    user_cache.set(f"users:{user_id}", claims)
+    if SESSION_CLAIMS:
+        session['claims'] = {"id": user_id, "at": time.time(), **claims}
+
+def invalidate_user(user_id):
+    """Forget cached claims after logout or a role/profile change."""
+    user_cache.discard(f"users:{user_id}")
+    if session.get('claims', {}).get('id') == user_id:
+        session.pop('claims', None)
 
 # User Loader Function
 @login_manager.user_loader
 def load_user(user_id):
-    user_ref = db.collection("users").document(user_id).get()
-    if user_ref.exists:
-        user_data = user_ref.to_dict()
-        return User(user_id, user_data.get('username'), user_data.get('email'))
-    return None
+    claims = session.get('claims') if SESSION_CLAIMS else None
+    if not claims or claims.get('id') != user_id or time.time() - claims.get('at', 0) > SESSION_CLAIMS_TTL:
+        claims = user_cache.get(f"users:{user_id}", lambda: _fetch_claims(user_id))
+        if claims is None:
+            return None
+        if SESSION_CLAIMS:
+            session['claims'] = {"id": user_id, "at": time.time(), **claims}
+    return User(user_id, claims['username'], claims['email'], claims.get('role'))
 
 # ---------------- EMAIL UTILITY ---------------- #
+# Messages are queued in outbox.db and sent by background workers over pooled SMTP
+outbox = Outbox(SMTPPool(EMAIL_HOST, EMAIL_PORT, EMAIL_USERNAME, EMAIL_PASSWORD), EMAIL_FROM)
+
 def send_email(recipient_email, subject, body):
-    """Send email to the recipient (HTML body)."""
-    if not all([EMAIL_HOST, EMAIL_PORT, EMAIL_USERNAME, EMAIL_PASSWORD]):
+    """Queue an email to the recipient (HTML body); returns False if email is not configured."""
+    if not all([EMAIL_HOST, EMAIL_PORT, EMAIL_FROM]):
         print("❌ Email configuration missing.")
         return False
+    try:
+        outbox.enqueue(recipient_email, subject, body)
+        return True
+    except Exception as e:
+        print(f"❌ Failed to queue email: {e}")
+        return False
 
-    message = MIMEMultipart()
-    message['From'] = EMAIL_USERNAME
-    message['To'] = recipient_email
-    message['Subject'] = subject
-    message.attach(MIMEText(body, 'html'))
-
+def send_bulk_email(recipients, subject, body):
+    """Queue the same notice for many recipients in one transaction."""
+    if not all([EMAIL_HOST, EMAIL_PORT, EMAIL_FROM]):
+        print("❌ Email configuration missing.")
+        return False
     try:
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USERNAME, EMAIL_PASSWORD)
-            server.sendmail(EMAIL_USERNAME, recipient_email, message.as_string())
-        print(f"✅ Email sent to {recipient_email}")
+        outbox.enqueue_many([(recipient, subject, body) for recipient in recipients])
         return True
     except Exception as e:
-        print(f"❌ Failed to send email: {e}")
+        print(f"❌ Failed to queue emails: {e}")
         return False
 
 
@@ -87,59 +176,138 @@ def home():
 
 
 # ---------------- ADMIN DASHBOARD ---------------- #
+DASHBOARD_PAGE_SIZE = 50
+DASHBOARD_MAX_PAGE_SIZE = 200
+
+def room_row(d):
+    return {
+        "id": d["id"],
+        "name": d.get("name", ""),
+        "video": d.get("video", "")
+    }
+
+def timetable_row(d):
+    return {
+        "id": d["id"],
+        "day": d.get("day", ""),
+        "period": d.get("period", ""),
+        "subject": d.get("subject", ""),
+        "teacher": d.get("teacher", ""),
+        "room": d.get("room", ""),
+        "start_time": d.get("start_time", ""),
+        "end_time": d.get("end_time", "")
+    }
+
+def exam_row(d):
+    date_val = d.get("date")
+    if isinstance(date_val, datetime):
+        date_str = date_val.strftime('%Y-%m-%d')
+    else:
+        date_str = str(date_val) if date_val else ""
+    return {
+        "id": d["id"],
+        "name": d.get("name", ""),
+        "date": date_str,
+        "room": d.get("room", ""),
+        "start_time": d.get("start_time", ""),
+        "end_time": d.get("end_time", "")
+    }
+
+# Projection, ordering and equality filters per dashboard section.
+# On Firestore, filtering on one field while ordering by another needs a composite index.
+SECTIONS = {
+    "rooms": {"fields": ["name", "video"], "order_by": None, "filters": [], "row": room_row},
+    "timetable": {
+        "fields": ["day", "period", "subject", "teacher", "room", "start_time", "end_time"],
+        "order_by": "start_time",
+        "filters": ["day", "room", "teacher"],
+        "row": timetable_row
+    },
+    "exams": {
+        "fields": ["name", "date", "room", "start_time", "end_time"],
+        "order_by": "date",
+        "filters": ["date", "room"],
+        "row": exam_row
+    },
+}
+
+def query_section(name, limit=DASHBOARD_PAGE_SIZE, cursor=None, filters=None):
+    """Fetch one page of a section; returns (rows, next_cursor).
+
+    The cursor is the ID of the last document on the previous page.
+    """
+    spec = SECTIONS[name]
+    equals = {}
+    for field in spec["filters"]:
+        value = (filters or {}).get(field, '').strip()
+        if value:
+            equals[field] = value
+
+    rows = store[name].page(spec["fields"], equals, spec["order_by"], cursor, limit + 1)
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return [spec["row"](row) for row in rows[:limit]], next_cursor
+
+
 @app.route('/admin')
 @login_required
 def admin():
-    # Rooms
-    rooms_ref = db.collection("rooms").stream()
-    rooms = []
-    for room in rooms_ref:
-        d = room.to_dict()
-        rooms.append({
-            "id": room.id,
-            "name": d.get("name", ""),
-            "video": d.get("video", ""),
-            "created_at": d.get("created_at")
-        })
-
-    # Timetable
-    timetable_ref = db.collection("timetable").stream()
-    timetable = []
-    for entry in timetable_ref:
-        d = entry.to_dict()
-        timetable.append({
-            "id": entry.id,
-            "day": d.get("day", ""),
-            "period": d.get("period", ""),
-            "subject": d.get("subject", ""),
-            "teacher": d.get("teacher", ""),
-            "room": d.get("room", ""),
-            "start_time": d.get("start_time", ""),
-            "end_time": d.get("end_time", ""),
-            "created_at": d.get("created_at")
-        })
-
-    # Exams
-    exams_ref = db.collection("exams").stream()
-    exams = []
-    for ex in exams_ref:
-        d = ex.to_dict()
-        date_val = d.get("date")
-        if isinstance(date_val, datetime):
-            date_str = date_val.strftime('%Y-%m-%d')
-        else:
-            date_str = str(date_val) if date_val else ""
-        exams.append({
-            "id": ex.id,
-            "name": d.get("name", ""),
-            "date": date_str,
-            "room": d.get("room", ""),
-            "start_time": d.get("start_time", ""),
-            "end_time": d.get("end_time", ""),
-            "created_at": d.get("created_at")
-        })
+    # Only the first page of rooms is rendered; other tabs load from /api/<section>
+    result = fetch_all({
+        "rooms": lambda: query_section("rooms"),
+        "room_options": get_rooms,
+        "transcode_stats": transcode_queue.stats,
+        "transcode_jobs": transcode_queue.recent,
+    }, defaults={"rooms": ([], None), "transcode_stats": {}})
+    rooms, rooms_cursor = result["rooms"]
+    response = make_response(render_template(
+        'admin.html', rooms=rooms, rooms_cursor=rooms_cursor, room_options=result["room_options"],
+        transcode_stats=result["transcode_stats"], transcode_jobs=result["transcode_jobs"],
+        degraded=result.degraded
+    ))
+    response.headers['Server-Timing'] = result.server_timing()
+    return response
+
+
+@app.route('/api/<section>')
+@login_required
+def section_data(section):
+    if section not in SECTIONS:
+        return jsonify({"success": False, "message": "Unknown section"}), 404
+
+    limit = min(request.args.get('limit', DASHBOARD_PAGE_SIZE, type=int), DASHBOARD_MAX_PAGE_SIZE)
+    rows, next_cursor = query_section(section, max(limit, 1), request.args.get('cursor'), request.args)
+    if section == "rooms":
+        for row in rows:
+            row["video_url"] = video_url(row["video"])
+    return jsonify({"success": True, "items": rows, "next_cursor": next_cursor})
+
+
+@app.route('/transcode/status')
+@login_required
+def transcode_status():
+    return jsonify({"stats": transcode_queue.stats(), "jobs": transcode_queue.recent()})
+
+
+@app.route('/outbox/status')
+@login_required
+def outbox_status():
+    return jsonify(outbox.stats())
+
 
-    return render_template('admin.html', rooms=rooms, timetable=timetable, exams=exams)
+@app.route('/notices', methods=['POST'])
+@login_required
+def send_notice():
+    """Email a notice ({"subject", "message"}) to every account, queued as one batch."""
+    data = request.get_json(silent=True) or {}
+    subject = str(data.get('subject') or '').strip()
+    message = str(data.get('message') or '').strip()
+    if not subject or not message:
+        return jsonify({"success": False, "message": "subject and message are required"}), 400
+    recipients = sorted({row["email"] for row in store.users.rows(["email"]) if row.get("email")})
+    body = f"<html><body><p>{escape(message)}</p></body></html>"
+    if not send_bulk_email(recipients, subject, body):
+        return jsonify({"success": False, "message": "Email sending failed. Check config."}), 503
+    return jsonify({"success": True, "queued": len(recipients)})
 
 
 # ---------------- ROOMS ---------------- #
@@ -149,62 +317,67 @@ def add_room():
     room_id = request.form['id'].strip()
     name = request.form['name'].strip()
     video = request.files.get('video')
+    upload_id = request.form.get('upload_id', '').strip()
 
-    if not room_id or not name or not video:
+    if not room_id or not name or not (video or upload_id):
         flash('Missing required fields for room.', 'danger')
         return redirect(url_for('admin'))
 
     # Check if room ID exists
-    room_ref = db.collection("rooms").document(room_id).get()
-    if room_ref.exists:
+    if store.rooms.get(room_id) is not None:
         flash('Room ID already exists!', 'danger')
         return redirect(url_for('admin'))
 
     # Check if room name already exists
-    name_ref = db.collection("rooms").where("name", "==", name).limit(1).get()
-    if name_ref:
+    if store.rooms.find(name=name, limit=1):
         flash('Room name already exists!', 'danger')
         return redirect(url_for('admin'))
 
-    # Save video
-    video_filename = secure_filename(f"room_{room_id}.mp4")
-    video_path = os.path.join(app.config['UPLOAD_FOLDER'], video_filename)
-    video.save(video_path)
+    # Save video (finished chunked upload, or a regular multipart file)
+    try:
+        video_filename = finalize_upload(upload_id, room_id) if upload_id else save_video(video, room_id)
+    except UploadError as e:
+        flash(f'Video upload failed: {e}', 'danger')
+        return redirect(url_for('admin'))
 
-    # Add room to Firestore
-    db.collection("rooms").document(room_id).set({
+    # Add room (created_at is stamped by the storage)
+    store.rooms.create(room_id, {
         "name": name,
-        "video": video_filename,
-        "created_at": firestore.SERVER_TIMESTAMP
+        "video": video_filename
     })
+    collection_cache.invalidate("rooms")
+    queue_transcode(room_id, video_filename)
     flash('Room added successfully!', 'success')
     return redirect(url_for('admin'))
 # ---------------- EDIT ROOM ---------------- #
 @app.route('/edit_room/<room_id>', methods=['GET', 'POST'])
 @login_required
 def edit_room(room_id):
-    room_ref = db.collection("rooms").document(room_id).get()
-    if not room_ref.exists:
+    room_data = store.rooms.get(room_id)
+    if room_data is None:
         flash('Room not found!', 'danger')
         return redirect(url_for('admin'))
 
-    room_data = room_ref.to_dict()
-
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
         video = request.files.get('video')
+        upload_id = request.form.get('upload_id', '').strip()
 
         if name:
             # Update name
-            room_ref.reference.update({"name": name})
+            store.rooms.update(room_id, {"name": name})
 
-        if video:
+        if video or upload_id:
             # Save new video
-            video_filename = secure_filename(f"room_{room_id}.mp4")
-            video_path = os.path.join(app.config['UPLOAD_FOLDER'], video_filename)
-            video.save(video_path)
-            room_ref.reference.update({"video": video_filename})
-
+            try:
+                video_filename = finalize_upload(upload_id, room_id) if upload_id else save_video(video, room_id)
+            except UploadError as e:
+                flash(f'Video upload failed: {e}', 'danger')
+                return redirect(url_for('edit_room', room_id=room_id))
+            store.rooms.update(room_id, {"video": video_filename, **stale_renditions()})
+            queue_transcode(room_id, video_filename)
+
+        collection_cache.invalidate("rooms")
         flash('Room updated successfully!', 'success')
         return redirect(url_for('admin'))
 
@@ -213,20 +386,335 @@ def edit_room(room_id):
 @app.route('/delete_room/<room_id>', methods=['POST'])
 @login_required
 def delete_room(room_id):
-    room_ref = db.collection("rooms").document(room_id).get()
-    if room_ref.exists:
-        video_filename = room_ref.to_dict().get("video")
+    room_data = store.rooms.get(room_id)
+    if room_data is not None:
+        video_filename = room_data.get("video")
         if video_filename:
             video_path = os.path.join(app.config['UPLOAD_FOLDER'], video_filename)
             if os.path.exists(video_path):
                 os.remove(video_path)
-        db.collection("rooms").document(room_id).delete()
+        store.rooms.delete(room_id)
+        transcode_queue.remove(room_id)
+        collection_cache.invalidate("rooms")
         flash('Room deleted successfully!', 'success')
     else:
         flash('Room not found!', 'danger')
     return redirect(url_for('admin'))
 
 
+# ---------------- CONFLICT CHECKS ---------------- #
+schedule_index = ScheduleIndex()
+
+def get_schedule():
+    """Schedule index over all timetable/exam entries, refreshed from the cache's TTL.
+
+    Writes in this process update the index directly, so the "schedule:" cache
+    keys are deliberately not dropped by collection_cache.invalidate().
+    """
+    schedule_index.set_rooms(get_rooms())
+    for name in ("timetable", "exams"):
+        spec = SECTIONS[name]
+        rows = collection_cache.get(
+            f"schedule:{name}",
+            lambda spec=spec, name=name: [spec["row"](row) for row in store[name].rows(spec["fields"])]
+        )
+        schedule_index.sync(name, rows)
+    return schedule_index
+
+def describe_conflicts(conflicts):
+    parts = []
+    for c in conflicts[:3]:
+        e = c["entry"]
+        when = e.get("day") or e.get("date")
+        label = e.get("subject") or e.get("name")
+        parts.append(f"{c['reason']} clash with {label} ({when} {e['start_time']}-{e['end_time']}, {e['room']})")
+    more = f" and {len(conflicts) - 3} more" if len(conflicts) > 3 else ""
+    return "; ".join(parts) + more
+
+class ScheduleConflict(Exception):
+    def __init__(self, conflicts):
+        super().__init__(f"Conflict: {describe_conflicts(conflicts)}")
+        self.conflicts = conflicts
+
+def stored_schedule(kind, rows):
+    """ScheduleIndex of the stored entries rows could clash with, read now instead of from the cache.
+
+    Reads the rooms' schedule views (their timetable, and for exams the week's
+    exams) and, for classes, the teacher's entries by exact name.
+    """
+    index = ScheduleIndex()
+    index.set_rooms(get_rooms())
+    loaded = {}
+
+    def load(other_kind, key, view_id=None, **equals):
+        if key not in loaded:
+            rows = store.view(view_id) if view_id else None
+            if rows is None:
+                rows = [SECTIONS[other_kind]["row"](row) for row in store[other_kind].find(**equals)]
+            loaded[key] = rows
+            for row in rows:
+                index.upsert(other_kind, row)
+
+    for row in rows:
+        name = index.resolve_room(row.get("room"))
+        # Entries may name the room by ID or by name
+        rooms = {row.get("room"), name} | {r["id"] for r in get_rooms() if r["name"] == name}
+        for room in filter(None, rooms):
+            view_id = f"room:{room_key(room)}"
+            load("timetable", view_id, view_id, room=room)
+            if kind == "exams":
+                try:
+                    view_id = week_view_id(room, datetime.strptime(str(row.get("date"))[:10], '%Y-%m-%d'))
+                except ValueError:
+                    continue
+                load("exams", view_id, view_id, room=room)
+        if kind == "timetable" and row.get("teacher"):
+            load("timetable", f"teacher:{row['teacher']}", teacher=row["teacher"])
+    return index
+
+def schedule_check(kind):
+    """check() for store writes: re-run the conflict check against the stored schedule.
+
+    The index check before a write uses this process's cached view, so two
+    workers could both accept clashing entries. Inside the write the check
+    is serialized with other writes (SQLite write lock, Firestore revision
+    precondition), closing that window.
+    """
+    def check(ops):
+        rows = [{**(previous or {}), **data, "id": doc_id}
+                for mode, doc_id, data, previous in ops if mode != "delete"]
+        ids = {row["id"] for row in rows}
+        stored = stored_schedule(kind, rows)
+        for row in rows:
+            # Rows written together were already checked against each other
+            conflicts = [c for c in stored.conflicts_for(kind, row) if c["kind"] != kind or c["entry"]["id"] not in ids]
+            if conflicts:
+                raise ScheduleConflict(conflicts)
+    return check
+
+@app.route('/conflicts/check', methods=['POST'])
+@login_required
+def check_conflicts():
+    """Check a prospective timetable/exam entry: {"kind": ..., "entry": {...}}."""
+    data = request.get_json(silent=True) or {}
+    kind = data.get("kind")
+    if kind not in ("timetable", "exams"):
+        return jsonify({"success": False, "message": "kind must be timetable or exams"}), 400
+    conflicts = get_schedule().conflicts_for(kind, data.get("entry") or {})
+    return jsonify({"success": True, "conflicts": conflicts})
+
+@app.route('/conflicts/term')
+@login_required
+def term_conflicts():
+    """Sweep the whole term for room and teacher double-bookings."""
+    conflicts = get_schedule().validate()
+    return jsonify({"success": True, "count": len(conflicts), "conflicts": conflicts})
+
+
+# ---------------- BULK SCHEDULE API ---------------- #
+BULK_MAX_ROWS = int(os.getenv('BULK_MAX_ROWS', 2000))
+
+def validate_entry(kind, row, index):
+    """Return (entry, errors) for one bulk row; the room is normalized to its name."""
+    entry = {field: str(row.get(field) or '').strip() for field in SECTIONS[kind]["fields"]}
+    errors = [f"{field} is required" for field, value in entry.items() if not value]
+
+    if kind == "timetable" and entry["day"] and entry["day"] not in DAYS:
+        errors.append("day must be a weekday name")
+    if kind == "exams" and entry["date"]:
+        try:
+            datetime.strptime(entry["date"], '%Y-%m-%d')
+        except ValueError:
+            errors.append("date must be YYYY-MM-DD")
+    if entry["start_time"] and entry["end_time"]:
+        try:
+            if datetime.strptime(entry["end_time"], '%H:%M') <= datetime.strptime(entry["start_time"], '%H:%M'):
+                errors.append("end_time must be later than start_time")
+        except ValueError:
+            errors.append("times must be HH:MM")
+    if entry["room"]:
+        if index.has_room(entry["room"]):
+            entry["room"] = index.resolve_room(entry["room"])
+        else:
+            errors.append(f"unknown room {entry['room']}")
+    return entry, errors
+
+def current_entry(index, kind, entry_id):
+    """The indexed entry, else the stored one this process hasn't indexed yet, else None."""
+    found = index.entry(kind, entry_id)
+    if found is None:
+        stored = store[kind].get(entry_id)
+        found = SECTIONS[kind]["row"](stored) if stored else None
+    return found
+
+def request_overlay():
+    """Empty index for the rows a bulk request accepts, so they aren't shared before they commit."""
+    overlay = ScheduleIndex()
+    overlay.set_rooms(get_rooms())
+    return overlay
+
+def overlay_conflicts(index, overlay, kind, row):
+    """Conflicts of row with the shared index and with rows accepted earlier in the request."""
+    # The overlay's version of an entry replaces the indexed one
+    shared = [c for c in index.conflicts_for(kind, row) if overlay.entry(c["kind"], c["entry"]["id"]) is None]
+    return shared + overlay.conflicts_for(kind, row)
+
+def bulk_request(section, key):
+    """Parse a bulk JSON body; returns (data, None) or (None, error response)."""
+    if section not in ("timetable", "exams"):
+        return None, (jsonify({"success": False, "message": "Unknown section"}), 404)
+    data = request.get_json(silent=True) or {}
+    items = data.get(key)
+    if not isinstance(items, list) or not items:
+        return None, (jsonify({"success": False, "message": f"{key} must be a non-empty list"}), 400)
+    if len(items) > BULK_MAX_ROWS:
+        return None, (jsonify({"success": False, "message": f"At most {BULK_MAX_ROWS} {key} per request"}), 413)
+    return data, None
+
+@app.route('/api/bulk/<section>', methods=['POST'])
+@login_required
+def bulk_upsert(section):
+    """Create or update many entries: {"rows": [{...}, ...], "dry_run": false}.
+
+    Rows with an "id" update that entry, or create it under that ID if there
+    is none. Every row is validated and checked for conflicts (including
+    against earlier rows of the same request) before anything is written;
+    accepted rows are committed in chunks and only then added to the index.
+    """
+    data, error = bulk_request(section, "rows")
+    if error:
+        return error
+
+    index = get_schedule()
+    overlay = request_overlay()
+    results, accepted = [], []
+    for i, row in enumerate(data["rows"]):
+        if not isinstance(row, dict):
+            results.append({"index": i, "status": "invalid", "errors": ["row must be an object"]})
+            continue
+        entry_id = str(row.get("id") or '').strip() or None
+        entry, errors = validate_entry(section, row, index)
+        if errors:
+            results.append({"index": i, "id": entry_id, "status": "invalid", "errors": errors})
+            continue
+        conflicts = overlay_conflicts(index, overlay, section, {"id": entry_id, **entry})
+        if conflicts:
+            results.append({"index": i, "id": entry_id, "status": "conflict", "conflicts": conflicts})
+            continue
+        doc_id = entry_id or store[section].new_id()
+        previous = (overlay.entry(section, doc_id) or current_entry(index, section, doc_id)) if entry_id else None
+        # Later rows of this request are checked against this one too
+        overlay.upsert(section, {"id": doc_id, **entry})
+        result = {"index": i, "id": doc_id, "status": "updated" if previous else "created"}
+        results.append(result)
+        accepted.append((result, entry, previous))
+
+    if data.get("dry_run"):
+        for result, _, _ in accepted:
+            result["status"] = "valid"
+    elif accepted:
+        ops = [("merge" if previous else "create", result["id"], entry, previous)
+               for result, entry, previous in accepted]
+        failed = store[section].write_many(ops, check=schedule_check(section))
+        for n, (result, entry, _) in enumerate(accepted):
+            if n in failed:
+                result.update(status="error", message=failed[n])
+            else:
+                schedule_index.upsert(section, {"id": result["id"], **entry})
+        collection_cache.invalidate(section)
+
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    ok = all(r["status"] in ("created", "updated", "valid") for r in results)
+    return jsonify({"success": ok, "counts": counts, "results": results}), 200 if ok else 207
+
+@app.route('/api/bulk/<section>', methods=['DELETE'])
+@login_required
+def bulk_delete(section):
+    """Delete many entries: {"ids": [...]}; IDs with no entry are reported as not_found."""
+    data, error = bulk_request(section, "ids")
+    if error:
+        return error
+
+    ids = list(dict.fromkeys(str(i) for i in data["ids"]))
+    index = get_schedule()
+    previous = {entry_id: current_entry(index, section, entry_id) for entry_id in ids}
+    targets = [entry_id for entry_id in ids if previous[entry_id] is not None]
+    failed = store[section].write_many([("delete", entry_id, None, previous[entry_id]) for entry_id in targets])
+    failed = {targets[n]: message for n, message in failed.items()}
+    results = []
+    for entry_id in ids:
+        if previous[entry_id] is None:
+            results.append({"id": entry_id, "status": "not_found"})
+        elif entry_id in failed:
+            results.append({"id": entry_id, "status": "error", "message": failed[entry_id]})
+        else:
+            schedule_index.remove(section, entry_id)
+            results.append({"id": entry_id, "status": "deleted"})
+    if targets:
+        collection_cache.invalidate(section)
+    ok = all(r["status"] == "deleted" for r in results)
+    return jsonify({"success": ok, "results": results}), 200 if ok else 207
+
+@app.route('/api/bulk/<section>/reassign', methods=['POST'])
+@login_required
+def bulk_reassign(section):
+    """Move entries to another room: {"to_room": ..., "from_room": ...} or {"to_room": ..., "ids": [...]}."""
+    if section not in ("timetable", "exams"):
+        return jsonify({"success": False, "message": "Unknown section"}), 404
+    data = request.get_json(silent=True) or {}
+    index = get_schedule()
+    to_room = str(data.get("to_room") or '').strip()
+    if not index.has_room(to_room):
+        return jsonify({"success": False, "message": f"Unknown room {to_room}"}), 400
+    to_room = index.resolve_room(to_room)
+
+    if data.get("ids"):
+        entries = [current_entry(index, section, str(i)) or {"id": str(i)} for i in data["ids"]]
+    elif data.get("from_room"):
+        from_room = index.resolve_room(str(data["from_room"]).strip()).lower()
+        entries = [e for e in index.entries(section) if str(e.get("room", '')).lower() == from_room]
+    else:
+        return jsonify({"success": False, "message": "Give ids or from_room"}), 400
+
+    overlay = request_overlay()
+    results, accepted = [], []
+    for entry in entries:
+        if "room" not in entry:
+            results.append({"id": entry["id"], "status": "not_found"})
+            continue
+        moved = {**entry, "room": to_room}
+        conflicts = overlay_conflicts(index, overlay, section, moved)
+        if conflicts:
+            results.append({"id": entry["id"], "status": "conflict", "conflicts": conflicts})
+            continue
+        overlay.upsert(section, moved)
+        result = {"id": entry["id"], "status": "moved"}
+        results.append(result)
+        accepted.append((result, entry, moved))
+
+    failed = store[section].write_many([("update", entry["id"], {"room": to_room}, entry)
+                                        for _, entry, _ in accepted], check=schedule_check(section))
+    for n, (result, _, moved) in enumerate(accepted):
+        if n in failed:
+            result.update(status="error", message=failed[n])
+        else:
+            schedule_index.upsert(section, moved)
+    if accepted:
+        collection_cache.invalidate(section)
+
+    ok = all(r["status"] == "moved" for r in results)
+    return jsonify({"success": ok, "to_room": to_room, "results": results}), 200 if ok else 207
+
+@app.route('/views/check')
+@login_required
+def views_check():
+    """Compare the per-day/per-room schedule views with timetable and exams (full scan)."""
+    problems = store.check_views()
+    return jsonify({"success": not problems, "count": len(problems), "problems": problems})
+
+
 # ---------------- TIMETABLE ---------------- #
 @app.route('/add_timetable', methods=['POST'])
 @login_required
@@ -253,59 +741,69 @@ def add_timetable():
         flash('Invalid time format (HH:MM).', 'danger')
         return redirect(url_for('admin'))
 
-    existing_ref = db.collection("timetable").where("day", "==", day).where("period", "==", period).limit(1).get()
-    if existing_ref:
+    if store.timetable.find(day=day, period=period, limit=1):
         flash('This time slot already exists!', 'danger')
         return redirect(url_for('admin'))
 
-    db.collection("timetable").add({
+    entry = {
         "day": day,
         "period": period,
         "subject": subject,
         "teacher": teacher,
         "room": room,
         "start_time": start_time,
-        "end_time": end_time,
-        "created_at": firestore.SERVER_TIMESTAMP
-    })
+        "end_time": end_time
+    }
+    conflicts = get_schedule().conflicts_for("timetable", entry)
+    if conflicts:
+        flash(f'Timetable conflict: {describe_conflicts(conflicts)}', 'danger')
+        return redirect(url_for('admin'))
+
+    entry_id = store.timetable.new_id()
+    try:
+        store.timetable.create(entry_id, entry, check=schedule_check("timetable"))
+    except ScheduleConflict as e:
+        flash(f'Timetable conflict: {describe_conflicts(e.conflicts)}', 'danger')
+        return redirect(url_for('admin'))
+    schedule_index.upsert("timetable", {"id": entry_id, **entry})
+    collection_cache.invalidate("timetable")
     flash('Timetable entry added!', 'success')
     return redirect(url_for('admin'))
 
 # ---------------- UTILITY FUNCTIONS ---------------- #
 def get_rooms():
-    """Fetch all rooms from Firestore and return as list of dicts."""
-    rooms_ref = db.collection("rooms").stream()
-    rooms = []
-    for room in rooms_ref:
-        d = room.to_dict()
-        rooms.append({
-            "id": room.id,
-            "name": d.get("name", ""),
-            "video": d.get("video", "")
-        })
-    return rooms
+    """Fetch all rooms from storage (through the shared cache) as list of dicts."""
+    return collection_cache.get("rooms:options", _load_room_options)
+
+def _load_room_options():
+    return [room_row(room) for room in store.rooms.rows(["name", "video"])]
 
 @app.route('/edit_timetable/<entry_id>', methods=['GET', 'POST'])
 @login_required
 def edit_timetable(entry_id):
-    entry_ref = db.collection("timetable").document(entry_id)
-    entry_doc = entry_ref.get()
-    if not entry_doc.exists:
+    entry = store.timetable.get(entry_id)
+    if entry is None:
         flash("Timetable entry not found!", "danger")
         return redirect(url_for('admin'))
-    entry = entry_doc.to_dict()
 
     if request.method == "POST":
-        updated_data = {
-            "day": request.form['day'],
-            "period": request.form['period'],
-            "subject": request.form['subject'],
-            "teacher": request.form['teacher'],
-            "room": request.form['room'],
-            "start_time": request.form['start_time'],
-            "end_time": request.form['end_time']
-        }
-        entry_ref.update(updated_data)
+        index = get_schedule()
+        # Same checks as the bulk API, so an edit can't store a row it would reject
+        updated_data, errors = validate_entry("timetable", request.form, index)
+        if errors:
+            flash(f'Invalid timetable entry: {"; ".join(errors)}', 'danger')
+            return redirect(url_for('edit_timetable', entry_id=entry_id))
+        conflicts = index.conflicts_for("timetable", {"id": entry_id, **updated_data})
+        if conflicts:
+            flash(f'Timetable conflict: {describe_conflicts(conflicts)}', 'danger')
+            return redirect(url_for('edit_timetable', entry_id=entry_id))
+        try:
+            store.timetable.update(entry_id, updated_data, previous=entry, check=schedule_check("timetable"))
+        except ScheduleConflict as e:
+            flash(f'Timetable conflict: {describe_conflicts(e.conflicts)}', 'danger')
+            return redirect(url_for('edit_timetable', entry_id=entry_id))
+        schedule_index.upsert("timetable", {"id": entry_id, **updated_data})
+        collection_cache.invalidate("timetable")
         flash("Timetable updated successfully!", "success")
         return redirect(url_for('admin'))
 
@@ -314,9 +812,11 @@ def edit_timetable(entry_id):
 @app.route('/delete_timetable/<entry_id>', methods=['POST'])
 @login_required
 def delete_timetable(entry_id):
-    entry_ref = db.collection("timetable").document(entry_id).get()
-    if entry_ref.exists:
-        db.collection("timetable").document(entry_id).delete()
+    entry = store.timetable.get(entry_id)
+    if entry is not None:
+        store.timetable.delete(entry_id, previous=entry)
+        schedule_index.remove("timetable", entry_id)
+        collection_cache.invalidate("timetable")
         flash('Timetable entry deleted!', 'success')
     else:
         flash('Timetable not found!', 'danger')
@@ -353,38 +853,56 @@ def add_exam():
         flash('Invalid exam time format.', 'danger')
         return redirect(url_for('admin'))
 
-    db.collection("exams").add({
+    exam = {
         "name": name,
         "date": exam_date.strftime('%Y-%m-%d'),
         "room": room,
         "start_time": start_time,
-        "end_time": end_time,
-        "created_at": firestore.SERVER_TIMESTAMP
-    })
+        "end_time": end_time
+    }
+    conflicts = get_schedule().conflicts_for("exams", exam)
+    if conflicts:
+        flash(f'Exam conflict: {describe_conflicts(conflicts)}', 'danger')
+        return redirect(url_for('admin'))
+
+    exam_id = store.exams.new_id()
+    try:
+        store.exams.create(exam_id, exam, check=schedule_check("exams"))
+    except ScheduleConflict as e:
+        flash(f'Exam conflict: {describe_conflicts(e.conflicts)}', 'danger')
+        return redirect(url_for('admin'))
+    schedule_index.upsert("exams", {"id": exam_id, **exam})
+    collection_cache.invalidate("exams")
     flash('Exam added!', 'success')
     return redirect(url_for('admin'))
 
 @app.route('/edit_exam/<exam_id>', methods=['GET', 'POST'])
 @login_required
 def edit_exam(exam_id):
-    exam_ref = db.collection("exams").document(exam_id)
-    exam_doc = exam_ref.get()
+    exam = store.exams.get(exam_id)
 
-    if not exam_doc.exists:
+    if exam is None:
         flash("Exam not found!", "danger")
         return redirect(url_for('admin'))
 
-    exam = exam_doc.to_dict()
-
     if request.method == "POST":
-        updated_data = {
-            "name": request.form['exam_name'],
-            "date": request.form['exam_date'],
-            "room": request.form['exam_room'],
-            "start_time": request.form['exam_start_time'],
-            "end_time": request.form['exam_end_time']
-        }
-        exam_ref.update(updated_data)
+        index = get_schedule()
+        form = {field: request.form.get(f"exam_{field}") for field in SECTIONS["exams"]["fields"]}
+        updated_data, errors = validate_entry("exams", form, index)
+        if errors:
+            flash(f'Invalid exam: {"; ".join(errors)}', 'danger')
+            return redirect(url_for('edit_exam', exam_id=exam_id))
+        conflicts = index.conflicts_for("exams", {"id": exam_id, **updated_data})
+        if conflicts:
+            flash(f'Exam conflict: {describe_conflicts(conflicts)}', 'danger')
+            return redirect(url_for('edit_exam', exam_id=exam_id))
+        try:
+            store.exams.update(exam_id, updated_data, previous=exam, check=schedule_check("exams"))
+        except ScheduleConflict as e:
+            flash(f'Exam conflict: {describe_conflicts(e.conflicts)}', 'danger')
+            return redirect(url_for('edit_exam', exam_id=exam_id))
+        schedule_index.upsert("exams", {"id": exam_id, **updated_data})
+        collection_cache.invalidate("exams")
         flash("Exam updated successfully!", "success")
         return redirect(url_for('admin'))
 
@@ -394,15 +912,30 @@ def edit_exam(exam_id):
 @app.route('/delete_exam/<exam_id>', methods=['POST'])
 @login_required
 def delete_exam(exam_id):
-    ex_ref = db.collection("exams").document(exam_id).get()
-    if ex_ref.exists:
-        db.collection("exams").document(exam_id).delete()
+    exam = store.exams.get(exam_id)
+    if exam is not None:
+        store.exams.delete(exam_id, previous=exam)
+        schedule_index.remove("exams", exam_id)
+        collection_cache.invalidate("exams")
         flash('Exam deleted!', 'success')
     else:
         flash('Exam not found!', 'danger')
     return redirect(url_for('admin'))
 
 
+# ---------------- BULK EXPORT ---------------- #
+@app.route('/export/<collection>')
+@login_required
+def export_data(collection):
+    if collection not in FIRESTORE_COLLECTIONS:
+        return jsonify({"success": False, "message": "Unknown collection"}), 404
+
+    fmt = 'csv' if request.args.get('format') == 'csv' else 'jsonl'
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_rows(collection, store[collection].stream(), fmt)), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={collection}.{fmt}"})
+
+
 # ---------------- AUTH ---------------- #
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -411,13 +944,28 @@ def login():
         email = data.get('email')
         password = data.get('password')
 
+        allowed, retry_after = login_allowed(request.remote_addr, email)
+        if not allowed:
+            response = jsonify({"success": False, "message": f"Too many login attempts, try again in {retry_after} seconds."})
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
+
         try:
-            user_record = auth.get_user_by_email(email)
-            user_ref = db.collection("users").document(user_record.uid).get()
-            if user_ref.exists and check_password_hash(user_ref.to_dict().get('password',''), password):
-                user_obj = User(user_record.uid, user_ref.to_dict().get('username'), email)
-                login_user(user_obj)
-                return jsonify({"success": True})
+            user_data = store.users.account(email)
+            # Unknown emails are checked against a dummy hash, so the response time doesn't reveal accounts
+            valid, new_hash = hasher.verify(user_data.get('password', '') if user_data else None, password)
+            if not valid:
+                return jsonify({"success": False, "message": "Invalid email or password"}), 401
+            if new_hash:
+                # Upgrade hashes made with an older method or cost
+                store.users.update(user_data["id"], {"password": new_hash})
+            login_succeeded(request.remote_addr, email)
+            claims = user_claims(user_data)
+            remember_user(user_data["id"], claims)
+            login_user(User(user_data["id"], claims['username'], email, claims['role']))
+            return jsonify({"success": True})
+        except PasswordBusy:
+            return jsonify({"success": False, "message": "The server is busy, please try again in a moment."}), 503
         except Exception as e:
             print("Login error:", e)
             return jsonify({"success": False, "message": "Invalid email or password"}), 401
@@ -442,19 +990,15 @@ def signup():
             return redirect(url_for('signup_form'))
 
         try:
-            # Create user in Firebase Auth
-            user_record = auth.create_user(email=email, password=password)
-            user_uid = user_record.uid
-
-            # Save user info in Firestore
-            hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
-            db.collection("users").document(user_uid).set({
+            # Create the account (Firebase Auth, or the local users table) and save user info
+            hashed_password = hasher.hash(password)
+            user_uid = store.users.register(email, password, {
                 "username": name,
                 "email": email,
                 "password": hashed_password,
-                "role": "admin",
-                "created_at": firestore.SERVER_TIMESTAMP
+                "role": "admin"
             })
+            user_cache.discard(f"users:{user_uid}")
 
             # Optional: send welcome email
             send_email(email, "Welcome!", f"Hello {name}, your account is ready!")
@@ -462,7 +1006,7 @@ def signup():
             flash("Registration successful! Please login.", "success")
             return redirect(url_for('login'))
 
-        except firebase_admin.auth.EmailAlreadyExistsError:
+        except AccountExists:
             flash("This email is already registered.", "danger")
             return redirect(url_for('signup_form'))
         except Exception as e:
@@ -481,7 +1025,7 @@ def forgot_password():
         email = data.get('email')
 
         try:
-            reset_link = auth.generate_password_reset_link(email)
+            reset_link = store.users.reset_link(email, url_for('reset_password', _external=True))
             subject = "Password Reset Request - Indoor Navigation System"
             body = f"""
             <html><body>
@@ -500,14 +1044,52 @@ def forgot_password():
     return render_template('forgot_password.html')
 
 
+@app.route('/reset_password', methods=['GET', 'POST'])
+def reset_password():
+    # Only SQLite links land here; Firebase's links open its own page
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        password = data.get('newPassword') or ''
+        if len(password) < 6:
+            return jsonify({"success": False, "message": "Password must be at least 6 characters."}), 400
+        try:
+            user_id = store.users.reset_password(data.get('oobCode'), hasher.hash(password))
+        except PasswordBusy:
+            return jsonify({"success": False, "message": "The server is busy, please try again in a moment."}), 503
+        except StorageError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        invalidate_user(user_id)
+        return jsonify({"success": True, "message": "Password updated. You can log in now."})
+
+    return render_template('reset_password.html', oob_code=request.args.get('oobCode', ''))
+
+
 # ---------------- LOGOUT ---------------- #
 @app.route('/logout')
 @login_required
 def logout():
+    invalidate_user(current_user.id)
     logout_user()
     flash('Logged out successfully!', 'success')
     return redirect(url_for('login'))
 
 
+# ---------------- STARTUP ---------------- #
+def start():
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    transcode_queue.start()
+
+startup = init_startup(app, start, warm={
+    "storage": store.connect,
+    "schedule": get_schedule,
+    "password pool": lambda: hasher.method_prefix,
+})
+
+def create_app(warm=STARTUP_WARM):
+    """Start background workers and warm caches before serving, e.g. gunicorn 'app:create_app()'."""
+    startup.run(warm)
+    return app
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
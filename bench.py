@@ -0,0 +1,432 @@
+"""Load-test and latency benchmark for admin.py, app.py and user.py.
+
+Each app runs in-process against a freshly seeded SQLite ims.db (admin.py) or,
+for app.py and user.py, the storage picked by --backend: an in-memory
+Firestore stand-in (default) or a local SQLite storage file. Its key routes are
+driven by concurrent clients, and the latency percentiles, throughput and
+memory are written to JSON so runs can be compared across versions and backends.
+
+Usage:
+    python bench.py --apps admin app user --rooms 500 --timetable 5000 --exams 300 \\
+        --clients 8 --requests 200 --out bench-results.json
+    python bench.py --baseline bench-results.json --out new.json   # exit 1 on p95 regressions
+    python bench.py --apps app user --backend sqlite --baseline bench-results.json   # SQLite vs Firestore
+    python bench.py --startup --out startup.json   # import, create_app() and first-request latency
+
+The startup benchmark imports each app in a fresh interpreter, cold (started
+by its first request) and warmed by create_app(). firebase_ms is importing
+firebase_admin, which the apps now defer until Firestore is first used.
+"""
+import argparse
+import importlib
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from werkzeug.security import generate_password_hash
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+from schedule import DAYS  # noqa: E402
+
+BENCH_EMAIL = 'bench@example.com'
+BENCH_PASSWORD = 'bench-password'
+BENCH_USER_ID = 'bench-admin'
+SUBJECTS = ['Maths', 'Physics', 'Chemistry', 'Biology', 'English', 'Pharmacology', 'Anatomy']
+SLOTS = [('09:00', '10:00'), ('10:00', '11:00'), ('11:15', '12:15'), ('12:15', '13:15'), ('14:00', '15:00')]
+
+
+# ---------------- SEED DATA ---------------- #
+def make_data(rooms, timetable, exams, seed=42):
+    rnd = random.Random(seed)
+    room_rows = [{"id": f"{rnd.choice('ABCDEFGHIJ')}-{i:04d}", "name": f"ROOM {i}",
+                  "video": f"room_{i}.mp4"} for i in range(rooms)]
+    teachers = [f"Teacher {i}" for i in range(max(rooms // 2, 1))]
+    timetable_rows = []
+    for i in range(timetable):
+        start, end = rnd.choice(SLOTS)
+        timetable_rows.append({
+            "id": f"tt{i}", "day": rnd.choice(DAYS[:5]), "period": str(SLOTS.index((start, end)) + 1),
+            "subject": rnd.choice(SUBJECTS), "teacher": rnd.choice(teachers),
+            "room": rnd.choice(room_rows)["name"], "start_time": start, "end_time": end,
+        })
+    first_day = date.today()
+    exam_rows = [{"id": f"ex{i}", "name": f"{rnd.choice(SUBJECTS)} final",
+                  "date": (first_day + timedelta(days=rnd.randrange(60))).isoformat(),
+                  "room": rnd.choice(room_rows)["name"], "start_time": "09:00", "end_time": "12:00"}
+                 for i in range(exams)]
+    return {"rooms": room_rows, "timetable": timetable_rows, "exams": exam_rows}
+
+
+def patch_firebase(client):
+    """Point firebase_admin at client before app.py/user.py are imported."""
+    import firebase_admin
+    from firebase_admin import auth, credentials, firestore
+
+    client.server_timestamp = firestore.SERVER_TIMESTAMP
+    client.delete_field = firestore.DELETE_FIELD
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    credentials.Certificate = lambda *args, **kwargs: None
+    firestore.client = lambda *args, **kwargs: client
+
+    def get_user_by_email(email):
+        docs = client.collection("users").where("email", "==", email).limit(1).get()
+        if not docs:
+            raise ValueError(f"No user record for {email}")
+        return SimpleNamespace(uid=docs[0].id, email=email)
+    auth.get_user_by_email = get_user_by_email
+
+
+# ---------------- SCENARIOS ---------------- #
+def _video():
+    return (io.BytesIO(b'\0' * 64 * 1024), 'bench.mp4')
+
+
+def admin_scenario(data):
+    import admin
+    admin.create_app()
+    with admin.pool.write() as conn:
+        conn.execute("INSERT OR IGNORE INTO admins (email, password) VALUES (?, ?)",
+                     (BENCH_EMAIL, generate_password_hash(BENCH_PASSWORD)))
+    ids = [r["id"] for r in data["rooms"]]
+    counter = iter(range(10 ** 9))
+
+    def login(client):
+        with client.session_transaction() as session:
+            session['admin'] = BENCH_EMAIL
+
+    return admin.app, login, {
+        "GET /voice_search": lambda c, rnd: c.get('/voice_search', query_string={"q": rnd.choice(ids)[:4]}),
+        "GET /admin": lambda c, rnd: c.get('/admin'),
+        "POST /login": lambda c, rnd: c.post('/login', data={"email": BENCH_EMAIL, "password": BENCH_PASSWORD}),
+        "POST /admin (add room)": lambda c, rnd: c.post('/admin', data={
+            "room_id": f"BENCH-{next(counter)}", "room_name": "Bench room", "video": _video()}),
+    }
+
+
+def app_scenario(data):
+    import app
+    app.create_app()
+    app.store.users.create(BENCH_USER_ID, {
+        "username": "bench", "email": BENCH_EMAIL, "password": generate_password_hash(BENCH_PASSWORD)})
+    counter = iter(range(10 ** 9))
+
+    def login(client):
+        with client.session_transaction() as session:
+            session['_user_id'] = BENCH_USER_ID
+            session['_fresh'] = True
+
+    return app.app, login, {
+        "GET /admin": lambda c, rnd: c.get('/admin'),
+        "GET /api/timetable": lambda c, rnd: c.get('/api/timetable', query_string={"day": rnd.choice(DAYS[:5])}),
+        "POST /login": lambda c, rnd: c.post('/login', json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD}),
+        "POST /add_room": lambda c, rnd: c.post('/add_room', data={
+            "id": f"BENCH-{next(counter)}", "name": f"Bench room {next(counter)}", "video": _video()}),
+    }
+
+
+def user_scenario(data):
+    import user
+    user.create_app()
+    names = [r["name"] for r in data["rooms"]]
+    return user.app, None, {
+        "GET /user": lambda c, rnd: c.get('/user'),
+        "GET /schedule/room": lambda c, rnd: c.get(f'/schedule/room/{rnd.choice(names)}'),
+        "GET /schedule/free": lambda c, rnd: c.get('/schedule/free', query_string={
+            "day": rnd.choice(DAYS[:5]), "start": "10:00", "end": "11:00"}),
+        "GET /tables/timetable": lambda c, rnd: c.get('/tables/timetable', query_string={
+            "q": rnd.choice(SUBJECTS)[:4], "offset": rnd.randrange(0, 200, 25), "html": "1"}),
+    }
+
+
+SCENARIOS = {"admin": admin_scenario, "app": app_scenario, "user": user_scenario}
+
+
+# ---------------- STARTUP ---------------- #
+STARTUP_ROUTES = {"admin": "/user", "app": "/login", "user": "/user"}
+
+
+def seeded_client(args):
+    # Imported here so the startup benchmark doesn't load google.api_core before the app does
+    from fake_firestore import FakeFirestore
+
+    client = FakeFirestore(latency=args.firestore_latency / 1000)
+    data = make_data(args.rooms, args.timetable, args.exams)
+    for name, rows in data.items():
+        client.seed(name, rows)
+    return client, data
+
+
+def seed_storage(data):
+    """Load the seed data into the SQLite storage file prepare_workdir() pointed STORAGE_SQLITE at."""
+    from storage import open_storage
+
+    store = open_storage('sqlite')
+    for name, rows in data.items():
+        store[name].write_many([("merge", row["id"], {k: v for k, v in row.items() if k != "id"}, None)
+                                for row in rows])
+
+
+def startup_child(app_name, warm, args):
+    """Runs in a fresh interpreter: time importing app_name, create_app() and its first requests."""
+    client, data = seeded_client(args)
+    prepare_workdir(data, args.backend)
+    if args.backend == 'sqlite' and app_name != 'admin':
+        seed_storage(data)
+    timings = {"modules_before": len(sys.modules)}
+    started = time.perf_counter()
+    module = importlib.import_module(app_name)
+    timings["import_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    timings["modules_imported"] = len(sys.modules) - timings.pop("modules_before")
+    if app_name != 'admin' and args.backend == 'firestore':
+        started = time.perf_counter()
+        patch_firebase(client)
+        timings["firebase_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    module.app.logger.disabled = True
+    started = time.perf_counter()
+    if warm:
+        module.create_app(warm=True)
+    timings["create_app_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    test_client = module.app.test_client()
+    path = STARTUP_ROUTES[app_name]
+    for name in ("first_request", "second_request"):
+        started = time.perf_counter()
+        status = test_client.get(path).status_code
+        timings[f"{name}_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        timings[f"{name}_status"] = status
+    timings["ready_ms"] = round(timings["import_ms"] + timings.get("firebase_ms", 0) +
+                                timings["create_app_ms"] + timings["first_request_ms"], 1)
+    print(json.dumps(timings))
+
+
+def run_startup(args):
+    """Median startup timings per app, cold and warmed, over args.startup_runs fresh processes."""
+    results = {}
+    for app_name in args.apps:
+        for mode in ("cold", "warm"):
+            runs = []
+            for _ in range(args.startup_runs):
+                cmd = [sys.executable, os.path.abspath(__file__), '--startup-child', app_name,
+                       '--rooms', str(args.rooms), '--timetable', str(args.timetable), '--exams', str(args.exams),
+                       '--firestore-latency', str(args.firestore_latency), '--backend', args.backend] + \
+                      (['--warm'] if mode == 'warm' else [])
+                proc = subprocess.run(cmd, capture_output=True, text=True)
+                if proc.returncode != 0:
+                    print(f"❌ {app_name} ({mode}) failed:\n{proc.stderr[-2000:]}")
+                    break
+                runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            if not runs:
+                continue
+            median = {key: sorted(run[key] for run in runs)[len(runs) // 2] for key in runs[0]}
+            results.setdefault(app_name, {})[mode] = median
+            print(f"{app_name:5} {mode:4}  import {median['import_ms']:>7} ms  "
+                  f"create_app {median['create_app_ms']:>7} ms  first request {median['first_request_ms']:>7} ms  "
+                  f"second {median['second_request_ms']:>6} ms  ready {median['ready_ms']:>7} ms")
+    return results
+
+
+# ---------------- RUNNER ---------------- #
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def max_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_route(flask_app, login, request_fn, clients, requests, warmup):
+    local = threading.local()
+    lock = threading.Lock()
+    latencies, statuses = [], {}
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = flask_app.test_client()
+            local.rnd = random.Random(threading.get_ident())
+            if login:
+                login(local.client)
+        return local.client
+
+    def one(record):
+        c = client()
+        started = time.perf_counter()
+        try:
+            status = request_fn(c, local.rnd).status_code
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = (time.perf_counter() - started) * 1000
+        if record:
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(one, [False] * warmup))
+        started = time.perf_counter()
+        list(pool.map(one, [True] * requests))
+        wall = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(n for s, n in statuses.items() if not s.isdigit() or int(s) >= 500)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": statuses,
+        "rps": round(len(latencies) / wall, 1) if wall else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        "max_ms": round(latencies[-1], 2) if latencies else None,
+    }
+
+
+def prepare_workdir(data, backend='firestore'):
+    """Fresh working directory holding ims.db's seed manifest, a dummy credential and the storage settings."""
+    workdir = tempfile.mkdtemp(prefix='ims-bench-')
+    with open(os.path.join(workdir, 'data.json'), 'w') as f:
+        json.dump(data["rooms"], f)
+    cred = os.path.join(workdir, 'bench-cred.json')
+    with open(cred, 'w') as f:
+        f.write('{}')
+    os.environ.update(FIREBASE_CRED=cred, KIOSK_MODE='live', KIOSK_SNAPSHOT=os.path.join(workdir, 'kiosk.snap'),
+                      STORAGE_BACKEND=backend, STORAGE_SQLITE=os.path.join(workdir, 'store.db'))
+    os.chdir(workdir)
+    return workdir
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print p95 changes against a previous results file; returns the regressed routes."""
+    regressions = []
+    for app_name, app_result in results["apps"].items():
+        for route, stats in app_result["routes"].items():
+            old = baseline.get("apps", {}).get(app_name, {}).get("routes", {}).get(route)
+            if not old or not old.get("p95_ms") or stats["p95_ms"] is None:
+                continue
+            change = (stats["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+            flag = '❌' if change > threshold else '✅'
+            print(f"{flag} {app_name} {route}: p95 {old['p95_ms']} -> {stats['p95_ms']} ms ({change:+.1f}%)")
+            if change > threshold:
+                regressions.append(f"{app_name} {route}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the admin, app and user Flask apps")
+    parser.add_argument('--apps', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--rooms', type=int, default=200)
+    parser.add_argument('--timetable', type=int, default=2000)
+    parser.add_argument('--exams', type=int, default=100)
+    parser.add_argument('--clients', type=int, default=8, help="concurrent clients")
+    parser.add_argument('--requests', type=int, default=200, help="measured requests per route")
+    parser.add_argument('--warmup', type=int, default=20, help="unmeasured requests per route")
+    parser.add_argument('--firestore-latency', type=float, default=2.0,
+                        help="simulated Firestore round trip in ms (default: 2)")
+    parser.add_argument('--backend', choices=['firestore', 'sqlite'], default='firestore',
+                        help="storage behind app.py and user.py (default: firestore)")
+    parser.add_argument('--routes', nargs='*', help="only run routes containing one of these strings")
+    parser.add_argument('--out', default='bench-results.json')
+    parser.add_argument('--baseline', help="previous results file to compare p95 latency against")
+    parser.add_argument('--threshold', type=float, default=20.0, help="p95 regression threshold in percent")
+    parser.add_argument('--startup', action='store_true', help="measure startup instead of request latency")
+    parser.add_argument('--startup-runs', type=int, default=3, help="fresh processes per app and mode")
+    parser.add_argument('--startup-child', choices=list(SCENARIOS), help=argparse.SUPPRESS)
+    parser.add_argument('--warm', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.startup_child:
+        startup_child(args.startup_child, args.warm, args)
+        return
+
+    # Paths are resolved before the benchmark moves into its working directory
+    out_path = os.path.abspath(args.out)
+    baseline_path = args.baseline and os.path.abspath(args.baseline)
+    if args.startup:
+        results = {
+            "version": git_version(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": sys.version.split()[0],
+            "config": {k: v for k, v in vars(args).items() if k not in ('out', 'baseline')},
+            "startup": run_startup(args),
+        }
+        with open(out_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {out_path}")
+        return
+
+    client, data = seeded_client(args)
+    workdir = prepare_workdir(data, args.backend)
+    if {'app', 'user'} & set(args.apps):
+        if args.backend == 'sqlite':
+            seed_storage(data)
+        else:
+            patch_firebase(client)
+
+    results = {
+        "version": git_version(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": sys.version.split()[0],
+        "config": {k: v for k, v in vars(args).items() if k not in ('out', 'baseline')},
+        "workdir": workdir,
+        "apps": {},
+    }
+    for app_name in args.apps:
+        rss_before = max_rss_mb()
+        started = time.perf_counter()
+        flask_app, login, routes = SCENARIOS[app_name](data)
+        flask_app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+        # 5xx responses are counted per route instead of printing every traceback
+        flask_app.logger.disabled = True
+        os.makedirs(flask_app.config['UPLOAD_FOLDER'], exist_ok=True)
+        app_result = {"startup_ms": round((time.perf_counter() - started) * 1000, 1), "routes": {}}
+        for route, request_fn in routes.items():
+            if args.routes and not any(r in route for r in args.routes):
+                continue
+            rpcs = client.rpcs
+            stats = run_route(flask_app, login, request_fn, args.clients, args.requests, args.warmup)
+            stats["firestore_rpcs"] = client.rpcs - rpcs
+            app_result["routes"][route] = stats
+            print(f"{app_name:5} {route:28} p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  "
+                  f"p99 {stats['p99_ms']:>8} ms  {stats['rps']:>8} req/s  errors {stats['errors']}")
+        app_result["max_rss_mb"] = max_rss_mb()
+        app_result["rss_growth_mb"] = round(app_result["max_rss_mb"] - rss_before, 1)
+        results["apps"][app_name] = app_result
+
+    with open(out_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Results written to {out_path}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"❌ p95 regressed by more than {args.threshold}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""Bulk room import/export for the SQLite and Firestore backends.
+
+Usage:
+    python bulk.py import rooms.jsonl [--db ims.db] [--batch-size 1000]
+    python bulk.py export rooms.csv [--db ims.db]
+    python bulk.py import timetable.jsonl --firestore --collection timetable
+    python bulk.py export exams.jsonl --firestore --collection exams
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+from itertools import islice
+
+from search import register_compact
+
+ROOM_FIELDS = ('id', 'name', 'video')
+SQLITE_BATCH_SIZE = 1000
+# Firestore rejects write batches with more than 500 operations
+FIRESTORE_BATCH_SIZE = 500
+FIRESTORE_COLLECTIONS = ('rooms', 'timetable', 'exams')
+
+
+def detect_format(filename, default='jsonl'):
+    ext = os.path.splitext(filename or '')[1].lower()
+    return {'.csv': 'csv', '.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(ext, default)
+
+
+def iter_manifest(stream, fmt):
+    """Yield row dicts from a text stream in jsonl, csv or json (array) format."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'json':
+        # A plain JSON array (like data.json) has to be parsed in one go
+        yield from json.load(stream)
+    else:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _report(count, batches, skipped, started):
+    elapsed = time.perf_counter() - started
+    return {
+        "rows": count,
+        "batches": batches,
+        "skipped": skipped,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(count / elapsed, 1) if elapsed else float(count),
+    }
+
+
+# ---------------- SQLITE ---------------- #
+def import_rooms(conn, rows, batch_size=SQLITE_BATCH_SIZE):
+    """Upsert rooms into SQLite, one transaction per batch."""
+    started = time.perf_counter()
+    count = batches = skipped = 0
+    cursor = conn.cursor()
+    for batch in _batches(rows, batch_size):
+        values = []
+        for row in batch:
+            room_id = str(row.get('id') or '').strip()
+            name = str(row.get('name') or '').strip()
+            if not room_id or not name:
+                skipped += 1
+                continue
+            values.append((room_id, name, row.get('video') or f"room_{room_id}.mp4"))
+        with conn:
+            cursor.executemany('''INSERT INTO rooms (id, name, video) VALUES (?, ?, ?)
+                                  ON CONFLICT(id) DO UPDATE SET name = excluded.name,
+                                                                video = excluded.video''', values)
+        count += len(values)
+        batches += 1
+    return _report(count, batches, skipped, started)
+
+
+def export_rooms(conn, fmt='jsonl', batch_size=SQLITE_BATCH_SIZE, stats=None):
+    """Yield the rooms table as jsonl or csv text chunks without loading it all.
+
+    If given, stats["rows"] is incremented as rows are written.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, name, video FROM rooms ORDER BY id")
+    if fmt == 'csv':
+        yield ','.join(ROOM_FIELDS) + '\r\n'
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        if stats is not None:
+            stats["rows"] = stats.get("rows", 0) + len(rows)
+        yield _encode_rows([dict(zip(ROOM_FIELDS, row)) for row in rows], fmt, ROOM_FIELDS)
+
+
+def _encode_rows(rows, fmt, fields=None):
+    if fmt == 'csv':
+        out = io.StringIO()
+        csv.DictWriter(out, fieldnames=fields, extrasaction='ignore').writerows(rows)
+        return out.getvalue()
+    return ''.join(json.dumps(row, default=str) + '\n' for row in rows)
+
+
+# ---------------- FIRESTORE ---------------- #
+def import_collection(store, collection, rows, batch_size=FIRESTORE_BATCH_SIZE):
+    """Merge documents through a storage.py repository, one revision per batch.
+
+    Going through write_many keeps the change log and schedule views in step, so
+    kiosks pick imported rows up on their next sync. Rows with an "id" keep it as
+    document ID; the rest get a new one.
+    """
+    repo = store[collection]
+    batch_size = min(batch_size, repo.chunk_size)
+    started = time.perf_counter()
+    count = batches = skipped = 0
+    for chunk in _batches(rows, batch_size):
+        ops = []
+        for row in chunk:
+            row = dict(row)
+            doc_id = row.pop('id', None)
+            ops.append(("merge", str(doc_id) if doc_id else repo.new_id(), row, None))
+        failed = repo.write_many(ops)
+        count += len(ops) - len(failed)
+        skipped += len(failed)
+        batches += 1
+    return _report(count, batches, skipped, started)
+
+
+def export_collection(db, collection, fmt='jsonl', fields=None, stats=None):
+    """Yield a Firestore collection as jsonl or csv text, one document at a time."""
+    docs = db.collection(collection).stream()
+    yield from export_rows(collection, ({"id": doc.id, **doc.to_dict()} for doc in docs), fmt, fields, stats)
+
+
+def export_rows(collection, rows, fmt='jsonl', fields=None, stats=None):
+    """Yield row dicts (e.g. from a storage.py repository) as jsonl or csv text."""
+    if fmt == 'csv' and not fields:
+        fields = ['id'] + _collection_fields(collection)
+    if fmt == 'csv':
+        yield ','.join(fields) + '\r\n'
+    for row in rows:
+        if stats is not None:
+            stats["rows"] = stats.get("rows", 0) + 1
+        yield _encode_rows([row], fmt, fields)
+
+
+def _collection_fields(collection):
+    return {
+        'rooms': ['name', 'video'],
+        'timetable': ['day', 'period', 'subject', 'teacher', 'room', 'start_time', 'end_time'],
+        'exams': ['name', 'date', 'room', 'start_time', 'end_time'],
+    }.get(collection, [])
+
+
+def _firestore_storage():
+    from dotenv import load_dotenv
+    from storage import open_storage
+
+    load_dotenv()
+    return open_storage('firestore')
+
+
+def _firestore_client():
+    from dotenv import load_dotenv
+    from clients import firestore_client
+
+    load_dotenv()
+    return firestore_client()
+
+
+# ---------------- CLI ---------------- #
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk room import/export")
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('path', help="manifest file, or - for stdin/stdout")
+    parser.add_argument('--format', choices=['jsonl', 'csv', 'json'])
+    parser.add_argument('--db', default='ims.db', help="SQLite database (default: ims.db)")
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--firestore', action='store_true', help="use Firestore instead of SQLite")
+    parser.add_argument('--collection', default='rooms', choices=FIRESTORE_COLLECTIONS)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detect_format(args.path)
+    if args.action == 'import':
+        stream = sys.stdin if args.path == '-' else open(args.path, newline='', encoding='utf-8')
+        with stream:
+            rows = iter_manifest(stream, fmt)
+            if args.firestore:
+                report = import_collection(_firestore_storage(), args.collection, rows,
+                                           args.batch_size or FIRESTORE_BATCH_SIZE)
+            else:
+                with sqlite3.connect(args.db) as conn:
+                    # The rooms search index triggers call compact()
+                    register_compact(conn)
+                    report = import_rooms(conn, rows, args.batch_size or SQLITE_BATCH_SIZE)
+        print(json.dumps(report), file=sys.stderr)
+        return
+
+    # Exports are written as csv or jsonl
+    fmt = 'csv' if fmt == 'csv' else 'jsonl'
+    started = time.perf_counter()
+    stats = {"rows": 0}
+    out = sys.stdout if args.path == '-' else open(args.path, 'w', newline='', encoding='utf-8')
+    with out:
+        if args.firestore:
+            out.writelines(export_collection(_firestore_client(), args.collection, fmt, stats=stats))
+        else:
+            with sqlite3.connect(args.db) as conn:
+                out.writelines(export_rooms(conn, fmt, stats=stats))
+            conn.close()
+    print(json.dumps(_report(stats["rows"], 0, 0, started)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Cache configuration
+CACHE_TTL = float(os.getenv('CACHE_TTL', 30))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 64))
+
+
+class CollectionCache:
+    """Read-through cache for collection reads with TTL and LRU eviction.
+
+    Keys are collection names ("rooms") or a collection name plus a variant
+    ("rooms:options"), so invalidating a collection drops every variant.
+
+    The cache lives in one process: invalidate() in app.py does not reach
+    user.py's workers. Those drop entries when their change feed sees a new
+    revision (see user.feed_changed) and are otherwise bounded by the TTL.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._watched = set()
+        self._generations = {}      # collection or key -> bumped by invalidate()/discard()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, loader):
+        """Return the cached value for key, calling loader() on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (key in self._watched or entry[0] > now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation(key)
+
+        value = loader()
+        self.set(key, value, generation)
+        return value
+
+    def _generation(self, key):
+        return self._generations.get(key.split(':', 1)[0], 0), self._generations.get(key, 0)
+
+    def set(self, key, value, generation=None):
+        """Store value for key; skipped if key was invalidated since generation was taken."""
+        with self._lock:
+            # A load that started before an invalidate() may hold stale rows
+            if generation is not None and generation != self._generation(key):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *collections):
+        """Drop cached entries for the given collections and their variants."""
+        with self._lock:
+            for collection in collections:
+                self._generations[collection] = self._generations.get(collection, 0) + 1
+            for key in list(self._entries):
+                if key.split(':', 1)[0] in collections and key not in self._watched:
+                    del self._entries[key]
+
+    def discard(self, *keys):
+        """Drop individual keys (e.g. one user) without touching the rest of a collection."""
+        with self._lock:
+            for key in keys:
+                self._generations[key] = self._generations.get(key, 0) + 1
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._watched.clear()
+
+    def watch(self, collection_ref, key, transform):
+        """Keep key warm from a Firestore on_snapshot listener instead of polling.
+
+        transform receives the full list of document snapshots on every change
+        and returns the value to cache. Watched keys never expire by TTL.
+        """
+        def on_snapshot(docs, changes, read_time):
+            self.set(key, transform(docs))
+            with self._lock:
+                self._watched.add(key)
+
+        watch = collection_ref.on_snapshot(on_snapshot)
+        self._listeners.append(watch)
+        return watch
+
+    def unwatch(self):
+        for watch in self._listeners:
+            watch.unsubscribe()
+        self._listeners = []
+        with self._lock:
+            self._watched.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self._entries),
+                "watched": sorted(self._watched),
+                "ttl": self.ttl,
+                "max_entries": self.max_entries,
+            }
+
+
+# Shared instance used by app.py and user.py
+collection_cache = CollectionCache()
@@ -0,0 +1,256 @@
+"""Revisioned change log for rooms, timetable and exams.
+
+Every Firestore write in app.py goes through commit_changes() (storage.py
+calls it), which commits the document writes, one log entry per changed document and the bumped revision
+counter in a single WriteBatch. The counter update is conditional on the
+counter's last update time, so concurrent writers retry instead of sharing a
+revision and revisions follow commit order. Kiosks then ask for everything
+changed since the revision they last saw.
+
+Usage:
+    python changes.py prune --days 7   # drop old log entries; older kiosks reload in full
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+from bulk import FIRESTORE_BATCH_SIZE, _batches, _firestore_client
+from clients import LazyModule, firestore_sentinels
+
+# google.api_core pulls in grpc; only writers need it
+exceptions = LazyModule('google.api_core.exceptions')
+
+CHANGES_COLLECTION = os.getenv('CHANGES_COLLECTION', 'changes')
+META_COLLECTION = 'meta'
+REVISION_DOC = 'revision'
+CHANGE_RETRIES = 8
+SYNC_LIMIT = int(os.getenv('SYNC_LIMIT', 500))          # log entries per /sync response
+SYNC_POLL_INTERVAL = float(os.getenv('SYNC_POLL_INTERVAL', 2))
+FEED_MEMORY = int(os.getenv('FEED_MEMORY', 5000))        # recent changes kept in memory per process
+
+
+def _counter(db):
+    return db.collection(META_COLLECTION).document(REVISION_DOC)
+
+
+def current_revision(db):
+    snap = _counter(db).get()
+    return (snap.to_dict() or {}).get("rev", 0) if snap.exists else 0
+
+
+# ---------------- WRITES ---------------- #
+def commit_changes(db, build):
+    """Commit build(batch, rev)'s writes as the next revision and return it.
+
+    build adds its writes to batch and returns the (collection, doc_id) pairs
+    it changed. It runs again with a fresh batch if another writer took the
+    revision first.
+    """
+    server_timestamp, _ = firestore_sentinels()
+    counter = _counter(db)
+    log = db.collection(CHANGES_COLLECTION)
+    for attempt in range(CHANGE_RETRIES):
+        snap = counter.get()
+        rev = (snap.to_dict() or {}).get("rev", 0) + 1 if snap.exists else 1
+        batch = db.batch()
+        for collection, doc_id in dict.fromkeys(build(batch, rev)):
+            batch.set(log.document(f"{rev:012d}-{collection}-{doc_id}"),
+                      {"rev": rev, "collection": collection, "id": doc_id, "at": server_timestamp})
+        if snap.exists:
+            batch.update(counter, {"rev": rev}, option=db.write_option(last_update_time=snap.update_time))
+        else:
+            batch.create(counter, {"rev": rev, "floor": 0})
+        try:
+            batch.commit()
+            return rev
+        except (exceptions.FailedPrecondition, exceptions.AlreadyExists, exceptions.Conflict):
+            time.sleep(random.uniform(0, 0.02 * 2 ** attempt))
+    raise exceptions.Conflict(f"Could not take a revision after {CHANGE_RETRIES} attempts")
+
+
+# ---------------- READS ---------------- #
+def read_changes(db, since, limit=SYNC_LIMIT):
+    """Log entries after since, cut at a revision boundary.
+
+    Returns (entries, rev, more, reset); reset means since is older than the
+    pruned log, so the caller has to reload everything.
+    """
+    snap = _counter(db).get()
+    meta = (snap.to_dict() or {}) if snap.exists else {}
+    if since < meta.get("floor", 0):
+        return [], meta.get("rev", 0), False, True
+
+    docs = list(db.collection(CHANGES_COLLECTION).where("rev", ">", since)
+                .order_by("rev").limit(limit + 1).stream())
+    entries = [(d.get("rev"), d.get("collection"), d.get("id")) for d in docs]
+    return cut_entries(entries, since, meta.get("rev", 0), limit) + (False,)
+
+
+def cut_entries(entries, since, current, limit):
+    """(entries, rev, more) for up to limit + 1 entries read after since, in revision order."""
+    more = len(entries) > limit
+    if more:
+        # Don't hand out half a revision; one commit never has more than limit entries
+        last = entries[limit][0]
+        entries = [e for e in entries[:limit] if e[0] < last] or entries[:limit]
+        rev = entries[-1][0]
+    else:
+        # Also covers revisions that changed no documents
+        rev = max([since, current] + [e[0] for e in entries[-1:]])
+    return entries, rev, more
+
+
+def resolve(db, entries):
+    """Current snapshot (None once deleted) of every document the entries mention, in one read."""
+    keys = list(dict.fromkeys((collection, doc_id) for _, collection, doc_id in entries))
+    if not keys:
+        return {}
+    # get_all() returns documents in no particular order
+    snaps = db.get_all([db.collection(collection).document(doc_id) for collection, doc_id in keys])
+    found = {(s.reference.parent.id, s.id): s for s in snaps if s.exists}
+    return {key: found.get(key) for key in keys}
+
+
+class ChangeFeed:
+    """Recent changes shared by every kiosk connected to this process.
+
+    The log is polled at most once per interval however many kiosks sync or
+    stream; clients further behind than the in-memory window are served
+    straight from the log. on_change(collections) runs after each poll that
+    found something (e.g. to drop cached collections).
+
+    store is a storage.Storage, so the feed works the same on either backend.
+    """
+
+    def __init__(self, store, load, interval=SYNC_POLL_INTERVAL, memory=FEED_MEMORY, on_change=None):
+        self.store = store
+        self.load = load            # load(collection, stored row) -> row dict
+        self.interval = interval
+        self.memory = memory
+        self.on_change = on_change
+        self.rev = None
+        self._base = None           # every change after _base is in _recent
+        self._recent = deque()      # (rev, collection, doc_id, row or None)
+        self._polled = 0.0
+        self._poll_lock = threading.Lock()
+        self._changed = threading.Condition()
+
+    def poll(self, force=False):
+        """Fetch new log entries, unless another poll ran less than interval ago."""
+        if not force and time.monotonic() - self._polled < self.interval:
+            return
+        if not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            if self.rev is None:
+                self.rev = self._base = self.store.revision()
+            found = set()
+            more = True
+            while more:
+                entries, rev, more, reset = self.store.read_changes(self.rev)
+                if reset:
+                    # The log was pruned past this process; start a new window
+                    with self._changed:
+                        self._recent.clear()
+                        self.rev = self._base = rev
+                    break
+                rows = self._rows(entries)
+                with self._changed:
+                    for entry_rev, collection, doc_id in entries:
+                        self._recent.append((entry_rev, collection, doc_id, rows[(collection, doc_id)]))
+                        found.add(collection)
+                    while len(self._recent) > self.memory:
+                        self._base = self._recent.popleft()[0]
+                    self.rev = rev
+                    self._changed.notify_all()
+            self._polled = time.monotonic()
+        finally:
+            self._poll_lock.release()
+        if found and self.on_change:
+            self.on_change(found)
+
+    def _rows(self, entries):
+        return {key: self.load(key[0], row) if row is not None else None
+                for key, row in self.store.resolve(entries).items()}
+
+    def since(self, rev):
+        """Changes after rev as {"rev", "reset", "more", "changes": {collection: {"upserts", "deletes"}}}."""
+        self.poll()
+        with self._changed:
+            if self._base is not None and rev >= self._base:
+                items = [item for item in self._recent if item[0] > rev]
+                return _delta(items, self.rev, more=False, reset=False)
+        entries, new_rev, more, reset = self.store.read_changes(rev)
+        rows = self._rows(entries)
+        return _delta([(r, c, i, rows[(c, i)]) for r, c, i in entries], new_rev, more, reset)
+
+    def wait(self, rev, timeout):
+        """Block until something after rev is known or timeout passes, then return since(rev)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            self.poll()
+            with self._changed:
+                if self.rev is not None and self.rev > rev:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(min(remaining, self.interval))
+        return self.since(rev)
+
+
+def _delta(items, rev, more, reset):
+    latest = {}
+    for _, collection, doc_id, row in items:
+        latest[(collection, doc_id)] = row
+    changes = {}
+    for (collection, doc_id), row in latest.items():
+        section = changes.setdefault(collection, {"upserts": [], "deletes": []})
+        if row is None:
+            section["deletes"].append(doc_id)
+        else:
+            section["upserts"].append(row)
+    return {"rev": rev, "reset": reset, "more": more, "changes": changes}
+
+
+# ---------------- CLI ---------------- #
+def prune(db, days):
+    """Delete log entries older than days and raise the floor kiosks can sync from."""
+    from datetime import datetime, timedelta, timezone
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    log = db.collection(CHANGES_COLLECTION)
+    old = [(doc.reference, doc.get("rev")) for doc in log.where("at", "<", cutoff).select(["rev"]).stream()]
+    if not old:
+        return {"deleted": 0}
+    floor = max(rev for _, rev in old)
+    # Raise the floor first: a kiosk syncing mid-prune reloads rather than missing deletions
+    _counter(db).update({"floor": floor})
+    for chunk in _batches(old, FIRESTORE_BATCH_SIZE):
+        batch = db.batch()
+        for ref, _ in chunk:
+            batch.delete(ref)
+        batch.commit()
+    return {"deleted": len(old), "floor": floor}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Change log maintenance")
+    parser.add_argument('action', choices=['prune', 'info'])
+    parser.add_argument('--days', type=float, default=7)
+    args = parser.parse_args(argv)
+
+    db = _firestore_client()
+    if args.action == 'prune':
+        print(json.dumps(prune(db, args.days)), file=sys.stderr)
+        return
+    snap = _counter(db).get()
+    print(json.dumps(snap.to_dict() if snap.exists else {"rev": 0, "floor": 0}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Firebase clients created on first use and shared by the whole process.
+
+Importing app.py or user.py doesn't read the credential file, import
+firebase_admin or open a channel; the first Firestore call does, once,
+whichever thread gets there first.
+"""
+import importlib
+import os
+import threading
+
+_lock = threading.Lock()
+_db = None
+
+
+def firebase_app(cred=None):
+    """Initialize firebase_admin once per process.
+
+    cred is the credential file (default FIREBASE_CRED); only the first call's counts.
+    """
+    import firebase_admin
+    from firebase_admin import credentials
+
+    with _lock:
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(cred or os.getenv("FIREBASE_CRED")))
+
+
+def firestore_client(cred=None):
+    """The process's Firestore client, initializing firebase_admin on first use."""
+    global _db
+    if _db is None:
+        firebase_app(cred)
+        with _lock:
+            if _db is None:
+                from firebase_admin import firestore
+                from profiling import instrument_firestore
+
+                client = firestore.client()
+                instrument_firestore()
+                _db = client
+    return _db
+
+
+def firestore_sentinels():
+    """(SERVER_TIMESTAMP, DELETE_FIELD), imported only when a Firestore write needs them."""
+    from firebase_admin import firestore
+    return firestore.SERVER_TIMESTAMP, firestore.DELETE_FIELD
+
+
+class LazyFirestore:
+    """Stands in for the Firestore client; the real one is created on first attribute access."""
+
+    def __init__(self, cred=None):
+        self._cred = cred
+
+    def __getattr__(self, name):
+        return getattr(firestore_client(self._cred), name)
+
+
+class LazyModule:
+    """A module imported on first attribute access, after setup() if given.
+
+    e.g. LazyModule('firebase_admin.auth', setup=firebase_app)
+    """
+
+    def __init__(self, name, setup=None):
+        self._name = name
+        self._setup = setup
+        self._module = None
+
+    def __getattr__(self, name):
+        if self._module is None:
+            if self._setup is not None:
+                self._setup()
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, name)
@@ -0,0 +1,288 @@
+"""In-memory stand-in for the parts of the Firestore client the apps use.
+
+Only meant for benchmarks: queries are evaluated by scanning, and every RPC
+(get, stream, set, update, delete, batch commit) sleeps for `latency` seconds
+to model the network round trip.
+"""
+import copy
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+
+DOCUMENT_ID = '__name__'   # what firestore.FieldPath.document_id() stands for
+
+
+class _Sentinel:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"<{self.name}>"
+
+
+SERVER_TIMESTAMP = _Sentinel('SERVER_TIMESTAMP')
+DELETE_FIELD = _Sentinel('DELETE_FIELD')
+
+_OPS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+def _order_key(value):
+    # Missing fields sort first, like null in Firestore's value ordering
+    return (value is not None, value)
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, fields=None, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+        self._fields = fields
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        data = copy.deepcopy(self._data)
+        return {k: v for k, v in data.items() if k in self._fields} if self._fields is not None else data
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocument:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def parent(self):
+        return FakeCollection(self._client, self._collection)
+
+    def get(self):
+        self._client._rpc()
+        return self._client._snapshot(self)
+
+    def set(self, data, merge=False):
+        self._client._rpc()
+        self._client._write(self._collection, self.id, data, merge=merge)
+
+    def update(self, data):
+        self._client._rpc()
+        self._client._write(self._collection, self.id, data, merge=True, must_exist=True)
+
+    def delete(self):
+        self._client._rpc()
+        self._client._delete(self._collection, self.id)
+
+
+class FakeQuery:
+    def __init__(self, client, collection, filters=(), orders=(), fields=None, limit=None, after=None):
+        self._client = client
+        self._collection = collection
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._fields = fields
+        self._limit = limit
+        self._after = after
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, fields=self._fields,
+                     limit=self._limit, after=self._after)
+        state.update(changes)
+        return FakeQuery(self._client, self._collection, **state)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + [(str(field), op, value)])
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(orders=self._orders + [(str(field), direction == 'DESCENDING')])
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot)
+
+    @staticmethod
+    def _value(doc_id, data, field):
+        return doc_id if field == DOCUMENT_ID else data.get(field)
+
+    def stream(self):
+        self._client._rpc()
+        with self._client._lock:
+            items = [(doc_id, data) for doc_id, data in self._client._docs(self._collection).items()
+                     if all(_OPS[op](self._value(doc_id, data, f), v) for f, op, v in self._filters)]
+            # Stable sorts from the last order_by to the first give the combined ordering
+            for field, descending in reversed(self._orders):
+                items.sort(key=lambda item, f=field: _order_key(self._value(item[0], item[1], f)),
+                           reverse=descending)
+            if self._after is not None:
+                after = next((n for n, (doc_id, _) in enumerate(items) if doc_id == self._after.id), None)
+                if after is not None:
+                    items = items[after + 1:]
+            if self._limit is not None:
+                items = items[:self._limit]
+            ref = FakeCollection(self._client, self._collection)
+            return iter([FakeSnapshot(ref.document(doc_id), data, self._fields) for doc_id, data in items])
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+        self.id = name
+
+    def document(self, doc_id=None):
+        return FakeDocument(self._client, self._collection, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return datetime.now(timezone.utc), ref
+
+    def on_snapshot(self, callback):
+        raise NotImplementedError("listeners are not supported by the fake client")
+
+
+class FakeBatch:
+    """Writes applied atomically on commit, after every precondition has been checked."""
+
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, ref, data, merge=False):
+        self._ops.append((ref, None, lambda: self._client._write(ref._collection, ref.id, data, merge=merge)))
+
+    def create(self, ref, data):
+        self._ops.append((ref, SimpleNamespace(exists=False),
+                          lambda: self._client._write(ref._collection, ref.id, data)))
+
+    def update(self, ref, data, option=None):
+        self._ops.append((ref, option or SimpleNamespace(exists=True),
+                          lambda: self._client._write(ref._collection, ref.id, data, merge=True, must_exist=True)))
+
+    def delete(self, ref):
+        self._ops.append((ref, None, lambda: self._client._delete(ref._collection, ref.id)))
+
+    def commit(self):
+        self._client._rpc()
+        with self._client._lock:
+            for ref, option, _ in self._ops:
+                if option is not None:
+                    self._client._check(ref, option)
+            for _, _, op in self._ops:
+                op()
+        self._ops = []
+
+
+class FakeFirestore:
+    """Thread-safe in-memory Firestore client.
+
+    server_timestamp/delete_field are the sentinels the caller's code writes
+    (pass the real firestore.SERVER_TIMESTAMP/DELETE_FIELD when patching an app).
+    """
+
+    def __init__(self, latency=0.0, server_timestamp=SERVER_TIMESTAMP, delete_field=DELETE_FIELD):
+        self.latency = latency
+        self.server_timestamp = server_timestamp
+        self.delete_field = delete_field
+        self.rpcs = 0
+        self._data = {}
+        self._update_times = {}
+        self._clock = 0
+        self._lock = threading.RLock()
+
+    def _rpc(self):
+        with self._lock:
+            self.rpcs += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _docs(self, collection):
+        return self._data.setdefault(collection, {})
+
+    def _write(self, collection, doc_id, data, merge=False, must_exist=False):
+        with self._lock:
+            docs = self._docs(collection)
+            if must_exist and doc_id not in docs:
+                raise NotFound(f"No document to update: {collection}/{doc_id}")
+            # set(merge=True) merges nested maps key by key; update() replaces top-level fields
+            docs[doc_id] = self._merge(dict(docs.get(doc_id, {})) if merge else {}, data,
+                                       merge and not must_exist)
+            # An opaque, strictly increasing stand-in for the document's update time
+            self._clock += 1
+            self._update_times[(collection, doc_id)] = self._clock
+
+    def _merge(self, doc, data, merge):
+        for key, value in data.items():
+            if value is self.delete_field:
+                doc.pop(key, None)
+            elif value is self.server_timestamp:
+                doc[key] = datetime.now(timezone.utc)
+            elif isinstance(value, dict):
+                current = doc.get(key)
+                doc[key] = self._merge(dict(current) if merge and isinstance(current, dict) else {}, value, merge)
+            else:
+                doc[key] = copy.deepcopy(value)
+        return doc
+
+    def _delete(self, collection, doc_id):
+        with self._lock:
+            self._docs(collection).pop(doc_id, None)
+            self._update_times.pop((collection, doc_id), None)
+
+    def _snapshot(self, ref):
+        with self._lock:
+            return FakeSnapshot(ref, self._docs(ref._collection).get(ref.id),
+                                update_time=self._update_times.get((ref._collection, ref.id)))
+
+    def _check(self, ref, option):
+        exists = ref.id in self._docs(ref._collection)
+        if getattr(option, 'exists', None) is False and exists:
+            raise AlreadyExists(f"Document already exists: {ref._collection}/{ref.id}")
+        if getattr(option, 'exists', None) is True and not exists:
+            raise NotFound(f"No document to update: {ref._collection}/{ref.id}")
+        last_update_time = getattr(option, 'last_update_time', None)
+        if last_update_time is not None and self._update_times.get((ref._collection, ref.id)) != last_update_time:
+            raise FailedPrecondition(f"Document changed since it was read: {ref._collection}/{ref.id}")
+
+    def write_option(self, last_update_time=None, exists=None):
+        return SimpleNamespace(last_update_time=last_update_time, exists=exists)
+
+    def get_all(self, refs):
+        """One RPC for many documents, like the real client's batched get."""
+        self._rpc()
+        return [self._snapshot(ref) for ref in refs]
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def seed(self, collection, rows):
+        """Load rows ({"id": ..., **fields}) without paying the simulated latency."""
+        for row in rows:
+            row = dict(row)
+            self._write(collection, str(row.pop('id', None) or uuid.uuid4().hex[:20]), row)
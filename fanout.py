@@ -0,0 +1,115 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from profiling import recording_into, request_spans
+
+# Fan-out configuration
+FANOUT_TIMEOUT = float(os.getenv('FANOUT_TIMEOUT', 3))
+# Fetches left running past their deadline (each holds a thread); beyond this many,
+# new fetches are degraded straight away instead of starting more threads
+FANOUT_MAX_HUNG = int(os.getenv('FANOUT_MAX_HUNG', 16))
+
+_hung = 0
+_hung_lock = threading.Lock()
+
+
+class FanOutResult:
+    def __init__(self, values, timings, degraded, wall):
+        self.values = values
+        self.timings = timings
+        self.degraded = degraded
+        self.wall = wall
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    @property
+    def sequential(self):
+        """What the same fetches would have cost one after another."""
+        return sum(self.timings.values())
+
+    def server_timing(self):
+        """Server-Timing header value, visible in browser dev tools."""
+        parts = [f"{name};dur={ms:.1f}" for name, ms in self.timings.items()]
+        parts.append(f"fanout;dur={self.wall:.1f};desc=\"wall\"")
+        parts.append(f"fanout-sequential;dur={self.sequential:.1f};desc=\"sum of fetches\"")
+        return ', '.join(parts)
+
+
+def _timed(fn, spans):
+    started = time.perf_counter()
+    with recording_into(spans):
+        value = fn()
+    return value, (time.perf_counter() - started) * 1000
+
+
+def _release(future):
+    global _hung
+    with _hung_lock:
+        _hung -= 1
+
+
+def _abandon(future):
+    """Count a timed-out fetch as hung until it finally returns."""
+    global _hung
+    with _hung_lock:
+        _hung += 1
+    future.add_done_callback(_release)
+
+
+def hung_fetches():
+    return _hung
+
+
+def fetch_all(fetchers, timeout=FANOUT_TIMEOUT, defaults=None):
+    """Run independent fetches concurrently.
+
+    fetchers maps a section name to a zero-argument callable. A fetch that
+    raises or misses the shared deadline is replaced by its default (an empty
+    list unless given in defaults) and listed in result.degraded, so the page
+    can still render the other sections. Fetches run in a copy of the
+    caller's context (Flask app/request context, g) and record their spans
+    into the caller's request. Each call runs on its own pool: a fetch still
+    running at the deadline is left to finish on its thread (counted by
+    hung_fetches()), and while FANOUT_MAX_HUNG are, fetches are not started.
+    """
+    defaults = defaults or {}
+    started = time.perf_counter()
+    deadline = started + timeout
+    spans = request_spans()
+    values, timings, degraded = {}, {}, []
+
+    def degrade(name, ms):
+        values[name] = defaults.get(name, [])
+        timings[name] = ms
+        degraded.append(name)
+
+    if _hung >= FANOUT_MAX_HUNG:
+        print(f"⚠️ {_hung} fetches still hung; skipping {', '.join(fetchers)}")
+        for name in fetchers:
+            degrade(name, 0.0)
+        return FanOutResult(values, timings, degraded, 0.0)
+
+    # A pool per call, so a hung fetch holds only its own thread and never a slot other requests wait on
+    executor = ThreadPoolExecutor(max_workers=max(len(fetchers), 1), thread_name_prefix='fanout')
+    # A context can only be entered by one thread at a time, so each fetch gets its own copy
+    futures = {name: executor.submit(contextvars.copy_context().run, _timed, fn, spans)
+               for name, fn in fetchers.items()}
+    executor.shutdown(wait=False)
+
+    for name, future in futures.items():
+        try:
+            values[name], timings[name] = future.result(timeout=max(deadline - time.perf_counter(), 0))
+        except TimeoutError:
+            if not future.cancel():
+                _abandon(future)
+            print(f"⚠️ {name} fetch timed out after {timeout}s")
+            degrade(name, timeout * 1000)
+        except Exception as e:
+            print(f"❌ {name} fetch failed: {e}")
+            degrade(name, (time.perf_counter() - started) * 1000)
+
+    return FanOutResult(values, timings, degraded, (time.perf_counter() - started) * 1000)
@@ -0,0 +1,221 @@
+"""Denormalized per-day and per-room schedule views kept next to timetable and exams.
+
+Every timetable/exam write also merges the entry into the views it belongs to,
+in the same WriteBatch, so a kiosk loads a day with a single document read:
+
+    day:<Weekday>           timetable entries on that weekday
+    date:<YYYY-MM-DD>       exams on that date
+    room:<room>             the room's weekly timetable
+    room:<room>:<YYYY-Www>  the room's exams in that ISO week
+
+A view document is {"entries": {entry_id: entry}, "updated_at": ...}. Entries
+are merged field by field, so writers never read a view before updating it and
+concurrent edits of different entries don't overwrite each other.
+
+Usage:
+    python materialize.py check      # list views that disagree with the source collections
+    python materialize.py rebuild    # recompute every view (run while nobody is editing)
+
+Readers only trust the views once a rebuild has written the BUILT_MARKER
+document; until then (or for a view that can't be read) they fall back to the
+source collections.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import quote
+
+from bulk import FIRESTORE_BATCH_SIZE, _batches, _collection_fields, _firestore_client
+from clients import firestore_sentinels
+
+VIEWS_COLLECTION = os.getenv('SCHEDULE_VIEWS', 'schedule_views')
+BUILT_MARKER = '_built'
+# An entry belongs to at most two views, and an edit may move it out of two others
+MAX_VIEWS_PER_ENTRY = 4
+# Entries per WriteBatch so that entry, change log and view writes plus the
+# revision counter stay under Firestore's limit
+ENTRIES_PER_BATCH = (FIRESTORE_BATCH_SIZE - 1) // (2 + MAX_VIEWS_PER_ENTRY)
+SORT_KEYS = {
+    "timetable": lambda e: (e.get("start_time", ""), e.get("period", "")),
+    "exams": lambda e: (e.get("date", ""), e.get("start_time", "")),
+}
+
+
+def _text(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    return str(value) if value is not None else ""
+
+
+def entry_fields(kind, row):
+    """The fields of a timetable/exam row stored in its views."""
+    return {field: _text(row.get(field)) for field in _collection_fields(kind)}
+
+
+def room_key(room):
+    # Document IDs can't contain "/"; case and surrounding spaces don't matter for rooms
+    return quote(str(room or '').strip().lower(), safe='')
+
+
+def view_ids(kind, row):
+    """IDs of the view documents a timetable/exam row belongs to."""
+    if not row:
+        return []
+    room = room_key(row.get("room"))
+    if kind == "timetable":
+        day = _text(row.get("day")).strip()
+        return [view for view, ok in ((f"day:{day}", day), (f"room:{room}", room)) if ok]
+    date = _text(row.get("date")).strip()
+    views = [f"date:{date}"] if date else []
+    try:
+        year, week, _ = datetime.strptime(date, '%Y-%m-%d').isocalendar()
+    except ValueError:
+        return views
+    return views + ([f"room:{room}:{year}-W{week:02d}"] if room else [])
+
+
+def week_view_id(room, date):
+    """ID of the view holding room's exams in the ISO week of date."""
+    year, week, _ = date.isocalendar()
+    return f"room:{room_key(room)}:{year}-W{week:02d}"
+
+
+# ---------------- WRITES ---------------- #
+class ViewChanges:
+    """Entry changes grouped by view, written as one merge per view document."""
+
+    def __init__(self):
+        self._views = defaultdict(dict)
+
+    def add(self, kind, entry_id, entry=None, previous=None):
+        """Record that entry_id now holds entry (None when deleted) and used to hold previous."""
+        _, delete_field = firestore_sentinels()
+        current = set(view_ids(kind, entry))
+        for view in current:
+            self._views[view][entry_id] = entry_fields(kind, entry)
+        for view in set(view_ids(kind, previous)) - current:
+            self._views[view][entry_id] = delete_field
+
+    def stage(self, db, batch):
+        """Add the view writes to batch; returns how many were added."""
+        server_timestamp, _ = firestore_sentinels()
+        ref = db.collection(VIEWS_COLLECTION)
+        for view, entries in self._views.items():
+            batch.set(ref.document(view), {"entries": entries, "updated_at": server_timestamp}, merge=True)
+        count = len(self._views)
+        self._views = defaultdict(dict)
+        return count
+
+    def __len__(self):
+        return len(self._views)
+
+
+# ---------------- READS ---------------- #
+def read_view(db, view_id):
+    """Entries of one view as a sorted list of rows, or None if the view doesn't exist."""
+    doc = db.collection(VIEWS_COLLECTION).document(view_id).get()
+    if not doc.exists:
+        return None
+    return rows_from_entries(view_id, (doc.to_dict() or {}).get("entries") or {})
+
+
+def views_built(db):
+    return db.collection(VIEWS_COLLECTION).document(BUILT_MARKER).get().exists
+
+
+def view_kind(view_id):
+    """"exams" for date and room-week views, "timetable" for day and room views."""
+    return "exams" if view_id.startswith("date:") or view_id.count(':') == 2 else "timetable"
+
+
+def rows_from_entries(view_id, entries):
+    return sorted(({"id": entry_id, **entry} for entry_id, entry in entries.items()),
+                  key=SORT_KEYS[view_kind(view_id)])
+
+
+# ---------------- REBUILD / CHECK ---------------- #
+def expected_views(db):
+    """Compute every view from the timetable and exams collections."""
+    views = defaultdict(dict)
+    for kind in ("timetable", "exams"):
+        for doc in db.collection(kind).select(_collection_fields(kind)).stream():
+            row = doc.to_dict() or {}
+            for view in view_ids(kind, row):
+                views[view][doc.id] = entry_fields(kind, row)
+    return views
+
+
+def stored_views(db):
+    return {doc.id: (doc.to_dict() or {}).get("entries") or {}
+            for doc in db.collection(VIEWS_COLLECTION).stream() if doc.id != BUILT_MARKER}
+
+
+def check(db):
+    """Return the views whose entries are missing, extra or out of date."""
+    expected, actual = expected_views(db), stored_views(db)
+    problems = []
+    for view in sorted(set(expected) | set(actual)):
+        want, have = expected.get(view, {}), actual.get(view, {})
+        missing = sorted(set(want) - set(have))
+        extra = sorted(set(have) - set(want))
+        stale = sorted(i for i in set(want) & set(have) if want[i] != have[i])
+        if missing or extra or stale:
+            problems.append({"view": view, "missing": missing, "extra": extra, "stale": stale})
+    return problems
+
+
+def rebuild(db):
+    """Rewrite every view from the source collections and delete views nothing maps to.
+
+    Writes made while this runs can be lost from the views; run check afterwards.
+    """
+    server_timestamp, _ = firestore_sentinels()
+    started = time.perf_counter()
+    expected = expected_views(db)
+    ref = db.collection(VIEWS_COLLECTION)
+    orphans = [doc.id for doc in ref.select(["updated_at"]).stream()
+               if doc.id not in expected and doc.id != BUILT_MARKER]
+    ops = [(view, entries) for view, entries in expected.items()] + [(view, None) for view in orphans]
+    batches = 0
+    for chunk in _batches(ops, FIRESTORE_BATCH_SIZE):
+        batch = db.batch()
+        for view, entries in chunk:
+            if entries is None:
+                batch.delete(ref.document(view))
+            else:
+                batch.set(ref.document(view), {"entries": entries, "updated_at": server_timestamp})
+        batch.commit()
+        batches += 1
+    ref.document(BUILT_MARKER).set({"at": server_timestamp, "views": len(expected)})
+    return {
+        "views": len(expected),
+        "deleted": len(orphans),
+        "entries": sum(len(entries) for entries in expected.values()),
+        "batches": batches,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+# ---------------- CLI ---------------- #
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Materialized schedule views")
+    parser.add_argument('action', choices=['check', 'rebuild'])
+    args = parser.parse_args(argv)
+
+    db = _firestore_client()
+    if args.action == 'rebuild':
+        print(json.dumps(rebuild(db)), file=sys.stderr)
+        return
+    problems = check(db)
+    for problem in problems:
+        print(json.dumps(problem))
+    print(json.dumps({"views_with_problems": len(problems)}), file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from clients import LazyModule
+from profiling import span
+
+# Imported when the first message is sent, not when the app starts
+smtplib = LazyModule('smtplib')
+
+# Outbox configuration
+OUTBOX_DB = os.getenv('OUTBOX_DB', 'outbox.db')
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 2))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))    # messages sent per connection checkout
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = 30        # seconds, doubled on every attempt
+OUTBOX_POLL_INTERVAL = 2
+OUTBOX_STALE_AFTER = 600       # sending messages older than this are assumed lost
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', 20))
+SMTP_IDLE_TIMEOUT = 60         # pooled connections idle longer than this are closed
+# EMAIL_STARTTLS=0 for a local plain-text stand-in such as aiosmtpd
+EMAIL_STARTTLS = os.getenv('EMAIL_STARTTLS', '1').lower() not in ('0', 'false', 'no')
+
+
+class SMTPPool:
+    """Reusable SMTP connections: STARTTLS and login happen once per connection."""
+
+    def __init__(self, host, port, username=None, password=None, starttls=EMAIL_STARTTLS,
+                 timeout=SMTP_TIMEOUT, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._idle = []     # (connection, last used)
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def _connect(self):
+        with span("smtp"):
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                server.starttls()
+            if self.username:
+                server.login(self.username, self.password)
+        self.opened += 1
+        return server
+
+    def acquire(self):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, last_used = self._idle.pop()
+            if now - last_used >= self.idle_timeout:
+                _quit(server)
+                continue
+            # The server may have dropped the connection while it sat idle
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+            server.close()
+        return self._connect()
+
+    def release(self, server, broken=False):
+        if broken:
+            _quit(server)
+            return
+        with self._lock:
+            self._idle.append((server, time.monotonic()))
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            _quit(server)
+
+
+def _quit(server):
+    try:
+        server.quit()
+    except (smtplib.SMTPException, OSError):
+        server.close()
+
+
+class Outbox:
+    """SQLite-backed email queue drained by background threads over pooled SMTP.
+
+    Request handlers only enqueue(); messages survive restarts, are retried
+    with exponential backoff on transient errors, and several web workers can
+    share one outbox because batches are claimed in an IMMEDIATE transaction.
+    """
+
+    def __init__(self, pool, sender, db_path=OUTBOX_DB, workers=OUTBOX_WORKERS, batch_size=OUTBOX_BATCH_SIZE):
+        self.pool = pool
+        self.sender = sender
+        self.db_path = db_path
+        self.workers = workers
+        self.batch_size = batch_size
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._created = False
+
+    @contextmanager
+    def _connect(self):
+        """One transaction on a fresh connection, closed afterwards (sqlite3's own `with` only commits)."""
+        with closing(sqlite3.connect(self.db_path, timeout=10)) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            if not self._created:
+                # Created on first use, so importing an app doesn't create the database
+                with conn:
+                    self._create(conn)
+                self._created = True
+            with conn:
+                yield conn
+
+    def _create(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            recipient TEXT NOT NULL,
+                            subject TEXT NOT NULL,
+                            body TEXT NOT NULL,
+                            status TEXT NOT NULL DEFAULT 'pending',
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            next_attempt_at REAL NOT NULL DEFAULT 0,
+                            error TEXT,
+                            created_at REAL NOT NULL,
+                            claimed_at REAL,
+                            sent_at REAL
+                        )''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, next_attempt_at)")
+
+    def enqueue(self, recipient, subject, body):
+        """Queue one HTML email and return its outbox ID."""
+        return self.enqueue_many([(recipient, subject, body)])[0]
+
+    def enqueue_many(self, messages):
+        """Queue (recipient, subject, body) tuples in one transaction, e.g. for bulk notices."""
+        now = time.time()
+        with self._connect() as conn:
+            ids = [conn.execute("INSERT INTO outbox (recipient, subject, body, created_at) VALUES (?, ?, ?, ?)",
+                                (recipient, subject, body, now)).lastrowid
+                   for recipient, subject, body in messages]
+        self.start()
+        self._wake.set()
+        return ids
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            with self._connect() as conn:
+                conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?",
+                             (time.time() - OUTBOX_STALE_AFTER,))
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'outbox-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            batch = self._claim()
+            if not batch:
+                self._wake.wait(OUTBOX_POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            self._send(batch)
+
+    def _claim(self):
+        """Mark up to batch_size due messages as sending and return them."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute('''SELECT id, recipient, subject, body, attempts FROM outbox
+                                   WHERE status = 'pending' AND next_attempt_at <= ?
+                                   ORDER BY id LIMIT ?''', (now, self.batch_size)).fetchall()
+            conn.executemany("UPDATE outbox SET status = 'sending', attempts = attempts + 1, claimed_at = ? "
+                             "WHERE id = ?", [(now, row[0]) for row in rows])
+        return rows
+
+    def _send(self, batch):
+        try:
+            server = self.pool.acquire()
+        except (smtplib.SMTPException, OSError) as e:
+            print(f"❌ SMTP connection failed: {e}")
+            for message_id, _, _, _, attempts in batch:
+                self._failed(message_id, attempts + 1, e, retry=True)
+            return
+
+        broken = False
+        for message_id, recipient, subject, body, attempts in batch:
+            if broken:
+                # The connection died mid-batch; put the rest back without using an attempt
+                self._requeue(message_id)
+                continue
+            try:
+                with span("smtp"):
+                    server.sendmail(self.sender, recipient, _build(self.sender, recipient, subject, body))
+            except smtplib.SMTPRecipientsRefused as e:
+                self._failed(message_id, attempts + 1, e, retry=False)
+            except smtplib.SMTPResponseException as e:
+                # 4xx replies are temporary (greylisting, rate limits); 5xx are final
+                self._failed(message_id, attempts + 1, e, retry=400 <= e.smtp_code < 500)
+            except smtplib.SMTPServerDisconnected as e:
+                broken = True
+                self._failed(message_id, attempts + 1, e, retry=True)
+            except smtplib.SMTPException as e:
+                self._failed(message_id, attempts + 1, e, retry=False)
+            except OSError as e:
+                broken = True
+                self._failed(message_id, attempts + 1, e, retry=True)
+            else:
+                with self._connect() as conn:
+                    conn.execute("UPDATE outbox SET status = 'sent', error = NULL, sent_at = ? WHERE id = ?",
+                                 (time.time(), message_id))
+                print(f"✅ Email sent to {recipient}")
+        self.pool.release(server, broken=broken)
+
+    def _requeue(self, message_id):
+        with self._connect() as conn:
+            conn.execute("UPDATE outbox SET status = 'pending', attempts = attempts - 1 WHERE id = ?", (message_id,))
+
+    def _failed(self, message_id, attempts, error, retry):
+        with self._connect() as conn:
+            if retry and attempts < OUTBOX_MAX_ATTEMPTS:
+                conn.execute("UPDATE outbox SET status = 'pending', error = ?, next_attempt_at = ? WHERE id = ?",
+                             (str(error), time.time() + OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), message_id))
+            else:
+                conn.execute("UPDATE outbox SET status = 'failed', error = ? WHERE id = ?", (str(error), message_id))
+        print(f"❌ Failed to send email {message_id}: {error}")
+
+    def stats(self):
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return {
+            "pending": counts.get('pending', 0),
+            "sending": counts.get('sending', 0),
+            "sent": counts.get('sent', 0),
+            "failed": counts.get('failed', 0),
+            "connections_opened": self.pool.opened,
+        }
+
+
+def _build(sender, recipient, subject, body):
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    message = MIMEMultipart()
+    message['From'] = sender
+    message['To'] = recipient
+    message['Subject'] = subject
+    message.attach(MIMEText(body, 'html'))
+    return message.as_string()
@@ -0,0 +1,255 @@
+"""Rendered page and fragment cache keyed on data revision.
+
+A page is rendered once per data version, stored together with its gzip and
+brotli encodings, and served with a strong ETag so browsers revalidate with
+If-None-Match and get 304 Not Modified. Pages are assembled from per-section
+fragments cached the same way, so an edit to one section re-renders only that
+section. The store is an in-process LRU, or a directory that every worker on
+the machine shares.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from flask import Response, request, get_template_attribute
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Page cache configuration
+PAGE_CACHE = os.getenv('PAGE_CACHE', 'memory').lower()          # memory, disk or off
+PAGE_CACHE_DIR = os.getenv('PAGE_CACHE_DIR', 'page-cache')
+PAGE_CACHE_MAX_BYTES = int(os.getenv('PAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+PAGE_CACHE_PRUNE_EVERY = 50      # disk writes between size checks
+
+# Table row macros in _user_rows.html, per collection
+ROW_MACROS = {"rooms": "room_row", "timetable": "timetable_row", "exams": "exam_row"}
+
+
+# ---------------- STORES ---------------- #
+class MemoryStore:
+    """Bytes by key, evicting least recently used entries past max_bytes."""
+
+    def __init__(self, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"store": "memory", "entries": len(self._entries), "bytes": self.size}
+
+
+class DiskStore:
+    """One file per key in a directory shared by every worker process.
+
+    Files are written to a temporary name and renamed, so readers never see
+    a partial entry; the oldest files go once the directory grows past max_bytes.
+    """
+
+    def __init__(self, path=PAGE_CACHE_DIR, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._writes = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha256(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        path = self._file(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(value)
+        os.replace(tmp, path)
+        self._writes += 1
+        if self._writes % PAGE_CACHE_PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        files = []
+        for entry in os.scandir(self.path):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        files = [e for e in os.scandir(self.path) if e.is_file()]
+        return {"store": "disk", "path": self.path, "entries": len(files),
+                "bytes": sum(e.stat().st_size for e in files)}
+
+
+class NullStore:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def stats(self):
+        return {"store": "off"}
+
+
+def make_store(kind=PAGE_CACHE):
+    if kind == 'disk':
+        return DiskStore()
+    if kind == 'off':
+        return NullStore()
+    return MemoryStore()
+
+
+# ---------------- CACHE ---------------- #
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=9)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=9, mtime=0)
+    return body
+
+
+def _encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return 'identity'
+
+
+def digest(rows):
+    """Content version for rows that come without a revision (e.g. from a listener)."""
+    return hashlib.sha1(json.dumps(rows, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def init_row_macros(app):
+    """Register what _user_rows.html needs, for every app that compiles its templates."""
+    # Row macros stamp data-sig="{{ row|digest }}" so the page can keep unchanged rows
+    app.add_template_filter(digest, 'digest')
+
+
+def render_rows(collection, rows):
+    """<tr> markup for rows, rendered by the same macros /tables/<name>?html=1 uses."""
+    macro = get_template_attribute('_user_rows.html', ROW_MACROS[collection])
+    return Markup(''.join(str(macro(row)) for row in rows))
+
+
+class PageCache:
+    """Fragments and whole responses per (name, version) for one app.
+
+    namespace keeps apps that share a disk store apart. Template file times are
+    part of every key, so a deploy with changed templates doesn't serve old pages.
+    """
+
+    def __init__(self, app, store=None):
+        self.store = store if store is not None else make_store()
+        self.namespace = app.import_name
+        self._salt = self._template_salt(app)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def _template_salt(app):
+        folder = os.path.join(app.root_path, app.template_folder or 'templates')
+        stamps = []
+        for root, _, files in os.walk(folder):
+            stamps += [f"{name}:{os.stat(os.path.join(root, name)).st_mtime_ns}" for name in sorted(files)]
+        return hashlib.sha1(';'.join(sorted(stamps)).encode()).hexdigest()[:8]
+
+    def _key(self, kind, name, version):
+        return f"{self.namespace}:{self._salt}:{kind}:{name}:{version}"
+
+    def fragment(self, name, version, render):
+        """Markup for fragment name at version; render() runs only on a miss."""
+        key = self._key('fragment', name, version)
+        cached = self.store.get(key)
+        if cached is not None:
+            self.hits += 1
+            return Markup(cached.decode())
+        self.misses += 1
+        html = str(render())
+        self.store.set(key, html.encode())
+        return Markup(html)
+
+    def page(self, name, version, render, headers=None):
+        """Response for page name at version, honoring If-None-Match.
+
+        render() returns the HTML and only runs when this version isn't stored;
+        each encoding is compressed once and kept next to it.
+        """
+        encoding = _encoding()
+        tag = hashlib.sha1(self._key('page', name, version).encode()).hexdigest()[:20]
+        # The same content in another encoding is still not modified for this client
+        if any(request.if_none_match.contains(t) for t in (tag, f"{tag}-gzip", f"{tag}-br")):
+            self.not_modified += 1
+            response = Response(status=304)
+        else:
+            key = self._key('page', name, version)
+            body = self.store.get(f"{key}:{encoding}")
+            if body is None:
+                self.misses += 1
+                identity = self.store.get(f"{key}:identity")
+                if identity is None:
+                    identity = str(render()).encode()
+                    self.store.set(f"{key}:identity", identity)
+                body = _compress(identity, encoding)
+                if encoding != 'identity':
+                    self.store.set(f"{key}:{encoding}", body)
+            else:
+                self.hits += 1
+            response = Response(body, mimetype='text/html')
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(tag if encoding == 'identity' else f"{tag}-{encoding}")
+        response.headers['Vary'] = 'Accept-Encoding'
+        # Always revalidate; a matching ETag costs a 304 and no rendering
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers.update(headers or {})
+        return response
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "not_modified": self.not_modified,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0, **self.store.stats()}
@@ -0,0 +1,184 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import check_password_hash, generate_password_hash
+from profiling import span
+
+# Password hashing configuration
+# Any werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+PASSWORD_METHOD = os.getenv('PASSWORD_METHOD', 'scrypt:32768:8:1')
+PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', max((os.cpu_count() or 2) // 2, 1)))
+# Hashes allowed to wait for a worker; beyond this logins are turned away instead of queueing
+PASSWORD_MAX_PENDING = int(os.getenv('PASSWORD_MAX_PENDING', PASSWORD_WORKERS * 8))
+PASSWORD_TIMEOUT = float(os.getenv('PASSWORD_TIMEOUT', 10))
+
+# Login rate limiting: a bucket of LOGIN_BURST attempts refilled at LOGIN_RATE per minute
+# for each client IP and email pair, and a larger one for each client IP
+LOGIN_RATE = float(os.getenv('LOGIN_RATE', 5))
+LOGIN_BURST = int(os.getenv('LOGIN_BURST', 10))
+LOGIN_IP_RATE = float(os.getenv('LOGIN_IP_RATE', LOGIN_RATE * 6))
+LOGIN_IP_BURST = int(os.getenv('LOGIN_IP_BURST', LOGIN_BURST * 6))
+LOGIN_BUCKETS = 10000
+# Reverse proxies in front of the app; their X-Forwarded-For entries give the client address
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 0))
+
+
+class PasswordBusy(Exception):
+    """Raised when the hashing pool is saturated; callers should answer 503."""
+
+
+# ---------------- WORKER (runs in the process pool) ---------------- #
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(stored_hash, password, method, method_prefix):
+    """Check a password and, if it matches an outdated hash, compute its replacement."""
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    if stored_hash.split('$', 1)[0] != method_prefix:
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+
+# ---------------- POOL ---------------- #
+class PasswordHasher:
+    """Bounded process pool for password hashing, so login storms don't hold the GIL."""
+
+    def __init__(self, method=PASSWORD_METHOD, workers=PASSWORD_WORKERS, max_pending=PASSWORD_MAX_PENDING):
+        self.method = method
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._pool = None
+        self._dummy = None
+        self._lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordBusy("Too many password checks in progress")
+        try:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            with span("password"):
+                return self._pool.submit(fn, *args).result(timeout=PASSWORD_TIMEOUT)
+        except TimeoutError:
+            raise PasswordBusy(f"Password hashing took longer than {PASSWORD_TIMEOUT}s")
+        finally:
+            self._slots.release()
+
+    @property
+    def dummy_hash(self):
+        # A random password hashed with the configured method, checked in place of unknown accounts
+        if self._dummy is None:
+            self._dummy = self._submit(_hash, secrets.token_hex(16), self.method)
+        return self._dummy
+
+    @property
+    def method_prefix(self):
+        # The "method$salt$hash" prefix werkzeug writes for the configured method
+        return self.dummy_hash.split('$', 1)[0]
+
+    def hash(self, password):
+        return self._submit(_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        """Return (valid, new_hash); new_hash is set when the stored hash should be upgraded.
+
+        Without a stored hash (no such account) the dummy hash is checked instead,
+        so the answer takes as long as for a wrong password.
+        """
+        if not stored_hash:
+            self._submit(_verify, self.dummy_hash, password or '', self.method, self.method_prefix)
+            return False, None
+        return self._submit(_verify, stored_hash, password, self.method, self.method_prefix)
+
+
+hasher = PasswordHasher()
+
+
+# ---------------- RATE LIMITING ---------------- #
+class RateLimiter:
+    """Token buckets per key (e.g. IP address), kept for the most recent keys only."""
+
+    def __init__(self, rate_per_minute=LOGIN_RATE, burst=LOGIN_BURST, max_keys=LOGIN_BUCKETS):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, *keys):
+        """Take one token from every key's bucket; returns (allowed, retry_after_seconds)."""
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            for key in keys:
+                if not key:
+                    continue
+                tokens, updated = self._buckets.pop(key, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                buckets.append([key, tokens])
+            allowed = all(tokens >= 1 for _, tokens in buckets)
+            for bucket in buckets:
+                if allowed:
+                    bucket[1] -= 1
+                self._buckets[bucket[0]] = (bucket[1], now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        if allowed:
+            return True, 0
+        wait = max((1 - tokens) / self.rate for _, tokens in buckets if tokens < 1)
+        return False, int(wait) + 1
+
+    def refund(self, *keys):
+        """Give back the token allow() took from each key's bucket."""
+        with self._lock:
+            for key in keys:
+                if key in self._buckets:
+                    tokens, updated = self._buckets[key]
+                    self._buckets[key] = (min(self.burst, tokens + 1), updated)
+
+
+login_limiter = RateLimiter()
+ip_limiter = RateLimiter(LOGIN_IP_RATE, LOGIN_IP_BURST)
+
+
+def init_proxies(app, proxies=TRUSTED_PROXIES):
+    """Make request.remote_addr the client's address behind that many reverse proxies.
+
+    Without this every login behind a proxy shares the proxy's rate-limit bucket.
+    Only X-Forwarded-* headers added by the trusted proxies are used, so clients
+    can't pick their own address.
+    """
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
+
+def _login_keys(ip, email):
+    return f"ip:{ip}", f"login:{ip}:{(email or '').strip().lower()}"
+
+
+def login_allowed(ip, email):
+    """Rate-limit a login attempt by client IP (request.remote_addr, see init_proxies) and email.
+
+    Never by the email alone: failed attempts from elsewhere can't lock its owner out.
+    """
+    ip_key, pair_key = _login_keys(ip, email)
+    allowed, retry_after = login_limiter.allow(pair_key)
+    if allowed:
+        allowed, retry_after = ip_limiter.allow(ip_key)
+        if not allowed:
+            login_limiter.refund(pair_key)
+    return allowed, retry_after
+
+
+def login_succeeded(ip, email):
+    """Refund a successful login's attempt, so only failures use up the limits."""
+    ip_key, pair_key = _login_keys(ip, email)
+    login_limiter.refund(pair_key)
+    ip_limiter.refund(ip_key)
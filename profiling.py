@@ -0,0 +1,304 @@
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from flask import Response, g, request
+
+# Profiling configuration
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))   # seconds between stack samples
+# ?__profile=<PROFILE_TOKEN> profiles a request without an admin session (e.g. on kiosks)
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+# /metrics needs "Authorization: Bearer <METRICS_TOKEN>" (e.g. from Prometheus) or an admin session
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_local = threading.local()
+_spans_lock = threading.Lock()   # a request's spans can be recorded from fan-out threads too
+
+
+# ---------------- METRICS ---------------- #
+class Histogram:
+    """Cumulative-bucket latency histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = defaultdict(lambda: [[0] * len(buckets), 0.0, 0])
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, seconds):
+        with self._lock:
+            counts, _, _ = series = self._series[label_values]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        for label_values, (counts, total, count) in series:
+            labels = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {n}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUESTS = Histogram('ims_request_duration_seconds', 'Request latency by endpoint.',
+                     ('app', 'method', 'endpoint', 'status'))
+SPANS = Histogram('ims_span_duration_seconds', 'Time spent in database, template and external I/O spans.',
+                  ('span',))
+_in_flight = defaultdict(int)
+_in_flight_lock = threading.Lock()
+
+
+# ---------------- SPANS ---------------- #
+def record(name, seconds):
+    """Add a finished span to the histograms and to the current request, if any."""
+    SPANS.observe((name,), seconds)
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        with _spans_lock:
+            entry = spans.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+
+def request_spans():
+    """This thread's per-request span totals (None outside a request), for recording_into()."""
+    return getattr(_local, 'spans', None)
+
+
+@contextmanager
+def recording_into(spans):
+    """Record spans on this thread into another thread's request_spans() totals."""
+    previous = getattr(_local, 'spans', None)
+    _local.spans = spans
+    try:
+        yield
+    finally:
+        _local.spans = previous
+
+
+@contextmanager
+def span(name):
+    """Time a block; nested spans of the same name count once (e.g. get() calling stream())."""
+    active = _local.__dict__.setdefault('active', set())
+    if name in active:
+        yield
+        return
+    active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        active.discard(name)
+        record(name, time.perf_counter() - started)
+
+
+def timed(name):
+    """Decorator form of span()."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _timed_stream(name, iterator):
+    # Only the time spent producing items counts, not the caller's work between them
+    total = 0.0
+    it = iter(iterator)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                total += time.perf_counter() - started
+            yield item
+    finally:
+        record(name, total)
+
+
+def instrument_firestore():
+    """Wrap the Firestore client's RPC methods and to_dict() in spans."""
+    try:
+        from google.cloud.firestore_v1 import batch, document, query
+        from google.cloud.firestore_v1.base_document import DocumentSnapshot
+    except ImportError:
+        return False
+
+    def wrap(cls, method, name):
+        original = getattr(cls, method, None)
+        if original is not None and not getattr(original, '_profiled', False):
+            wrapped = timed(name)(original)
+            wrapped._profiled = True
+            setattr(cls, method, wrapped)
+
+    for method in ('get', 'set', 'update', 'delete', 'create'):
+        wrap(document.DocumentReference, method, 'firestore')
+    wrap(batch.WriteBatch, 'commit', 'firestore')
+    wrap(DocumentSnapshot, 'to_dict', 'firestore.to_dict')
+
+    stream = query.Query.stream
+    if not getattr(stream, '_profiled', False):
+        @wraps(stream)
+        def timed_stream(self, *args, **kwargs):
+            return _timed_stream('firestore', stream(self, *args, **kwargs))
+        timed_stream._profiled = True
+        query.Query.stream = timed_stream
+    return True
+
+
+# ---------------- SAMPLING PROFILER ---------------- #
+class Sampler:
+    """Samples one thread's Python stack and folds the samples for flamegraph.pl/speedscope."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.counts.items()))
+
+
+# ---------------- FLASK INTEGRATION ---------------- #
+def init_profiling(app, is_admin=None):
+    """Record request latency and spans for app, serve /metrics and ?__profile=1.
+
+    is_admin() decides who may request a profile or read /metrics; PROFILE_TOKEN
+    and METRICS_TOKEN also work. Spans are added to the Server-Timing header.
+    """
+    app_name = app.import_name
+
+    from flask import before_render_template, template_rendered
+
+    # A stack, since a template can render another (e.g. a cached fragment) before it finishes
+    def render_started(sender, template, context, **extra):
+        _local.__dict__.setdefault('renders', []).append(time.perf_counter())
+
+    def render_finished(sender, template, context, **extra):
+        renders = getattr(_local, 'renders', None)
+        if renders:
+            record(f"render.{template.name}", time.perf_counter() - renders.pop())
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+    def wants_profile():
+        value = request.args.get('__profile')
+        if not value:
+            return False
+        if PROFILE_TOKEN and value == PROFILE_TOKEN:
+            return True
+        return value == '1' and is_admin is not None and is_admin()
+
+    def metrics_allowed():
+        supplied = request.headers.get('Authorization', '')
+        if METRICS_TOKEN and hmac.compare_digest(supplied, f"Bearer {METRICS_TOKEN}"):
+            return True
+        return is_admin is not None and is_admin()
+
+    @app.before_request
+    def start_request():
+        _local.spans = {}
+        # A render that raised never finished; don't let its start time leak into this request
+        _local.renders = []
+        g.request_started = time.perf_counter()
+        with _in_flight_lock:
+            _in_flight[app_name] += 1
+        if wants_profile():
+            g.profiler = Sampler(threading.get_ident()).start()
+
+    @app.after_request
+    def finish_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUESTS.observe((app_name, request.method, endpoint, str(response.status_code)), elapsed)
+
+        spans = getattr(_local, 'spans', None) or {}
+        if spans:
+            timing = ', '.join(f'{name.replace(".", "-")};dur={total * 1000:.1f};desc="{count}x"'
+                               for name, (count, total) in spans.items())
+            existing = response.headers.get('Server-Timing')
+            response.headers['Server-Timing'] = f"{existing}, {timing}" if existing else timing
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{app_name}-{time.strftime('%Y%m%d-%H%M%S')}-"
+                                             f"{request.endpoint or 'unmatched'}-{threading.get_ident()}.folded")
+            with open(path, 'w') as f:
+                f.write(profiler.folded())
+            response.headers['X-Profile'] = path
+            print(f"✅ Profile written to {path} ({sum(profiler.counts.values())} samples)")
+        return response
+
+    @app.teardown_request
+    def end_request(exc):
+        _local.spans = None
+        if g.pop('request_started', None) is not None:
+            with _in_flight_lock:
+                _in_flight[app_name] -= 1
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+
+    @app.route('/metrics')
+    def metrics():
+        if not metrics_allowed():
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        lines = REQUESTS.expose() + SPANS.expose()
+        lines += ["# HELP ims_requests_in_flight Requests currently being handled.",
+                  "# TYPE ims_requests_in_flight gauge"]
+        with _in_flight_lock:
+            lines += [f'ims_requests_in_flight{{app="{name}"}} {n}' for name, n in sorted(_in_flight.items())]
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
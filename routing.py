@@ -0,0 +1,322 @@
+import heapq
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Routing configuration
+ROUTE_ENTRANCE = os.getenv('ROUTE_ENTRANCE', 'ENTRANCE')
+ROUTE_LANDMARKS = int(os.getenv('ROUTE_LANDMARKS', 8))
+# Graphs up to this many nodes get every shortest-path tree precomputed;
+# larger ones use A* with landmark (ALT) lower bounds instead.
+ROUTE_ALL_PAIRS_LIMIT = int(os.getenv('ROUTE_ALL_PAIRS_LIMIT', 500))
+ROUTE_CACHE_SIZE = int(os.getenv('ROUTE_CACHE_SIZE', 4096))
+# Seconds between graph revision checks; an import elsewhere shows up within this
+ROUTE_REVISION_TTL = float(os.getenv('ROUTE_REVISION_TTL', 2))
+
+NODE_KINDS = ('room', 'corridor', 'junction', 'stairs', 'lift', 'entrance')
+EDGE_KINDS = ('walk', 'stairs', 'lift')
+INF = float('inf')
+
+
+def init_routing(conn):
+    """Create the building graph tables: nodes keyed by room ID plus directed edges.
+
+    The graph's revision is the 'nav' row of the database's revisions table,
+    which init_db creates.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS nav_nodes (
+                        id TEXT PRIMARY KEY,
+                        kind TEXT NOT NULL DEFAULT 'corridor',
+                        floor INTEGER NOT NULL DEFAULT 0,
+                        x REAL,
+                        y REAL,
+                        label TEXT
+                      )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS nav_edges (
+                        src TEXT NOT NULL,
+                        dst TEXT NOT NULL,
+                        weight REAL NOT NULL,
+                        kind TEXT NOT NULL DEFAULT 'walk',
+                        video TEXT,
+                        instruction TEXT,
+                        PRIMARY KEY (src, dst)
+                      )''')
+    # Bumped by import_graph(), so every process's Router notices a new graph
+    cursor.execute("INSERT OR IGNORE INTO revisions (name, rev) VALUES ('nav', 0)")
+    conn.commit()
+
+
+def graph_revision(conn):
+    row = conn.execute("SELECT rev FROM revisions WHERE name = 'nav'").fetchone()
+    return row[0] if row else 0
+
+
+def import_graph(conn, data):
+    """Replace the building graph with data = {"nodes": [...], "edges": [...]}.
+
+    Edges are walkable in both directions unless "oneway" is set; the way back
+    can have its own "reverse_video"/"reverse_instruction". A missing weight
+    defaults to the straight-line distance between the two nodes, which then
+    both need x and y.
+    """
+    nodes, edges = [], []
+    for n in data.get("nodes", []):
+        kind = n.get("kind", "corridor")
+        if kind not in NODE_KINDS:
+            raise ValueError(f"unknown node kind {kind!r} for {n['id']}")
+        nodes.append((str(n["id"]).strip(), kind, int(n.get("floor", 0)), n.get("x"), n.get("y"), n.get("label")))
+
+    coords = {n[0]: (n[3], n[4]) for n in nodes}
+    for e in data.get("edges", []):
+        src, dst = str(e["from"]).strip(), str(e["to"]).strip()
+        for end in (src, dst):
+            if end not in coords:
+                raise ValueError(f"edge {src} -> {dst} references unknown node {end}")
+        kind = e.get("kind", "walk")
+        if kind not in EDGE_KINDS:
+            raise ValueError(f"unknown edge kind {kind!r} for {src} -> {dst}")
+        if e.get("weight") is not None:
+            weight = float(e["weight"])
+        else:
+            for end in (src, dst):
+                if None in coords[end]:
+                    raise ValueError(f"edge {src} -> {dst} has no weight and node {end} has no x/y")
+            weight = math.dist(coords[src], coords[dst])
+        if weight < 0:
+            raise ValueError(f"negative weight for {src} -> {dst}")
+        edges.append((src, dst, weight, kind, e.get("video"), e.get("instruction")))
+        if not e.get("oneway"):
+            edges.append((dst, src, weight, kind, e.get("reverse_video"), e.get("reverse_instruction")))
+
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM nav_edges")
+    cursor.execute("DELETE FROM nav_nodes")
+    cursor.executemany("INSERT INTO nav_nodes (id, kind, floor, x, y, label) VALUES (?, ?, ?, ?, ?, ?)", nodes)
+    cursor.executemany('''INSERT OR REPLACE INTO nav_edges (src, dst, weight, kind, video, instruction)
+                          VALUES (?, ?, ?, ?, ?, ?)''', edges)
+    cursor.execute("UPDATE revisions SET rev = rev + 1 WHERE name = 'nav'")
+    return {"nodes": len(nodes), "edges": len(edges)}
+
+
+def load_graph(conn):
+    cursor = conn.cursor()
+    nodes = [dict(zip(("id", "kind", "floor", "x", "y", "label"), row))
+             for row in cursor.execute("SELECT id, kind, floor, x, y, label FROM nav_nodes")]
+    edges = [dict(zip(("src", "dst", "weight", "kind", "video", "instruction"), row))
+             for row in cursor.execute("SELECT src, dst, weight, kind, video, instruction FROM nav_edges")]
+    return Graph(nodes, edges)
+
+
+def _dijkstra(adj, source):
+    """Distances and predecessors from source over an adjacency list of (node, weight)."""
+    dist = [INF] * len(adj)
+    parent = [-1] * len(adj)
+    dist[source] = 0
+    heap = [(0, source)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        for v, w in adj[u]:
+            nd = d + w
+            if nd < dist[v]:
+                dist[v] = nd
+                parent[v] = u
+                heapq.heappush(heap, (nd, v))
+    return dist, parent
+
+
+class Graph:
+    """Weighted, directed building graph with precomputed shortest-path data.
+
+    prepare() either stores a shortest-path tree from every node (small
+    buildings: a query is a walk up the parent array) or distances to and
+    from a few far-apart landmarks, which give A* tight admissible bounds.
+    Answers are kept in an LRU cache.
+    """
+
+    def __init__(self, nodes, edges):
+        self.nodes = nodes
+        self.ids = [n["id"] for n in nodes]
+        self.index = {node_id: i for i, node_id in enumerate(self.ids)}
+        self._folded = {node_id.casefold(): i for i, node_id in enumerate(self.ids)}
+        self.adj = [[] for _ in nodes]
+        self.radj = [[] for _ in nodes]
+        self.edges = {}
+        for e in edges:
+            u, v = self.index[e["src"]], self.index[e["dst"]]
+            self.adj[u].append((v, e["weight"]))
+            self.radj[v].append((u, e["weight"]))
+            self.edges[(u, v)] = e
+        self._trees = None
+        self._landmarks = []
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def resolve(self, node_id):
+        node_id = str(node_id or '').strip()
+        i = self.index.get(node_id)
+        return i if i is not None else self._folded.get(node_id.casefold())
+
+    # ---------------- PRECOMPUTATION ---------------- #
+    def prepare(self):
+        if len(self) <= ROUTE_ALL_PAIRS_LIMIT:
+            self._trees = [_dijkstra(self.adj, i) for i in range(len(self))]
+        else:
+            self._landmarks = self._pick_landmarks(ROUTE_LANDMARKS)
+        return self
+
+    def _pick_landmarks(self, count):
+        """Farthest-point selection: each landmark is the node worst served by the previous ones."""
+        landmarks = []
+        closest = [INF] * len(self)
+        current = 0
+        for _ in range(min(count, len(self))):
+            from_l, _ = _dijkstra(self.adj, current)
+            to_l, _ = _dijkstra(self.radj, current)
+            landmarks.append((from_l, to_l))
+            closest = [min(c, f) for c, f in zip(closest, from_l)]
+            reachable = [(c, i) for i, c in enumerate(closest) if c != INF]
+            current = max(reachable)[1] if reachable else 0
+        return landmarks
+
+    def _heuristic(self, target):
+        bounds = [(from_l, to_l, from_l[target], to_l[target]) for from_l, to_l in self._landmarks]
+
+        def h(v):
+            best = 0
+            for from_l, to_l, from_t, to_t in bounds:
+                # Triangle inequality: d(v,t) >= d(L,t) - d(L,v) and d(v,t) >= d(v,L) - d(t,L)
+                if from_t != INF and from_l[v] != INF:
+                    best = max(best, from_t - from_l[v])
+                if to_l[v] != INF and to_t != INF:
+                    best = max(best, to_l[v] - to_t)
+            return best
+        return h
+
+    # ---------------- QUERIES ---------------- #
+    def _astar(self, source, target):
+        h = self._heuristic(target)
+        dist = {source: 0}
+        parent = {source: -1}
+        heap = [(h(source), 0, source)]
+        while heap:
+            _, d, u = heapq.heappop(heap)
+            if u == target:
+                break
+            if d > dist[u]:
+                continue
+            for v, w in self.adj[u]:
+                nd = d + w
+                if nd < dist.get(v, INF):
+                    dist[v] = nd
+                    parent[v] = u
+                    heapq.heappush(heap, (nd + h(v), nd, v))
+        if target not in dist:
+            return None
+        return dist[target], self._walk(parent.get, source, target)
+
+    @staticmethod
+    def _walk(parent_of, source, target):
+        path = [target]
+        while path[-1] != source:
+            path.append(parent_of(path[-1]))
+        return path[::-1]
+
+    def shortest_path(self, source_id, target_id):
+        """(cost, [node IDs]) of the cheapest route, or None if unreachable/unknown."""
+        s, t = self.resolve(source_id), self.resolve(target_id)
+        if s is None or t is None:
+            return None
+        with self._lock:
+            if (s, t) in self._cache:
+                self._cache.move_to_end((s, t))
+                return self._cache[(s, t)]
+
+        if self._trees is not None:
+            dist, parent = self._trees[s]
+            found = None if dist[t] == INF else (dist[t], self._walk(parent.__getitem__, s, t))
+        else:
+            found = self._astar(s, t)
+        if found is not None:
+            found = (found[0], [self.ids[i] for i in found[1]])
+
+        with self._lock:
+            self._cache[(s, t)] = found
+            if len(self._cache) > ROUTE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return found
+
+    def route(self, source_id, target_id):
+        """Ordered steps (one per edge, each with its video segment) from source to target."""
+        found = self.shortest_path(source_id, target_id)
+        if found is None:
+            return None
+        cost, path = found
+        steps = []
+        for a, b in zip(path, path[1:]):
+            edge = self.edges[(self.index[a], self.index[b])]
+            node = self.nodes[self.index[b]]
+            steps.append({
+                "from": a,
+                "to": b,
+                "kind": edge["kind"],
+                "distance": edge["weight"],
+                "floor": node["floor"],
+                "video": edge["video"],
+                "instruction": edge["instruction"] or f"Go to {node['label'] or b}",
+            })
+        return {"from": path[0], "to": path[-1], "distance": cost, "steps": steps}
+
+
+class Router:
+    """Holds the prepared graph for the app, rebuilt lazily when it changes.
+
+    revision() (e.g. graph_revision) is checked at most every ttl seconds, so
+    an import in another worker is picked up within that without a query per
+    route; invalidate() only affects this process and re-checks right away.
+    """
+
+    def __init__(self, loader, revision=None, ttl=ROUTE_REVISION_TTL):
+        self._loader = loader
+        self._revision = revision
+        self._ttl = ttl
+        self._checked = -INF
+        self._seen = None
+        self._graph = None
+        self._rev = None
+        self._lock = threading.Lock()
+
+    def _current_revision(self):
+        if self._revision is None:
+            return None
+        now = time.monotonic()
+        if now - self._checked >= self._ttl:
+            self._seen, self._checked = self._revision(), now
+        return self._seen
+
+    def graph(self):
+        rev = self._current_revision()
+        graph = self._graph
+        if graph is None or rev != self._rev:
+            with self._lock:
+                if self._graph is None or rev != self._rev:
+                    self._graph = self._loader().prepare()
+                    self._rev = rev
+                    print(f"✅ Navigation graph ready: {len(self._graph)} nodes")
+                graph = self._graph
+        return graph
+
+    def invalidate(self):
+        self._graph = None
+        self._checked = -INF
+
+    def route(self, source_id, target_id):
+        return self.graph().route(source_id, target_id)
+
@@ -0,0 +1,397 @@
+import heapq
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from datetime import datetime
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MINUTES_PER_DAY = 24 * 60
+INF = float('inf')
+
+
+def to_minutes(value):
+    """'HH:MM' -> minutes since midnight, or None if malformed."""
+    try:
+        hours, minutes = str(value).split(':')[:2]
+        return int(hours) * 60 + int(minutes)
+    except (TypeError, ValueError):
+        return None
+
+
+def week_minute(day, time_str):
+    """Minutes since Monday 00:00 for a timetable day/time, or None."""
+    minutes = to_minutes(time_str)
+    if day not in DAYS or minutes is None:
+        return None
+    return DAYS.index(day) * MINUTES_PER_DAY + minutes
+
+
+def absolute_minute(date_str, time_str):
+    """Minutes since 0001-01-01 for an exam date/time, or None."""
+    minutes = to_minutes(time_str)
+    try:
+        ordinal = datetime.strptime(str(date_str)[:10], '%Y-%m-%d').toordinal()
+    except ValueError:
+        return None
+    if minutes is None:
+        return None
+    return ordinal * MINUTES_PER_DAY + minutes
+
+
+def _key(value):
+    return str(value or '').strip().lower()
+
+
+class Timeline:
+    """Intervals sorted by start, with a max-end segment tree over them.
+
+    at(), overlaps() and overlapping() only descend into subtrees whose latest
+    end reaches the query, so they cost O((k + 1) log n) for k results even
+    with a long interval early on; next_after() is a binary search. add and
+    remove keep the list sorted and note the change against the tree, which
+    queries scan alongside it; the tree is rebuilt only once about sqrt(n)
+    changes have piled up, so a batch of edits costs one rebuild.
+    """
+
+    def __init__(self):
+        self.items = []      # (start, end, entry_id), sorted
+        self._built = []     # items as of the last build, the tree's leaves
+        self._tree = None    # max end per node over _built
+        self._size = 0
+        self._added = []     # items added since the build
+        self._removed = set()  # items of _built removed since
+
+    def _stale(self):
+        pending = len(self._added) + len(self._removed)
+        return self._tree is None or pending * pending > max(len(self.items), 1024)
+
+    def _build(self):
+        size = 1
+        while size < len(self.items):
+            size *= 2
+        tree = [-INF] * (2 * size)
+        for i, (_, end, _) in enumerate(self.items):
+            tree[size + i] = end
+        for node in range(size - 1, 0, -1):
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+        self._built, self._tree, self._size = list(self.items), tree, size
+        self._added, self._removed = [], set()
+
+    def _ending_after(self, bound, t, first=False):
+        """Items sorting before bound whose interval ends after t, in order (only the first if first)."""
+        if self._stale():
+            self._build()
+        built, tree, size, removed = self._built, self._tree, self._size, self._removed
+        hi = bisect_left(built, bound)
+        found = []
+        stack = [(1, 0, size)]
+        while stack:
+            node, lo, node_hi = stack.pop()
+            if lo >= hi or tree[node] <= t:
+                continue
+            if node >= size:
+                if built[lo] not in removed:
+                    found.append(built[lo])
+                    if first:
+                        break
+                continue
+            mid = (lo + node_hi) // 2
+            stack.append((2 * node + 1, mid, node_hi))
+            stack.append((2 * node, lo, mid))
+        extra = [item for item in self._added if item < bound and item[1] > t]
+        if not extra:
+            return found
+        found = sorted(found + extra)
+        return found[:1] if first else found
+
+    @classmethod
+    def from_sorted(cls, items):
+        """A timeline over items already sorted by (start, end, entry_id)."""
+        timeline = cls()
+        timeline.items = list(items)
+        return timeline
+
+    def add(self, start, end, entry_id):
+        item = (start, end, entry_id)
+        insort(self.items, item)
+        if item in self._removed:
+            self._removed.discard(item)
+        else:
+            self._added.append(item)
+
+    def remove(self, start, end, entry_id):
+        item = (start, end, entry_id)
+        i = bisect_left(self.items, item)
+        if i < len(self.items) and self.items[i] == item:
+            del self.items[i]
+            if item in self._added:
+                self._added.remove(item)
+            else:
+                self._removed.add(item)
+
+    def at(self, t):
+        """Entry IDs whose interval contains t."""
+        return [item[2] for item in self._ending_after((t, INF, ''), t)]
+
+    def next_after(self, t):
+        """First interval starting after t, or None."""
+        i = bisect_right(self.items, (t, INF, ''))
+        return self.items[i] if i < len(self.items) else None
+
+    def first(self):
+        return self.items[0] if self.items else None
+
+    def overlaps(self, start, end):
+        """Whether any interval intersects [start, end)."""
+        return bool(self._ending_after((end, -1, ''), start, first=True))
+
+    def overlapping(self, start, end):
+        """Entry IDs of intervals intersecting [start, end)."""
+        return [item[2] for item in self._ending_after((end, -1, ''), start)]
+
+
+def sweep_overlaps(intervals):
+    """Yield (id_a, id_b) for every overlapping pair among (start, end, id) tuples.
+
+    Sort + sweep with a min-heap of active end times: O(n log n + conflicts)
+    instead of comparing every pair.
+    """
+    active = []
+    for start, end, entry_id in sorted(intervals):
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for _, other_id in active:
+            yield other_id, entry_id
+        heapq.heappush(active, (end, entry_id))
+
+
+class ScheduleIndex:
+    """Room/teacher lookup index over the timetable and exams collections.
+
+    Timetable entries live on a weekly timeline (minutes since Monday 00:00)
+    per room and per teacher; exams on an absolute timeline per room. sync()
+    diffs a fresh collection read against what is indexed and applies only
+    the added, changed and removed entries.
+    """
+
+    # Timeline groups: name -> (kind of entry, attribute)
+    TIMELINES = {"room": ("timetable", "_by_room"), "teacher": ("timetable", "_by_teacher"),
+                 "exams": ("exams", "_exams_by_room")}
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {"timetable": {}, "exams": {}}
+        self._synced = {}
+        self._rooms = {}
+        self._by_room = defaultdict(Timeline)
+        self._by_teacher = defaultdict(Timeline)
+        self._exams_by_room = defaultdict(Timeline)
+
+    # ---------------- MAINTENANCE ---------------- #
+    def set_rooms(self, rooms):
+        """Let entries and lookups use either a room ID ("J-307") or its name ("HOD ROOM")."""
+        mapping = {}
+        for room in rooms:
+            name = room.get("name") or room["id"]
+            mapping[_key(room["id"])] = name
+            mapping[_key(name)] = name
+        with self._lock:
+            if mapping == self._rooms:
+                return
+            # Entries are placed on their room's timeline by resolved name, so re-place them
+            entries = {kind: list(rows.values()) for kind, rows in self._entries.items()}
+            for kind, rows in entries.items():
+                for row in rows:
+                    self.remove(kind, row["id"])
+            self._rooms = mapping
+            for kind, rows in entries.items():
+                for row in rows:
+                    self.upsert(kind, row)
+
+    def resolve_room(self, room):
+        return self._rooms.get(_key(room), room)
+
+    def has_room(self, room):
+        return _key(room) in self._rooms
+
+    def entry(self, kind, entry_id):
+        with self._lock:
+            return self._entries[kind].get(entry_id)
+
+    def entries(self, kind):
+        with self._lock:
+            return list(self._entries[kind].values())
+
+    def sync(self, kind, rows):
+        """Bring one collection up to date with rows (a list of entry dicts)."""
+        with self._lock:
+            if self._synced.get(kind) is rows:
+                return
+            current = self._entries[kind]
+            fresh = {row["id"]: row for row in rows}
+            for entry_id in [i for i in current if i not in fresh]:
+                self.remove(kind, entry_id)
+            for entry_id, row in fresh.items():
+                if current.get(entry_id) != row:
+                    self.upsert(kind, row)
+            self._synced[kind] = rows
+
+    def upsert(self, kind, row):
+        with self._lock:
+            self.remove(kind, row["id"])
+            self._entries[kind][row["id"]] = row
+            for timeline, start, end in self._placements(kind, row):
+                timeline.add(start, end, row["id"])
+
+    def remove(self, kind, entry_id):
+        with self._lock:
+            row = self._entries[kind].pop(entry_id, None)
+            if row is not None:
+                for timeline, start, end in self._placements(kind, row):
+                    timeline.remove(start, end, entry_id)
+
+    def _placements(self, kind, row):
+        if kind == "timetable":
+            start = week_minute(row.get("day"), row.get("start_time"))
+            end = week_minute(row.get("day"), row.get("end_time"))
+            if start is None or end is None or end <= start:
+                return []
+            return [(self._by_room[_key(self.resolve_room(row.get("room")))], start, end),
+                    (self._by_teacher[_key(row.get("teacher"))], start, end)]
+        start = absolute_minute(row.get("date"), row.get("start_time"))
+        end = absolute_minute(row.get("date"), row.get("end_time"))
+        if start is None or end is None or end <= start:
+            return []
+        return [(self._exams_by_room[_key(self.resolve_room(row.get("room")))], start, end)]
+
+    # ---------------- PERSISTENCE ---------------- #
+    def timelines(self):
+        """[(group, key, items)] for every non-empty timeline, items in query order."""
+        with self._lock:
+            return [(group, key, list(timeline.items))
+                    for group, (_, attr) in self.TIMELINES.items()
+                    for key, timeline in getattr(self, attr).items() if timeline.items]
+
+    @classmethod
+    def restore(cls, rooms, entries, timelines):
+        """An index over entries ({kind: rows}) placed as timelines() saved them, without re-placing."""
+        index = cls()
+        index.set_rooms(rooms)
+        for kind, rows in entries.items():
+            index._entries[kind] = {row["id"]: row for row in rows}
+            index._synced[kind] = rows
+        for group, key, items in timelines:
+            getattr(index, cls.TIMELINES[group][1])[key] = Timeline.from_sorted(items)
+        return index
+
+    # ---------------- CONFLICTS ---------------- #
+    def conflicts_for(self, kind, row):
+        """Existing entries that clash with row (a new or edited entry).
+
+        Timetable entries clash on the same room or teacher at overlapping
+        times in the week; exams clash with other exams in the room on that
+        date and with the room's classes on that weekday.
+        """
+        with self._lock:
+            found = []
+            for reason, timeline, start, end, other_kind in self._checks(kind, row):
+                for entry_id in timeline.overlapping(start, end):
+                    if other_kind == kind and entry_id == row.get("id"):
+                        continue
+                    found.append({"reason": reason, "kind": other_kind,
+                                  "entry": self._entries[other_kind][entry_id]})
+            return found
+
+    def _checks(self, kind, row):
+        room = _key(self.resolve_room(row.get("room")))
+        if kind == "timetable":
+            start = week_minute(row.get("day"), row.get("start_time"))
+            end = week_minute(row.get("day"), row.get("end_time"))
+            if start is None or end is None:
+                return []
+            return [("room", self._by_room.get(room, Timeline()), start, end, "timetable"),
+                    ("teacher", self._by_teacher.get(_key(row.get("teacher")), Timeline()), start, end, "timetable")]
+
+        start = absolute_minute(row.get("date"), row.get("start_time"))
+        end = absolute_minute(row.get("date"), row.get("end_time"))
+        if start is None or end is None:
+            return []
+        weekday = datetime.strptime(str(row.get("date"))[:10], '%Y-%m-%d').weekday()
+        week_start = weekday * MINUTES_PER_DAY + start % MINUTES_PER_DAY
+        week_end = weekday * MINUTES_PER_DAY + end % MINUTES_PER_DAY
+        return [("room", self._exams_by_room.get(room, Timeline()), start, end, "exams"),
+                ("room", self._by_room.get(room, Timeline()), week_start, week_end, "timetable")]
+
+    def validate(self):
+        """Every conflict in the indexed term, found with one sweep per room/teacher."""
+        with self._lock:
+            conflicts = []
+            groups = (("room", "timetable", self._by_room), ("teacher", "timetable", self._by_teacher),
+                      ("room", "exams", self._exams_by_room))
+            for reason, kind, timelines in groups:
+                for key, timeline in timelines.items():
+                    for a, b in sweep_overlaps(timeline.items):
+                        conflicts.append({"reason": reason, "key": key, "kind": kind,
+                                          "entries": [self._entries[kind][a], self._entries[kind][b]]})
+            # Exams against the weekly classes in the same room
+            for exam in self._entries["exams"].values():
+                for found in self.conflicts_for("exams", exam):
+                    if found["kind"] == "timetable":
+                        conflicts.append({"reason": "room", "key": _key(exam.get("room")), "kind": "exams",
+                                          "entries": [exam, found["entry"]]})
+            return conflicts
+
+    # ---------------- QUERIES ---------------- #
+    def _next_class(self, timeline, t):
+        # The timetable repeats weekly, so wrap around to the first class of the week
+        item = timeline.next_after(t) or timeline.first()
+        return self._entries["timetable"][item[2]] if item else None
+
+    def room_status(self, room, when):
+        """Current and next class/exam in a room at datetime when."""
+        with self._lock:
+            name = self.resolve_room(room)
+            t = when.weekday() * MINUTES_PER_DAY + when.hour * 60 + when.minute
+            abs_t = when.toordinal() * MINUTES_PER_DAY + when.hour * 60 + when.minute
+            classes = self._by_room.get(_key(name), Timeline())
+            exams = self._exams_by_room.get(_key(name), Timeline())
+            next_exam = exams.next_after(abs_t)
+            return {
+                "room": name,
+                "now": [self._entries["timetable"][i] for i in classes.at(t)],
+                "next": self._next_class(classes, t),
+                "exams_now": [self._entries["exams"][i] for i in exams.at(abs_t)],
+                "next_exam": self._entries["exams"][next_exam[2]] if next_exam else None,
+            }
+
+    def teacher_status(self, teacher, when):
+        """Where a teacher is now and where their next class is."""
+        with self._lock:
+            t = when.weekday() * MINUTES_PER_DAY + when.hour * 60 + when.minute
+            classes = self._by_teacher.get(_key(teacher), Timeline())
+            return {
+                "teacher": teacher,
+                "now": [self._entries["timetable"][i] for i in classes.at(t)],
+                "next": self._next_class(classes, t),
+            }
+
+    def free_rooms(self, rooms, day, start, end, date=None):
+        """Rooms with no class (and, if date is given, no exam) in [start, end)."""
+        start_min, end_min = to_minutes(start), to_minutes(end)
+        if day not in DAYS or start_min is None or end_min is None or end_min <= start_min:
+            raise ValueError("day must be a weekday name and start/end HH:MM with end after start")
+        offset = DAYS.index(day) * MINUTES_PER_DAY
+        if date and absolute_minute(date, start) is None:
+            raise ValueError("date must be YYYY-MM-DD")
+        with self._lock:
+            free = []
+            for room in rooms:
+                key = _key(self.resolve_room(room["id"]))
+                classes = self._by_room.get(key)
+                if classes and classes.overlaps(offset + start_min, offset + end_min):
+                    continue
+                exams = self._exams_by_room.get(key)
+                if date and exams and exams.overlaps(absolute_minute(date, start), absolute_minute(date, end)):
+                    continue
+                free.append(room)
+            return free
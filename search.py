@@ -0,0 +1,131 @@
+import re
+import sqlite3
+
+# Default number of rooms returned by a search
+SEARCH_LIMIT = 20
+
+# Words a speech recognizer produces for room numbers ("j three oh seven" -> "j307")
+SPOKEN_DIGITS = {
+    'zero': '0', 'oh': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4',
+    'five': '5', 'six': '6', 'seven': '7', 'eight': '8', 'nine': '9',
+}
+SEPARATORS = ('-', ' ', '_', '.', '/')
+
+
+def compact(text):
+    """Lowercase, turn spoken digits into numbers and drop separators."""
+    words = re.split(r'[^0-9a-z]+', (text or '').lower())
+    text = ''.join(SPOKEN_DIGITS.get(w, w) for w in words)
+    # A letter "o" between digits is almost always a zero ("3o7")
+    return re.sub(r'(?<=[0-9])o(?=[0-9])', '0', text)
+
+
+def register_compact(conn):
+    """Make compact() callable as SQL; every connection that writes rooms needs it for the index triggers."""
+    conn.create_function('compact', 1, compact, deterministic=True)
+
+
+def _triggers(conn):
+    return conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'rooms_fts_%'").fetchall()
+
+
+def init_search(conn):
+    """Create the FTS5 index over rooms and the triggers that keep it in sync.
+
+    Returns False when this SQLite build has no FTS5/trigram support, in which
+    case search_rooms() falls back to a linear scan.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS rooms_fts
+                          USING fts5(id UNINDEXED, key, name, tokenize='trigram')''')
+    except sqlite3.OperationalError:
+        return False
+
+    # Keys are compact() of the ID and name, the same function that compacts queries
+    register_compact(conn)
+    insert = '''INSERT INTO rooms_fts (rowid, id, key, name)
+                VALUES (new.rowid, new.id, compact(new.id), compact(new.name));'''
+    delete = "DELETE FROM rooms_fts WHERE rowid = old.rowid;"
+    before = _triggers(conn)
+    for name, event, body in (('ai', 'INSERT', insert), ('ad', 'DELETE', delete), ('au', 'UPDATE', delete + insert)):
+        cursor.execute(f"DROP TRIGGER IF EXISTS rooms_fts_{name}")
+        cursor.execute(f"CREATE TRIGGER rooms_fts_{name} AFTER {event} ON rooms BEGIN {body} END")
+
+    # Backfill rooms written before the index existed, and re-key them when the triggers changed
+    cursor.execute("SELECT (SELECT COUNT(*) FROM rooms), (SELECT COUNT(*) FROM rooms_fts)")
+    rooms_count, indexed_count = cursor.fetchone()
+    if rooms_count != indexed_count or _triggers(conn) != before:
+        rebuild_search(conn)
+    conn.commit()
+    return True
+
+
+def rebuild_search(conn):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM rooms_fts")
+    register_compact(conn)
+    cursor.execute('''INSERT INTO rooms_fts (rowid, id, key, name)
+                      SELECT rowid, id, compact(id), compact(name) FROM rooms''')
+    conn.commit()
+
+
+def _has_index(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'rooms_fts'").fetchone()
+    return row is not None
+
+
+def _fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def search_rooms(conn, query, limit=SEARCH_LIMIT):
+    """Return up to limit (id, name, video) rows ranked for query.
+
+    Exact ID matches come first, then ID/name prefix matches, then substring
+    matches. If nothing contains the query, rooms sharing the most trigrams
+    with it are returned so misheard voice queries still find a room.
+    """
+    cursor = conn.cursor()
+    q = compact(query)
+    if not (query or '').strip():
+        cursor.execute("SELECT id, name, video FROM rooms ORDER BY id LIMIT ?", (limit,))
+        return cursor.fetchall()
+    if not q:
+        # Nothing searchable left (e.g. only non-ASCII), which would otherwise match every room
+        return []
+
+    if not _has_index(conn):
+        cursor.execute("SELECT id, name, video FROM rooms")
+        return [room for room in cursor.fetchall()
+                if q in compact(room[0]) or q in compact(room[1])][:limit]
+
+    params = {"q": q, "prefix": q + '%', "limit": limit}
+
+    # Trigram MATCH needs at least three characters; shorter queries use LIKE,
+    # which the trigram tokenizer can also serve from the index.
+    if len(q) < 3:
+        where = "(f.key LIKE :substring OR f.name LIKE :substring)"
+        rank = ""
+        params["substring"] = '%' + q + '%'
+    else:
+        where = "rooms_fts MATCH :match"
+        rank = "bm25(rooms_fts),"
+        params["match"] = _fts_phrase(q)
+
+    sql = f'''SELECT r.id, r.name, r.video FROM rooms_fts f
+              JOIN rooms r ON r.rowid = f.rowid
+              WHERE {where}
+              ORDER BY (f.key = :q) DESC,
+                       (f.key LIKE :prefix OR f.name LIKE :prefix) DESC,
+                       {rank} r.id
+              LIMIT :limit'''
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+
+    if not rows and len(q) >= 3:
+        trigrams = {q[i:i + 3] for i in range(len(q) - 2)}
+        params["match"] = ' OR '.join(_fts_phrase(t) for t in sorted(trigrams))
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return rows
@@ -0,0 +1,332 @@
+"""Compact, memory-mapped kiosk snapshots of rooms, timetable and exams.
+
+Usage:
+    python snapshot.py export kiosk.snap     # read storage (STORAGE_BACKEND), write a new snapshot
+    python snapshot.py info kiosk.snap
+
+Layout (little-endian):
+    magic "IMSSNAP" + format version byte | uint32 meta length | meta JSON
+    then 8-byte aligned sections listed in meta["sections"] as [offset, length]:
+      strings.off  uint32[n + 1]   offsets of every distinct string in strings.blob
+      strings.blob utf-8 bytes
+      <collection> uint32[rows * columns]   string ids, row-major
+      search       uint32[keys * 2]         (compacted key string id, room row), sorted by key
+      schedule.<group>  uint32[entries * 4] (key string id, start, end, row) for each room/teacher
+                   timeline of ScheduleIndex.TIMELINES, sorted as the index keeps them
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+
+from bulk import FIRESTORE_COLLECTIONS, _collection_fields
+from schedule import ScheduleIndex
+from search import compact
+
+# Snapshot configuration
+SNAPSHOT_PATH = os.getenv('KIOSK_SNAPSHOT', 'kiosk.snap')
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv('SNAPSHOT_CHECK_INTERVAL', 5))
+
+MAGIC = b'IMSSNAP'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<7sBI')
+EXTRA = '_extra'   # column holding any non-string or unexpected fields as JSON
+SCHEDULE = ('timetable', 'exams')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _uint32s(section):
+    """A little-endian uint32 section as a sequence of ints, zero-copy when the host is little-endian too."""
+    if sys.byteorder == 'little' and struct.calcsize('I') == 4:
+        return section.cast('I')
+    return struct.unpack(f'<{len(section) // 4}I', section)
+
+
+# ---------------- WRITER ---------------- #
+def _columns(collection):
+    return ['id'] + _collection_fields(collection) + [EXTRA]
+
+
+def _row_values(row, columns):
+    values, extra = [], {}
+    for key, value in row.items():
+        if key not in columns or not isinstance(value, str):
+            extra[key] = value.strftime('%Y-%m-%d') if isinstance(value, datetime) else value
+    for column in columns[:-1]:
+        value = row.get(column)
+        values.append(value if isinstance(value, str) else '')
+    values.append(json.dumps(extra, default=str, separators=(',', ':')) if extra else '')
+    return values
+
+
+def write_snapshot(path, collections, version=None):
+    """Write collections ({"rooms": [row, ...], ...}) to path, replacing it atomically."""
+    strings, string_ids = [], {}
+
+    def intern(value):
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    intern('')
+    sections, columns, counts = {}, {}, {}
+    for name, rows in collections.items():
+        columns[name] = _columns(name)
+        ids = [intern(v) for row in rows for v in _row_values(row, columns[name])]
+        sections[name] = struct.pack(f'<{len(ids)}I', *ids)
+        counts[name] = len(rows)
+
+    # Search keys: every room's compacted ID and name, sorted for bisect
+    keys = []
+    for i, room in enumerate(collections.get('rooms', [])):
+        for text in {compact(room.get('id')), compact(room.get('name'))}:
+            if text:
+                keys.append((text, i))
+    keys.sort()
+    sections['search'] = struct.pack(f'<{len(keys) * 2}I', *[v for text, i in keys for v in (intern(text), i)])
+
+    # Schedule timelines as ScheduleIndex places them, so a kiosk loads them instead of re-placing every entry
+    index = ScheduleIndex()
+    index.set_rooms(collections.get('rooms', []))
+    for kind in SCHEDULE:
+        index.sync(kind, collections.get(kind, []))
+    rows_at = {kind: {row['id']: i for i, row in enumerate(collections.get(kind, []))} for kind in SCHEDULE}
+    placed = {group: [] for group in ScheduleIndex.TIMELINES}
+    for group, key, items in sorted(index.timelines()):
+        kind = ScheduleIndex.TIMELINES[group][0]
+        for start, end, entry_id in items:
+            if end > 0xFFFFFFFF:
+                # Past the year 8000 in exam minutes; such a typo shouldn't fail the export
+                print(f"⚠️ Leaving {kind} {entry_id} out of the snapshot's schedule index: date out of range")
+                continue
+            placed[group] += [intern(key), start, end, rows_at[kind][entry_id]]
+    for group, values in placed.items():
+        sections[f'schedule.{group}'] = struct.pack(f'<{len(values)}I', *values)
+
+    blobs = [s.encode('utf-8') for s in strings]
+    offsets, total = [0], 0
+    for blob in blobs:
+        total += len(blob)
+        offsets.append(total)
+    sections['strings.off'] = struct.pack(f'<{len(offsets)}I', *offsets)
+    sections['strings.blob'] = b''.join(blobs)
+
+    meta = {
+        "version": version or int(time.time() * 1000),
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "columns": columns,
+        "counts": counts,
+        "sections": {},
+    }
+    # Section offsets depend on the meta length, so lay out twice until it is stable
+    while True:
+        meta_bytes = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+        position, layout = HEADER.size + len(meta_bytes), {}
+        for name, data in sections.items():
+            position += -position % 8
+            layout[name] = [position, len(data)]
+            position += len(data)
+        if layout == meta["sections"]:
+            break
+        meta["sections"] = layout
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(meta_bytes)))
+        f.write(meta_bytes)
+        for name, data in sections.items():
+            f.write(b'\0' * (layout[name][0] - f.tell()))
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return meta
+
+
+# ---------------- READER ---------------- #
+class Snapshot:
+    """Read-only view over a snapshot file; rows are decoded on first use."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, meta_len = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise SnapshotError(f"{path} is not a version {FORMAT_VERSION} kiosk snapshot")
+        self.meta = json.loads(self._mmap[HEADER.size:HEADER.size + meta_len])
+        self.version = self.meta["version"]
+        view = memoryview(self._mmap)
+        self._sections = {name: view[offset:offset + length]
+                          for name, (offset, length) in self.meta["sections"].items()}
+        self._offsets = _uint32s(self._sections['strings.off'])
+        self._blob = self._sections['strings.blob']
+        self._rows = {}
+        self._schedule = None
+        self._lock = threading.Lock()
+
+    def string(self, i):
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+    def rows(self, collection):
+        """Rows of a collection as dicts, in the shape the Firestore loaders produce."""
+        rows = self._rows.get(collection)
+        if rows is None:
+            with self._lock:
+                rows = self._rows.get(collection)
+                if rows is None:
+                    rows = self._rows[collection] = self._decode(collection)
+        return rows
+
+    def _decode(self, collection):
+        if collection not in self.meta["columns"]:
+            return []
+        columns = self.meta["columns"][collection][:-1]
+        ids = list(_uint32s(self._sections[collection]))
+        width = len(columns) + 1
+        # Strings are shared across rows (days, rooms, teachers), so decode each once
+        decoded = {}
+        strings = [decoded[i] if i in decoded else decoded.setdefault(i, self.string(i)) for i in ids]
+        rows = []
+        for start in range(0, len(strings), width):
+            row = dict(zip(columns, strings[start:start + width - 1]))
+            extra = strings[start + width - 1]
+            if extra:
+                row.update(json.loads(extra))
+            rows.append(row)
+        return rows
+
+    def schedule_index(self):
+        """ScheduleIndex over the snapshot's timetable and exams, from the stored timelines."""
+        index = self._schedule
+        if index is None:
+            timelines = []
+            for group, (kind, _) in ScheduleIndex.TIMELINES.items():
+                values, rows, items = _uint32s(self._sections[f'schedule.{group}']), self.rows(kind), {}
+                for i in range(0, len(values), 4):
+                    key, start, end, row = values[i:i + 4]
+                    items.setdefault(key, []).append((start, end, rows[row]['id']))
+                timelines += [(group, self.string(key), placed) for key, placed in items.items()]
+            index = ScheduleIndex.restore(self.rows('rooms'), {kind: self.rows(kind) for kind in SCHEDULE}, timelines)
+            with self._lock:
+                if self._schedule is None:
+                    self._schedule = index
+                index = self._schedule
+        return index
+
+    def search(self, query, limit=20):
+        """Rooms whose compacted ID or name starts with the compacted query."""
+        needle = compact(query)
+        if not needle:
+            return []
+        pairs = _uint32s(self._sections['search'])
+        count = len(pairs) // 2
+        keys = _KeyView(self, pairs)
+        rooms, seen = self.rows('rooms'), set()
+        found = []
+        for i in range(bisect_left(keys, needle, 0, count), count):
+            if not keys[i].startswith(needle) or len(found) >= limit:
+                break
+            if pairs[i * 2 + 1] not in seen:
+                seen.add(pairs[i * 2 + 1])
+                found.append(rooms[pairs[i * 2 + 1]])
+        return found
+
+
+class _KeyView:
+    """Sequence of search keys for bisect, decoding only the probed entries."""
+
+    def __init__(self, snapshot, pairs):
+        self._snapshot = snapshot
+        self._pairs = pairs
+
+    def __len__(self):
+        return len(self._pairs) // 2
+
+    def __getitem__(self, i):
+        return self._snapshot.string(self._pairs[i * 2])
+
+
+class SnapshotStore:
+    """Current snapshot at path, swapped for a newer file when one is written.
+
+    write_snapshot() replaces the file with os.replace(), so a reader either
+    keeps the old mapping or opens the complete new one.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH, check_interval=SNAPSHOT_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._stat = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """The current Snapshot, or None when no snapshot file exists."""
+        now = time.monotonic()
+        if self._snapshot is None or now - self._checked >= self.check_interval:
+            with self._lock:
+                self._checked = now
+                self._reload()
+        return self._snapshot
+
+    def _reload(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if key == self._stat:
+            return
+        try:
+            snapshot = Snapshot(self.path)
+        except (OSError, ValueError, KeyError, SnapshotError) as e:
+            print(f"❌ Ignoring snapshot {self.path}: {e}")
+            return
+        # Readers holding the old Snapshot keep its mapping until they let go
+        self._snapshot, self._stat = snapshot, key
+        print(f"✅ Loaded snapshot {self.path} (version {snapshot.version})")
+
+
+# ---------------- CLI ---------------- #
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Kiosk snapshot export")
+    parser.add_argument('action', choices=['export', 'info'])
+    parser.add_argument('path', nargs='?', default=SNAPSHOT_PATH)
+    args = parser.parse_args(argv)
+
+    if args.action == 'export':
+        from dotenv import load_dotenv
+        from storage import open_storage
+
+        load_dotenv()
+        started = time.perf_counter()
+        store = open_storage()
+        collections = {name: list(store[name].stream()) for name in FIRESTORE_COLLECTIONS}
+        meta = write_snapshot(args.path, collections)
+        print(json.dumps({"version": meta["version"], "counts": meta["counts"],
+                          "bytes": os.path.getsize(args.path),
+                          "seconds": round(time.perf_counter() - started, 3)}), file=sys.stderr)
+        return
+
+    started = time.perf_counter()
+    snapshot = Snapshot(args.path)
+    counts = {name: len(snapshot.rows(name)) for name in snapshot.meta["columns"]}
+    print(json.dumps({"version": snapshot.version, "created_at": snapshot.meta["created_at"], "counts": counts,
+                      "bytes": os.path.getsize(args.path),
+                      "load_ms": round((time.perf_counter() - started) * 1000, 2)}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import os
+import queue
+import sqlite3
+from contextlib import contextmanager
+from flask import g
+from profiling import span
+
+# Pool configuration
+SQLITE_READERS = int(os.getenv('SQLITE_READERS', 8))
+SQLITE_POOL_TIMEOUT = float(os.getenv('SQLITE_POOL_TIMEOUT', 10))
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 64 * 1024 * 1024)),
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -16000)),  # negative = KiB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+    'foreign_keys': 'ON',
+}
+# Prepared statements kept per connection by the sqlite3 module
+SQLITE_STATEMENT_CACHE = 256
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor whose statements are recorded as "sqlite" profiling spans."""
+
+    def execute(self, *args):
+        with span("sqlite"):
+            return super().execute(*args)
+
+    def executemany(self, *args):
+        with span("sqlite"):
+            return super().executemany(*args)
+
+    def executescript(self, *args):
+        with span("sqlite"):
+            return super().executescript(*args)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors and shortcut execute methods use TimedCursor.
+
+    Connection.execute() creates its cursor in C without calling cursor(), so
+    the shortcuts are overridden to go through it.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+
+class ConnectionPool:
+    """Fixed-size pool of SQLite connections opened lazily with tuned pragmas."""
+
+    def __init__(self, path, size, readonly=False, on_connect=None):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self.on_connect = on_connect    # on_connect(conn) after the pragmas, e.g. to register SQL functions
+        self._idle = queue.LifoQueue()
+        self._slots = queue.Queue()
+        for _ in range(size):
+            self._slots.put(None)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=TimedConnection,
+                               cached_statements=SQLITE_STATEMENT_CACHE)
+        for name, value in SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        if self.readonly:
+            conn.execute("PRAGMA query_only = ON")
+        if self.on_connect:
+            self.on_connect(conn)
+        return conn
+
+    def acquire(self, timeout=SQLITE_POOL_TIMEOUT):
+        try:
+            self._slots.get(timeout=timeout)
+        except queue.Empty:
+            raise RuntimeError(f"No free SQLite connection for {self.path} after {timeout}s")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._slots.put(None)
+                raise
+            return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+        self._slots.put(None)
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class SQLitePool:
+    """Read and write connection pools for one database, bound to a Flask app.
+
+    Readers are shared per request through flask.g and returned to the pool on
+    app-context teardown. Writes go through a separate single connection so,
+    with WAL, kiosk readers never wait on an admin write.
+    """
+
+    def __init__(self, path, app=None, readers=SQLITE_READERS, on_connect=None):
+        self.readers = ConnectionPool(path, readers, readonly=True, on_connect=on_connect)
+        self.writers = ConnectionPool(path, 1, on_connect=on_connect)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.teardown_appcontext(self._teardown)
+
+    def read(self):
+        """Return this request's read-only connection."""
+        if 'sqlite_reader' not in g:
+            g.sqlite_reader = self.readers.acquire()
+        return g.sqlite_reader
+
+    @contextmanager
+    def write(self):
+        """Hold the writer connection for one transaction, committing on success."""
+        conn = self.writers.acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.writers.release(conn)
+
+    def _teardown(self, exc):
+        conn = g.pop('sqlite_reader', None)
+        if conn is not None:
+            self.readers.release(conn)
+
+    def close(self):
+        self.readers.close_all()
+        self.writers.close_all()
@@ -0,0 +1,81 @@
+"""Deferred start-up and warm-up for the Flask apps.
+
+Importing admin.py, app.py or user.py only defines the app and its routes.
+Work that needs credentials, databases or background threads goes in the
+app's start function, and filling caches in its warm-up steps:
+
+    gunicorn 'user:create_app()'    # each worker starts and warms up before it accepts connections
+    gunicorn user:app               # starts on the first request; caches fill on demand
+
+Each step is timed for `python bench.py --startup`.
+"""
+import os
+import threading
+import time
+
+# STARTUP_WARM=0 makes create_app() skip the warm-up
+STARTUP_WARM = os.getenv('STARTUP_WARM', '1').lower() not in ('0', 'false', 'no')
+
+
+def _ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+class Startup:
+    """Runs an app's start function once, then its warm-up steps, and keeps their timings."""
+
+    def __init__(self, app, start, warm=None):
+        self.app = app
+        self.start = start
+        self.warm = warm or {}      # step name -> callable, or a path to GET once
+        self.started = False
+        self.timings = {}
+        self._lock = threading.Lock()
+
+        @app.before_request
+        def ensure_started():
+            if not self.started:
+                self.run(warm=False)
+
+    def run(self, warm=STARTUP_WARM):
+        with self._lock:
+            if self.started:
+                return
+            started = time.perf_counter()
+            self.start()
+            self.timings["start_ms"] = _ms(started)
+            self.started = True
+        if warm:
+            self.warm_up()
+
+    def warm_up(self):
+        """Compile every template, then run the warm-up steps; a failing step is skipped."""
+        steps = {"templates": self._compile_templates, **self.warm}
+        warm_started = time.perf_counter()
+        for name, step in steps.items():
+            started = time.perf_counter()
+            try:
+                self._get(step) if isinstance(step, str) else step()
+            except Exception as e:
+                print(f"⚠️ Warm-up step {name} failed: {e}")
+            self.timings[f"warm.{name}_ms"] = _ms(started)
+        self.timings["warm_ms"] = _ms(warm_started)
+        print(f"✅ {self.app.import_name} warmed up in {self.timings['warm_ms']} ms")
+
+    def _compile_templates(self):
+        env = self.app.jinja_env
+        for name in env.list_templates():
+            env.get_template(name)
+
+    def _get(self, path):
+        # Goes through the whole request, so the page, fragment and data caches it reads fill up
+        response = self.app.test_client().get(path)
+        if response.status_code >= 500:
+            raise RuntimeError(f"GET {path} returned {response.status_code}")
+
+    def stats(self):
+        return {"started": self.started, **self.timings}
+
+
+def init_startup(app, start, warm=None):
+    return Startup(app, start, warm)
@@ -0,0 +1,790 @@
+"""Repositories for rooms, timetable, exams and users, over Firestore or SQLite.
+
+app.py, user.py and bench.py read and write through store.rooms,
+store.timetable, store.exams and store.users instead of calling the Firestore
+client, so STORAGE_BACKEND switches every one of them at once:
+
+    STORAGE_BACKEND=firestore   # default: Firestore and Firebase Auth
+    STORAGE_BACKEND=sqlite      # a local file (STORAGE_SQLITE, default store.db); no network, no Firebase
+
+Both backends commit each write to rooms, timetable or exams as one revision
+with change log entries, so /sync and the kiosk page caches behave the same.
+On SQLite the revision is taken inside the write transaction and the per-day
+and per-room schedule views are plain indexed queries (room, day, date,
+teacher) instead of materialized documents.
+
+Usage:
+    python storage.py copy --from firestore --to sqlite   # take a local copy of the data
+    python storage.py prune --days 7                       # drop old SQLite change log entries
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from bulk import SQLITE_BATCH_SIZE, _batches, _report
+from changes import SYNC_LIMIT, commit_changes, current_revision, cut_entries, read_changes, resolve
+from clients import LazyFirestore, LazyModule, firebase_app, firestore_client
+from materialize import ENTRIES_PER_BATCH, SORT_KEYS, ViewChanges, check, entry_fields, read_view, room_key, \
+    view_kind, views_built
+from sqlite_pool import ConnectionPool, SQLITE_READERS
+
+BACKENDS = ('firestore', 'sqlite')
+# Writes to these are revisions in the change log; users are not synced to kiosks
+REVISIONED = ('rooms', 'timetable', 'exams')
+SCHEDULE = ('timetable', 'exams')
+# Seconds a SQLite password reset link stays valid
+PASSWORD_RESET_TTL = int(os.getenv('PASSWORD_RESET_TTL', 3600))
+
+
+class StorageError(Exception):
+    pass
+
+
+class NotFound(StorageError):
+    pass
+
+
+class AccountExists(StorageError):
+    pass
+
+
+def storage_backend():
+    # Read when the app opens its storage, i.e. after load_dotenv()
+    return os.getenv('STORAGE_BACKEND', 'firestore').lower()
+
+
+def sqlite_path():
+    return os.getenv('STORAGE_SQLITE', 'store.db')
+
+
+class _DeleteField:
+    def __repr__(self):
+        return 'DELETE'
+
+
+# Value for update(): remove the field (Firestore's DELETE_FIELD, NULL in SQLite)
+DELETE = _DeleteField()
+
+
+def _view_entry(mode, data, previous):
+    # What a schedule entry looks like after the write, for its views
+    if mode == "delete":
+        return None
+    data = {field: value for field, value in data.items() if value is not DELETE}
+    return data if mode == "create" else {**(previous or {}), **data}
+
+
+class Repository(ABC):
+    """One collection. Rows are dicts with the document ID under "id".
+
+    Writes are (mode, doc_id, data, previous) operations: mode is "create"
+    (replace, stamping created_at), "merge", "update" (the document must
+    exist) or "delete"; previous is the row before the write, which schedule
+    views need to drop an entry from the day or room it left.
+
+    check(ops), if given, runs inside the write: under the SQLite write lock,
+    or in every Firestore attempt before the revision counter's precondition
+    is checked. It can re-validate the ops against what is stored at that
+    moment; raising aborts the commit.
+    """
+
+    chunk_size = SQLITE_BATCH_SIZE
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.revisioned = name in REVISIONED
+
+    def create(self, doc_id, data, check=None):
+        return self.commit([("create", doc_id, data, None)], check)
+
+    def update(self, doc_id, data, previous=None, check=None):
+        return self.commit([("update", doc_id, data, previous)], check)
+
+    def delete(self, doc_id, previous=None):
+        return self.commit([("delete", doc_id, None, previous)])
+
+    def write_many(self, ops, check=None):
+        """Commit ops in chunks, one revision per chunk (check runs per chunk).
+
+        Returns {position in ops: error message} for ops whose chunk failed.
+        """
+        failed = {}
+        for chunk in _batches(enumerate(ops), self.chunk_size):
+            try:
+                self.commit([op for _, op in chunk], check)
+            except Exception as e:
+                print(f"❌ Bulk write to {self.name} failed: {e}")
+                failed.update((n, str(e)) for n, _ in chunk)
+        return failed
+
+    @abstractmethod
+    def commit(self, ops, check=None):
+        """Commit ops together; returns the revision (None for users)."""
+
+    @abstractmethod
+    def get(self, doc_id):
+        """The row, or None if there is no such document."""
+
+    @abstractmethod
+    def find(self, limit=None, **equals):
+        """Rows whose fields equal the given values."""
+
+    @abstractmethod
+    def rows(self, fields=None):
+        """Every row, with only fields (plus "id") if given."""
+
+    @abstractmethod
+    def page(self, fields, equals, order_by, cursor, limit):
+        """Up to limit rows ordered by order_by then ID, after the row whose ID is cursor."""
+
+    @abstractmethod
+    def stream(self):
+        """Every row, read incrementally (for exports)."""
+
+    @abstractmethod
+    def new_id(self):
+        raise NotImplementedError
+
+
+class Storage(ABC):
+    """The repositories plus the revision, change log and schedule view reads kiosks need."""
+
+    backend = None
+    repository = Repository
+
+    def __init__(self):
+        self.rooms = self.repository(self, "rooms")
+        self.timetable = self.repository(self, "timetable")
+        self.exams = self.repository(self, "exams")
+        self.users = self.repository(self, "users")
+
+    def __getitem__(self, name):
+        if name not in REVISIONED + ("users",):
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def connect(self):
+        """Open the connection (warm-up)."""
+
+    @abstractmethod
+    def revision(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_changes(self, since, limit=SYNC_LIMIT):
+        """(entries, rev, more, reset) after since; see changes.read_changes()."""
+
+    def rows_at(self, name):
+        """(rev, rows, exact) for a collection.
+
+        rev is read before the rows, so nothing committed after it is missing
+        from /sync. exact says the rows are precisely that revision's; here,
+        that the revision didn't move while they were read.
+        """
+        rev = self.revision()
+        rows = self[name].rows()
+        return rev, rows, self.revision() == rev
+
+    @abstractmethod
+    def resolve(self, entries):
+        """Current row (None once deleted) of every (rev, collection, id) entry, by (collection, id)."""
+
+    @abstractmethod
+    def view(self, view_id):
+        """Rows of a materialize.py schedule view, or None when the backend can't serve it."""
+
+    def check_views(self):
+        """Schedule views that disagree with timetable and exams."""
+        return []
+
+    def watch(self, cache, name, transform):
+        """Keep cache[name] = transform(rows) current from a listener; False if unsupported."""
+        return False
+
+
+# ---------------- FIRESTORE ---------------- #
+def _row(doc):
+    return {"id": doc.id, **doc.to_dict()}
+
+
+class FirestoreRepository(Repository):
+    chunk_size = ENTRIES_PER_BATCH
+
+    def _ref(self):
+        return self.store.db.collection(self.name)
+
+    def _fields(self, data):
+        return {field: self.store.firestore.DELETE_FIELD if value is DELETE else value
+                for field, value in data.items()}
+
+    def _stage(self, batch, views, op, rev):
+        mode, doc_id, data, previous = op
+        doc = self._ref().document(doc_id)
+        stamp = {} if rev is None else {"rev": rev}
+        if mode == "delete":
+            batch.delete(doc)
+        elif mode == "create":
+            batch.set(doc, {**self._fields(data), "created_at": self.store.firestore.SERVER_TIMESTAMP, **stamp})
+        elif mode == "merge":
+            batch.set(doc, {**self._fields(data), **stamp}, merge=True)
+        else:
+            batch.update(doc, {**self._fields(data), **stamp})
+        if self.name in SCHEDULE:
+            views.add(self.name, doc_id, _view_entry(mode, data, previous), previous)
+        return self.name, doc_id
+
+    def commit(self, ops, check=None):
+        db = self.store.db
+        if not self.revisioned:
+            if check:
+                check(ops)
+            batch = db.batch()
+            for op in ops:
+                self._stage(batch, None, op, None)
+            batch.commit()
+            return None
+
+        def build(batch, rev):
+            # A write committed since the counter was read fails the precondition, and this runs again
+            if check:
+                check(ops)
+            views = ViewChanges()
+            changed = [self._stage(batch, views, op, rev) for op in ops]
+            views.stage(db, batch)
+            return changed
+
+        return commit_changes(db, build)
+
+    def get(self, doc_id):
+        doc = self._ref().document(doc_id).get()
+        return _row(doc) if doc.exists else None
+
+    def find(self, limit=None, **equals):
+        query = self._ref()
+        for field, value in equals.items():
+            query = query.where(field, "==", value)
+        if limit:
+            query = query.limit(limit)
+        return [_row(doc) for doc in query.stream()]
+
+    def rows(self, fields=None):
+        query = self._ref().select(fields) if fields else self._ref()
+        return [_row(doc) for doc in query.stream()]
+
+    def page(self, fields, equals, order_by, cursor, limit):
+        # Filtering on one field while ordering by another needs a composite index
+        ref = self._ref()
+        query = ref.select(fields)
+        for field, value in equals.items():
+            query = query.where(field, "==", value)
+        if order_by:
+            query = query.order_by(order_by)
+        query = query.order_by(self.store.firestore.FieldPath.document_id())
+        if cursor:
+            last_doc = ref.document(cursor).get()
+            if last_doc.exists:
+                query = query.start_after(last_doc)
+        return [_row(doc) for doc in query.limit(limit).stream()]
+
+    def stream(self):
+        for doc in self._ref().stream():
+            yield _row(doc)
+
+    def new_id(self):
+        return self._ref().document().id
+
+    # Accounts live in Firebase Auth; the users collection holds the profile and password hash
+    def account(self, email):
+        """The user row for email, or None."""
+        try:
+            record = self.store.auth.get_user_by_email(email)
+        except self.store.auth.UserNotFoundError:
+            return None
+        return self.get(record.uid)
+
+    def register(self, email, password, data):
+        """Create an account and its user row; returns the new user ID."""
+        try:
+            uid = self.store.auth.create_user(email=email, password=password).uid
+        except self.store.auth.EmailAlreadyExistsError:
+            raise AccountExists(email)
+        try:
+            self.create(uid, data)
+        except Exception:
+            # An auth account without a profile can't log in, and would block signing up again
+            self.store.auth.delete_user(uid)
+            raise
+        return uid
+
+    def reset_link(self, email, url=None):
+        # Firebase hosts the page the link opens, so url is not used
+        return self.store.auth.generate_password_reset_link(email)
+
+    def reset_password(self, code, password_hash):
+        raise StorageError("Firebase resets passwords from its own link")
+
+    def adopt_account(self, uid, email):
+        """Create a passwordless auth account for a user row copied from another backend.
+
+        Returns False when email already belongs to a different account."""
+        try:
+            self.store.auth.create_user(uid=uid, email=email)
+        except self.store.auth.UidAlreadyExistsError:
+            return True
+        except self.store.auth.EmailAlreadyExistsError:
+            return False
+        return True
+
+
+class FirestoreStorage(Storage):
+    backend = "firestore"
+    repository = FirestoreRepository
+
+    def __init__(self, cred=None):
+        self.cred = cred
+        self.db = LazyFirestore(cred)
+        self.firestore = LazyModule('firebase_admin.firestore')
+        self.auth = LazyModule('firebase_admin.auth', setup=lambda: firebase_app(cred))
+        super().__init__()
+
+    def connect(self):
+        firestore_client(self.cred)
+
+    def revision(self):
+        return current_revision(self.db)
+
+    def read_changes(self, since, limit=SYNC_LIMIT):
+        return read_changes(self.db, since, limit)
+
+    def resolve(self, entries):
+        return {key: _row(snap) if snap is not None else None for key, snap in resolve(self.db, entries).items()}
+
+    def view(self, view_id):
+        # Only trusted once `python materialize.py rebuild` has run
+        if not views_built(self.db):
+            return None
+        rows = read_view(self.db, view_id)
+        # No document just means nothing is scheduled there
+        return rows if rows is not None else []
+
+    def check_views(self):
+        return check(self.db)
+
+    def watch(self, cache, name, transform):
+        cache.watch(self.db.collection(name), name, lambda docs: transform([_row(doc) for doc in docs]))
+        return True
+
+
+# ---------------- SQLITE ---------------- #
+# Fields with their own column; anything else is kept as JSON in "extra"
+COLUMNS = {
+    "rooms": ("name", "video"),
+    "timetable": ("day", "period", "subject", "teacher", "room", "start_time", "end_time"),
+    "exams": ("name", "date", "room", "start_time", "end_time"),
+    "users": ("username", "email", "password", "role"),
+}
+INDEXES = {
+    "rooms": ["name"],
+    "timetable": ["day, start_time", "room, start_time", "teacher, start_time", "room_key"],
+    "exams": ["date, start_time", "room, date", "room_key, date"],
+}
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _column_value(value):
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class SQLiteRepository(Repository):
+    def _fields(self):
+        # room_key is derived (see materialize.room_key) and never read back
+        return ("id",) + COLUMNS[self.name] + ("created_at", "rev", "extra")
+
+    def _select(self, fields=None):
+        columns = self._fields()
+        if fields is not None and set(fields) <= set(COLUMNS[self.name]):
+            columns = ("id",) + tuple(f for f in COLUMNS[self.name] if f in fields)
+        return columns, f"SELECT {', '.join(columns)} FROM {self.name}"
+
+    def _rows(self, columns, values):
+        rows = []
+        for value in values:
+            row = {field: v for field, v in zip(columns, value) if v is not None}
+            extra = row.pop("extra", None)
+            if extra:
+                row.update(json.loads(extra))
+            rows.append(row)
+        return rows
+
+    def _read(self, sql, params=(), fields=None):
+        columns, select = self._select(fields)
+        with self.store.read() as conn:
+            return self._rows(columns, conn.execute(select + sql, params).fetchall())
+
+    def _write(self, conn, op, rev):
+        mode, doc_id, data, _ = op
+        if mode == "delete":
+            conn.execute(f"DELETE FROM {self.name} WHERE id = ?", (doc_id,))
+            return
+        current = None
+        if mode != "create":
+            columns, select = self._select()
+            found = self._rows(columns, conn.execute(select + " WHERE id = ?", (doc_id,)).fetchall())
+            current = found[0] if found else None
+            if current is None and mode == "update":
+                raise NotFound(f"No {self.name} document {doc_id}")
+        doc = {field: value for field, value in (current or {}).items() if field != "id"}
+        doc.update(data)
+        doc = {field: value for field, value in doc.items() if value is not DELETE}
+        if mode == "create":
+            doc["created_at"] = _now()
+        if rev is not None:
+            doc["rev"] = rev
+
+        columns = COLUMNS[self.name] + ("created_at", "rev")
+        extra = {field: value for field, value in doc.items() if field not in columns}
+        names = ("id",) + columns + ("extra",)
+        values = [doc_id] + [_column_value(doc.get(field)) for field in columns] + \
+                 [json.dumps(extra, default=str) if extra else None]
+        if self.name in SCHEDULE:
+            names += ("room_key",)
+            values.append(room_key(doc.get("room")))
+        # An upsert rather than INSERT OR REPLACE, which would delete a row holding the same users.email
+        conn.execute(f"INSERT INTO {self.name} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+                     f"ON CONFLICT(id) DO UPDATE SET {', '.join(f'{n} = excluded.{n}' for n in names[1:])}",
+                     values)
+
+    def commit(self, ops, check=None):
+        with self.store.write() as conn:
+            if check:
+                check(ops)
+            rev = self.store.next_revision(conn) if self.revisioned else None
+            for op in ops:
+                self._write(conn, op, rev)
+            if rev is not None:
+                at = _now()
+                conn.executemany("INSERT OR REPLACE INTO changes (rev, collection, id, at) VALUES (?, ?, ?, ?)",
+                                 [(rev, self.name, doc_id, at) for _, doc_id, _, _ in ops])
+        return rev
+
+    def get(self, doc_id):
+        rows = self._read(" WHERE id = ?", (doc_id,))
+        return rows[0] if rows else None
+
+    def find(self, limit=None, **equals):
+        unknown = set(equals) - set(("id",) + COLUMNS[self.name])
+        if unknown:
+            raise ValueError(f"{self.name} can't be filtered on {', '.join(sorted(unknown))}")
+        where = " AND ".join(f"{field} = ?" for field in equals)
+        sql = (f" WHERE {where}" if where else "") + (f" LIMIT {int(limit)}" if limit else "")
+        return self._read(sql, tuple(equals.values()))
+
+    def rows(self, fields=None):
+        return self._read("", fields=fields)
+
+    def page(self, fields, equals, order_by, cursor, limit):
+        where = [f"{field} = ?" for field in equals]
+        params = list(equals.values())
+        order = [order_by, "id"] if order_by else ["id"]
+        if order_by:
+            # Firestore leaves out documents without the order_by field
+            where.append(f"{order_by} IS NOT NULL")
+        if cursor:
+            with self.store.read() as conn:
+                last = conn.execute(f"SELECT {', '.join(order)} FROM {self.name} WHERE id = ?", (cursor,)).fetchone()
+            if last:
+                where.append(f"({', '.join(order)}) > ({', '.join('?' * len(order))})")
+                params.extend(last)
+        sql = (f" WHERE {' AND '.join(where)}" if where else "") + f" ORDER BY {', '.join(order)} LIMIT ?"
+        return self._read(sql, params + [limit], fields)
+
+    def stream(self):
+        columns, select = self._select()
+        with self.store.read() as conn:
+            cursor = conn.execute(select + " ORDER BY id")
+            while True:
+                values = cursor.fetchmany(SQLITE_BATCH_SIZE)
+                if not values:
+                    return
+                yield from self._rows(columns, values)
+
+    def new_id(self):
+        return uuid.uuid4().hex[:20]
+
+    # Without Firebase Auth the users table is the account list
+    def account(self, email):
+        rows = self.find(email=email, limit=1)
+        return rows[0] if rows else None
+
+    def register(self, email, password, data):
+        uid = self.new_id()
+        try:
+            self.create(uid, {**data, "email": email})
+        except sqlite3.IntegrityError:
+            raise AccountExists(email)
+        return uid
+
+    def reset_link(self, email, url):
+        """A one-time link to url (the reset page) that lets email set a new password."""
+        account = self.account(email)
+        if account is None:
+            raise NotFound(email)
+        secret = secrets.token_urlsafe(32)
+        self.update(account["id"], {"reset_token": _digest(secret), "reset_expires": time.time() + PASSWORD_RESET_TTL})
+        return f"{url}?oobCode={account['id']}.{secret}"
+
+    def reset_password(self, code, password_hash):
+        """Set the password for a reset link's code and use the code up; returns the user ID."""
+        uid, _, secret = (code or "").partition(".")
+        row = self.get(uid) if uid and secret else None
+        if (row is None or not row.get("reset_token") or time.time() > row.get("reset_expires", 0)
+                or not hmac.compare_digest(row["reset_token"], _digest(secret))):
+            raise StorageError("This reset link is invalid or has expired")
+        self.update(uid, {"password": password_hash, "reset_token": DELETE, "reset_expires": DELETE})
+        return uid
+
+
+def _digest(secret):
+    # Only the hash of a reset code is stored, like a password
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+class SQLiteStorage(Storage):
+    """Rows in indexed tables of one SQLite file; a write holds the file's write lock
+    from taking its revision to commit, so revisions follow commit order across processes."""
+
+    backend = "sqlite"
+    repository = SQLiteRepository
+
+    def __init__(self, path=None, readers=SQLITE_READERS):
+        self.path = path = path or sqlite_path()
+        self.readers = ConnectionPool(path, readers, readonly=True)
+        self.writers = ConnectionPool(path, 1)
+        self._created = False
+        self._create_lock = threading.Lock()
+        super().__init__()
+
+    def _create(self):
+        # Created on first use, so importing an app doesn't create the database
+        with self._create_lock:
+            if self._created:
+                return
+            conn = self.writers.acquire()
+            try:
+                with conn:
+                    for name, columns in COLUMNS.items():
+                        derived = ", room_key TEXT" if name in SCHEDULE else ""
+                        conn.execute(f"""CREATE TABLE IF NOT EXISTS {name} (
+                                            id TEXT PRIMARY KEY,
+                                            {', '.join(f'{c} TEXT' for c in columns)},
+                                            created_at TEXT,
+                                            rev INTEGER,
+                                            extra TEXT{derived}
+                                         )""")
+                        for columns in INDEXES.get(name, []):
+                            index = '_'.join(c.strip() for c in columns.split(','))
+                            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_{index} ON {name} ({columns})")
+                    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email)")
+                    conn.execute('''CREATE TABLE IF NOT EXISTS changes (
+                                        rev INTEGER NOT NULL,
+                                        collection TEXT NOT NULL,
+                                        id TEXT NOT NULL,
+                                        at TEXT NOT NULL,
+                                        PRIMARY KEY (rev, collection, id)
+                                    )''')
+                    conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+                    conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('rev', 0), ('floor', 0)")
+            finally:
+                self.writers.release(conn)
+            self._created = True
+
+    @contextmanager
+    def read(self):
+        if not self._created:
+            self._create()
+        conn = self.readers.acquire()
+        try:
+            yield conn
+        finally:
+            self.readers.release(conn)
+
+    @contextmanager
+    def write(self):
+        """One IMMEDIATE transaction on the writer connection, committed on success."""
+        if not self._created:
+            self._create()
+        conn = self.writers.acquire()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        finally:
+            self.writers.release(conn)
+
+    def next_revision(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE name = 'rev'")
+        return conn.execute("SELECT value FROM meta WHERE name = 'rev'").fetchone()[0]
+
+    def connect(self):
+        self.revision()
+
+    def revision(self):
+        with self.read() as conn:
+            return conn.execute("SELECT value FROM meta WHERE name = 'rev'").fetchone()[0]
+
+    def read_changes(self, since, limit=SYNC_LIMIT):
+        with self.read() as conn:
+            meta = dict(conn.execute("SELECT name, value FROM meta").fetchall())
+            if since < meta["floor"]:
+                return [], meta["rev"], False, True
+            entries = conn.execute("SELECT rev, collection, id FROM changes WHERE rev > ? ORDER BY rev LIMIT ?",
+                                   (since, limit + 1)).fetchall()
+        return cut_entries([tuple(e) for e in entries], since, meta["rev"], limit) + (False,)
+
+    def rows_at(self, name):
+        repo = self[name]
+        columns, select = repo._select()
+        with self.read() as conn:
+            # One read transaction, so the rows are exactly those of the revision
+            conn.execute("BEGIN")
+            try:
+                rev = conn.execute("SELECT value FROM meta WHERE name = 'rev'").fetchone()[0]
+                rows = repo._rows(columns, conn.execute(select).fetchall())
+            finally:
+                conn.rollback()
+        return rev, rows, True
+
+    def resolve(self, entries):
+        keys = list(dict.fromkeys((collection, doc_id) for _, collection, doc_id in entries))
+        found = {}
+        for collection in dict.fromkeys(collection for collection, _ in keys):
+            ids = [doc_id for c, doc_id in keys if c == collection]
+            for chunk in _batches(ids, 500):
+                rows = self[collection]._read(f" WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+                found.update(((collection, row["id"]), row) for row in rows)
+        return {key: found.get(key) for key in keys}
+
+    def view(self, view_id):
+        kind = view_kind(view_id)
+        prefix, _, value = view_id.partition(':')
+        if prefix == "day":
+            sql, params = " WHERE day = ?", (value,)
+        elif prefix == "date":
+            sql, params = " WHERE date = ?", (value,)
+        elif prefix == "room" and ':' not in value:
+            sql, params = " WHERE room_key = ?", (value,)
+        elif prefix == "room":
+            key, week = value.split(':')
+            monday = datetime.strptime(f"{week}-1", '%G-W%V-%u').date()
+            sunday = datetime.strptime(f"{week}-7", '%G-W%V-%u').date()
+            sql, params = " WHERE room_key = ? AND date BETWEEN ? AND ?", (key, monday.isoformat(), sunday.isoformat())
+        else:
+            return None
+        rows = self[kind]._read(sql, params)
+        return sorted(({"id": row["id"], **entry_fields(kind, row)} for row in rows), key=SORT_KEYS[kind])
+
+    def prune(self, days):
+        """Delete log entries older than days and raise the floor kiosks can sync from."""
+        from datetime import timedelta
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+        with self.write() as conn:
+            floor = conn.execute("SELECT MAX(rev) FROM changes WHERE at < ?", (cutoff,)).fetchone()[0]
+            if floor is None:
+                return {"deleted": 0}
+            deleted = conn.execute("DELETE FROM changes WHERE rev <= ?", (floor,)).rowcount
+            conn.execute("UPDATE meta SET value = MAX(value, ?) WHERE name = 'floor'", (floor,))
+        return {"deleted": deleted, "floor": floor}
+
+
+def open_storage(backend=None, **options):
+    """The storage for backend (default $STORAGE_BACKEND); options go to its constructor."""
+    backend = (backend or storage_backend()).lower()
+    if backend == "sqlite":
+        return SQLiteStorage(**options)
+    if backend == "firestore":
+        return FirestoreStorage(**options)
+    raise ValueError(f"STORAGE_BACKEND must be one of {', '.join(BACKENDS)}, not {backend}")
+
+
+# ---------------- CLI ---------------- #
+def copy(source, target, collections=REVISIONED + ("users",), auth_accounts=False):
+    """Merge every row of source's collections into target, streamed one chunk (one revision) at a time.
+
+    Users copied into Firestore also need Firebase Auth accounts: with auth_accounts each
+    gets a passwordless one under the same ID (rows whose email another account holds are
+    skipped); without it, users are not copied to Firestore at all.
+    """
+    started = time.perf_counter()
+    count = batches = skipped = 0
+    for name in collections:
+        adopt = name == "users" and target.backend == "firestore"
+        if adopt and not auth_accounts:
+            print("⚠️ Not copying users: Firestore logins need Firebase Auth accounts (--auth-accounts)", file=sys.stderr)
+            continue
+        for chunk in _batches(source[name].stream(), target[name].chunk_size):
+            ops = []
+            for row in chunk:
+                doc_id = row.pop("id")
+                if adopt and not target.users.adopt_account(doc_id, row.get("email")):
+                    print(f"⚠️ Skipping user {doc_id}: {row.get('email')} has another auth account", file=sys.stderr)
+                    skipped += 1
+                    continue
+                ops.append(("merge", doc_id, row, None))
+            errors = target[name].write_many(ops)
+            count += len(ops) - len(errors)
+            skipped += len(errors)
+            batches += 1
+    return _report(count, batches, skipped, started)
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Storage backends")
+    parser.add_argument('action', choices=['copy', 'prune'])
+    parser.add_argument('--from', dest='source', choices=BACKENDS, default='firestore')
+    parser.add_argument('--to', dest='target', choices=BACKENDS, default='sqlite')
+    parser.add_argument('--sqlite', help="SQLite file (default: $STORAGE_SQLITE or store.db)")
+    parser.add_argument('--days', type=float, default=7, help="prune: keep this many days of change log")
+    parser.add_argument('--auth-accounts', action='store_true',
+                        help="copy to firestore: create passwordless Firebase Auth accounts for users (else users are skipped)")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    if args.action == 'prune':
+        # Firestore's log is pruned by `python changes.py prune`
+        print(json.dumps(SQLiteStorage(args.sqlite).prune(args.days)), file=sys.stderr)
+        return
+    if args.source == args.target:
+        parser.error("--from and --to must differ")
+    options = {"sqlite": {"path": args.sqlite}, "firestore": {}}
+    report = copy(open_storage(args.source, **options[args.source]), open_storage(args.target, **options[args.target]),
+                  auth_accounts=args.auth_accounts)
+    print(json.dumps(report), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
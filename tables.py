@@ -0,0 +1,161 @@
+"""Server-side search, filtering, sorting and paging for the kiosk tables.
+
+The page renders only the first window of each table and fetches the rest
+from /tables/<name> as the kiosk scrolls or types. Each table's rows are
+indexed once per data version (lowercased search text, sort orders, recent
+query results), so a keystroke or scroll is a scan of precomputed strings
+rather than a Firestore read or a walk over every <tr>.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from flask import get_template_attribute
+
+from pagecache import ROW_MACROS, init_row_macros
+from schedule import DAYS
+
+TABLE_PAGE_SIZE = int(os.getenv('TABLE_PAGE_SIZE', 50))     # rows per window, and on the first render
+TABLE_MAX_PAGE_SIZE = 200
+TABLE_QUERY_CACHE = 32      # matching row lists kept per index, so scrolling doesn't re-filter
+
+# Fields matched by ?q=, accepted by ?sort= and filtered on by ?<field>=value, per table
+TABLES = {
+    "rooms": {
+        "search": ["id", "name"],
+        "sort": ["id", "name"],
+        "filters": [],
+        "default_sort": ["id"],
+    },
+    "timetable": {
+        "search": ["day", "period", "subject", "teacher", "room", "start_time", "end_time"],
+        "sort": ["day", "period", "subject", "teacher", "room", "start_time"],
+        "filters": ["day", "room", "teacher"],
+        "default_sort": ["day", "start_time", "period"],
+    },
+    "exams": {
+        "search": ["name", "date", "room", "start_time", "end_time"],
+        "sort": ["name", "date", "room", "start_time"],
+        "filters": ["date", "room"],
+        "default_sort": ["date", "start_time"],
+    },
+}
+
+
+def _natural(value):
+    # "Room 9" before "Room 10"; the split alternates text and digits, so keys always compare
+    return [int(part) if i % 2 else part for i, part in enumerate(re.split(r'(\d+)', str(value or '').lower()))]
+
+
+def _sort_key(field):
+    if field == "day":
+        return lambda row: DAYS.index(row.get("day")) if row.get("day") in DAYS else len(DAYS)
+    return lambda row: _natural(row.get(field))
+
+
+class TableIndex:
+    """One table's rows at one data version, ready to be queried."""
+
+    def __init__(self, name, rows):
+        spec = TABLES[name]
+        self.name = name
+        self.rows = rows
+        self.text = ['\t'.join(str(row.get(field) or '') for field in spec["search"]).lower() for row in rows]
+        self._default = spec["default_sort"]
+        self._orders = {}
+        self._matches = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _order(self, sort, desc):
+        key = (sort, desc)
+        order = self._orders.get(key)
+        if order is None:
+            keys = [_sort_key(field) for field in dict.fromkeys([sort] + self._default)]
+            order = sorted(range(len(self.rows)), key=lambda i: [k(self.rows[i]) for k in keys], reverse=desc)
+            self._orders[key] = order
+        return order
+
+    def query(self, q='', filters=None, sort=None, desc=False, offset=0, limit=TABLE_PAGE_SIZE):
+        """Return (rows, total): one page of the rows matching every word of q and every filter."""
+        terms = q.lower().split()
+        filters = {field: value.strip().lower() for field, value in (filters or {}).items() if value.strip()}
+        order = self._order(sort or self._default[0], desc)
+        if not terms and not filters:
+            return [self.rows[i] for i in order[offset:offset + limit]], len(order)
+
+        key = (tuple(terms), tuple(sorted(filters.items())), sort, desc)
+        with self._lock:
+            matches = self._matches.get(key)
+            if matches is not None:
+                self._matches.move_to_end(key)
+        if matches is None:
+            matches = [i for i in order
+                       if all(term in self.text[i] for term in terms)
+                       and all(str(self.rows[i].get(field) or '').lower() == value for field, value in filters.items())]
+            with self._lock:
+                self._matches[key] = matches
+                while len(self._matches) > TABLE_QUERY_CACHE:
+                    self._matches.popitem(last=False)
+        return [self.rows[i] for i in matches[offset:offset + limit]], len(matches)
+
+
+_indexes = {}       # table name -> (version, TableIndex)
+_indexes_lock = threading.Lock()
+
+
+def index_for(name, version, load):
+    """The TableIndex for name at version; load() returns the rows and only runs for a new version.
+
+    version=None (rows of unknown age) always builds a fresh, uncached index.
+    """
+    if version is None:
+        return TableIndex(name, load())
+    cached = _indexes.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    index = TableIndex(name, load())
+    with _indexes_lock:
+        _indexes[name] = (version, index)
+    return index
+
+
+def parse_query(name, args):
+    """TableIndex.query() arguments from request args; raises ValueError for bad ones."""
+    spec = TABLES[name]
+    sort = args.get('sort', '').strip()
+    desc = sort.startswith('-')
+    sort = sort.lstrip('-') or None
+    if sort is not None and sort not in spec["sort"]:
+        raise ValueError(f"sort must be one of {', '.join(spec['sort'])}")
+    try:
+        offset = int(args.get('offset', 0))
+        limit = int(args.get('limit', TABLE_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("offset and limit must be integers")
+    if offset < 0 or not 1 <= limit <= TABLE_MAX_PAGE_SIZE:
+        raise ValueError(f"offset must be >= 0 and limit between 1 and {TABLE_MAX_PAGE_SIZE}")
+    return {
+        "q": args.get('q', ''),
+        "filters": {field: args[field] for field in spec["filters"] if field in args},
+        "sort": sort,
+        "desc": desc,
+        "offset": offset,
+        "limit": limit,
+    }
+
+
+def query_table(name, version, load, args):
+    """JSON body for GET /tables/<name>; ?html=1 adds each row's <tr> rendered by the page's macros."""
+    params = parse_query(name, args)
+    rows, total = index_for(name, version, load).query(**params)
+    body = {"success": True, "total": total, "offset": params["offset"], "limit": params["limit"],
+            "version": version, "items": rows}
+    if args.get('html') == '1':
+        macro = get_template_attribute('_user_rows.html', ROW_MACROS[name])
+        body["html"] = [str(macro(row)) for row in rows]
+    return body
+
+
+def init_tables(app):
+    init_row_macros(app)
+    app.add_template_global(TABLE_PAGE_SIZE, 'table_page_size')
@@ -0,0 +1,56 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from changes import ChangeFeed  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+
+def make_feed(tmp_path, memory=100):
+    store = SQLiteStorage(str(tmp_path / 'store.db'))
+    changed = []
+    feed = ChangeFeed(store, lambda collection, row: {**row, "from": collection}, interval=0, memory=memory,
+                      on_change=changed.append)
+    return store, feed, changed
+
+
+def test_since_returns_the_latest_row_per_document(tmp_path):
+    store, feed, changed = make_feed(tmp_path)
+    store.rooms.create('J-307', {"name": "HOD ROOM", "video": "a.mp4"})
+    start = feed.since(0)["rev"]
+
+    store.rooms.update('J-307', {"name": "STAFF ROOM"})
+    store.rooms.create('J-308', {"name": "LAB", "video": "b.mp4"})
+    store.rooms.delete('J-308')
+    delta = feed.since(start)
+
+    assert delta["rev"] == store.revision() and not delta["reset"] and not delta["more"]
+    assert [row["name"] for row in delta["changes"]["rooms"]["upserts"]] == ["STAFF ROOM"]
+    assert delta["changes"]["rooms"]["upserts"][0]["from"] == "rooms"
+    assert delta["changes"]["rooms"]["deletes"] == ["J-308"]
+    assert changed[-1] == {"rooms"}
+    assert feed.since(delta["rev"])["changes"] == {}
+
+
+def test_since_before_the_window_reads_the_log(tmp_path):
+    store, feed, _ = make_feed(tmp_path, memory=2)
+    feed.poll()
+    for i in range(5):
+        store.timetable.create(f't{i}', {"day": "Monday", "room": "J-307", "start_time": "09:00", "end_time": "10:00"})
+    feed.poll()
+    assert feed._base > 0
+
+    delta = feed.since(0)
+    assert sorted(row["id"] for row in delta["changes"]["timetable"]["upserts"]) == [f't{i}' for i in range(5)]
+
+
+def test_since_after_prune_asks_for_a_reload(tmp_path):
+    store, feed, _ = make_feed(tmp_path, memory=1)
+    for i in range(3):
+        store.rooms.create(f'R{i}', {"name": f"ROOM {i}", "video": ""})
+    feed.poll()
+    store.prune(days=-1)
+
+    delta = feed.since(1)
+    assert delta["reset"] and delta["changes"] == {}
@@ -0,0 +1,30 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fanout  # noqa: E402
+from fanout import fetch_all, hung_fetches  # noqa: E402
+
+
+def test_hung_fetches_do_not_hold_up_later_requests(monkeypatch):
+    monkeypatch.setattr(fanout, 'FANOUT_MAX_HUNG', 3)
+    release = threading.Event()
+    try:
+        for _ in range(3):
+            result = fetch_all({"slow": release.wait, "fast": lambda: [1]}, timeout=0.05)
+            assert result.degraded == ["slow"] and result["fast"] == [1]
+        assert hung_fetches() == 3
+
+        # At the cap nothing new is started, so a stuck backend can't pile up threads
+        result = fetch_all({"fast": lambda: [1]}, timeout=0.05, defaults={"fast": []})
+        assert result.degraded == ["fast"] and result["fast"] == []
+    finally:
+        release.set()
+
+    for thread in threading.enumerate():
+        if thread.name.startswith('fanout'):
+            thread.join(timeout=1)
+    assert hung_fetches() == 0
+    assert fetch_all({"fast": lambda: [1]})["fast"] == [1]
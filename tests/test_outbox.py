@@ -0,0 +1,112 @@
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+from aiosmtpd.controller import Controller
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import outbox  # noqa: E402
+from outbox import Outbox, SMTPPool  # noqa: E402
+
+
+class Handler:
+    """Local SMTP stand-in: answers DATA with the queued replies, then 250."""
+
+    def __init__(self, replies=()):
+        self.replies = list(replies)
+        self.received = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('nobody@'):
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.replies:
+            return self.replies.pop(0)
+        self.received.append((envelope.rcpt_tos, envelope.content.decode()))
+        return '250 OK'
+
+
+def make_outbox(tmp_path, handler, monkeypatch):
+    monkeypatch.setattr(outbox, 'OUTBOX_RETRY_DELAY', 0.2)
+    monkeypatch.setattr(outbox, 'OUTBOX_POLL_INTERVAL', 0.05)
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    pool = SMTPPool('127.0.0.1', port, starttls=False)
+    return controller, Outbox(pool, 'ims@example.com', db_path=str(tmp_path / 'outbox.db'), workers=1)
+
+
+def rows(tmp_path):
+    with sqlite3.connect(tmp_path / 'outbox.db') as conn:
+        return conn.execute("SELECT recipient, status, attempts, error, next_attempt_at, created_at FROM outbox "
+                            "ORDER BY id").fetchall()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_batch_is_sent_over_one_connection(tmp_path, monkeypatch):
+    handler = Handler()
+    controller, box = make_outbox(tmp_path, handler, monkeypatch)
+    try:
+        box.enqueue_many([(f'user{i}@example.com', 'Notice', f'<p>Hello {i}</p>') for i in range(3)])
+        wait_for(lambda: box.stats()["sent"] == 3)
+        assert sorted(to[0] for to, _ in handler.received) == [f'user{i}@example.com' for i in range(3)]
+        assert 'Subject: Notice' in handler.received[0][1]
+        assert box.stats()["connections_opened"] == 1
+    finally:
+        controller.stop()
+
+
+def test_temporary_failure_is_retried_with_backoff(tmp_path, monkeypatch):
+    handler = Handler(replies=['451 Try again later'])
+    controller, box = make_outbox(tmp_path, handler, monkeypatch)
+    try:
+        box.enqueue('user@example.com', 'Retry', '<p>Hi</p>')
+        wait_for(lambda: rows(tmp_path)[0][3] is not None)
+        recipient, status, attempts, error, next_attempt_at, created_at = rows(tmp_path)[0]
+        assert '451' in error and next_attempt_at - created_at >= outbox.OUTBOX_RETRY_DELAY
+
+        wait_for(lambda: box.stats()["sent"] == 1)
+        assert rows(tmp_path)[0][1:4] == ('sent', 2, None)
+    finally:
+        controller.stop()
+
+
+def test_permanent_failures_are_not_retried(tmp_path, monkeypatch):
+    handler = Handler(replies=['554 Rejected'])
+    controller, box = make_outbox(tmp_path, handler, monkeypatch)
+    try:
+        box.enqueue_many([('user@example.com', 'A', 'x'), ('nobody@example.com', 'B', 'y')])
+        wait_for(lambda: box.stats()["failed"] == 2)
+        assert [(r[0], r[2]) for r in rows(tmp_path)] == [('user@example.com', 1), ('nobody@example.com', 1)]
+        assert handler.received == []
+    finally:
+        controller.stop()
+
+
+def test_backoff_doubles_per_attempt(tmp_path, monkeypatch):
+    box = Outbox(None, 'ims@example.com', db_path=str(tmp_path / 'outbox.db'), workers=0)
+    monkeypatch.setattr(box, 'start', lambda: None)
+    message_id = box.enqueue('user@example.com', 'S', 'b')
+    delays = []
+    for attempts in (1, 2, 3):
+        before = time.time()
+        box._failed(message_id, attempts, OSError('down'), retry=True)
+        delays.append(rows(tmp_path)[0][4] - before)
+    assert [round(d / outbox.OUTBOX_RETRY_DELAY) for d in delays] == [1, 2, 4]
+
+    box._failed(message_id, outbox.OUTBOX_MAX_ATTEMPTS, OSError('down'), retry=True)
+    assert rows(tmp_path)[0][1] == 'failed'
@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import passwords  # noqa: E402
+from passwords import PasswordHasher, RateLimiter, login_allowed, login_succeeded  # noqa: E402
+
+
+def test_failures_elsewhere_do_not_lock_out_an_email(monkeypatch):
+    monkeypatch.setattr(passwords, 'login_limiter', RateLimiter(rate_per_minute=0.001, burst=2))
+    monkeypatch.setattr(passwords, 'ip_limiter', RateLimiter(rate_per_minute=0.001, burst=3))
+
+    assert login_allowed('10.0.0.9', 'victim@b.c')[0]
+    assert login_allowed('10.0.0.9', 'victim@b.c')[0]
+    allowed, retry_after = login_allowed('10.0.0.9', 'VICTIM@b.c ')
+    assert not allowed and retry_after > 0
+    assert login_allowed('10.0.0.1', 'victim@b.c')[0]
+
+    # The attacker's IP runs out across emails too
+    assert login_allowed('10.0.0.9', 'other@b.c')[0]
+    assert not login_allowed('10.0.0.9', 'third@b.c')[0]
+
+
+def test_successful_logins_are_refunded(monkeypatch):
+    monkeypatch.setattr(passwords, 'login_limiter', RateLimiter(rate_per_minute=0.001, burst=2))
+    monkeypatch.setattr(passwords, 'ip_limiter', RateLimiter(rate_per_minute=0.001, burst=2))
+    for _ in range(5):
+        assert login_allowed('10.0.0.2', 'a@b.c')[0]
+        login_succeeded('10.0.0.2', 'a@b.c')
+
+
+def test_unknown_account_is_checked_against_the_dummy_hash(monkeypatch):
+    hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=1)
+    checked = []
+    monkeypatch.setattr(hasher, '_submit', lambda fn, *args: checked.append(args) or fn(*args))
+
+    assert hasher.verify(None, 'guess') == (False, None)
+    assert checked[-1][0] == hasher.dummy_hash and checked[-1][1] == 'guess'
+
+    stored = hasher.hash('secret')
+    assert hasher.verify(stored, 'secret') == (True, None)
+    assert hasher.verify(stored, 'guess') == (False, None)
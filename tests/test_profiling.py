@@ -0,0 +1,48 @@
+import os
+import sys
+
+from flask import Flask, render_template_string, session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import profiling  # noqa: E402
+from profiling import SPANS, init_profiling  # noqa: E402
+
+
+def make_app():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    init_profiling(app, is_admin=lambda: session.get('admin', False))
+    return app
+
+
+def test_metrics_need_an_admin_or_the_token(monkeypatch):
+    monkeypatch.setattr(profiling, 'METRICS_TOKEN', None)
+    client = make_app().test_client()
+    assert client.get('/metrics').status_code == 401
+
+    with client.session_transaction() as s:
+        s['admin'] = True
+    assert client.get('/metrics').status_code == 200
+
+    monkeypatch.setattr(profiling, 'METRICS_TOKEN', 'secret')
+    client = make_app().test_client()
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+
+def renders_recorded():
+    return SPANS._series[('render.None',)][2]
+
+
+def test_nested_renders_are_each_recorded():
+    app = make_app()
+
+    @app.route('/page')
+    def page():
+        return render_template_string('<p>{{ inner() }}</p>', inner=lambda: render_template_string('<b>{{ x }}</b>', x=1))
+
+    before = renders_recorded()
+    assert app.test_client().get('/page').status_code == 200
+    # The outer render finishes after the one inside it and still has its own start time
+    assert renders_recorded() - before == 2
@@ -0,0 +1,99 @@
+import os
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import routing  # noqa: E402
+from routing import Graph, Router, graph_revision, import_graph, init_routing, load_graph  # noqa: E402
+
+
+def make_db():
+    conn = sqlite3.connect(':memory:')
+    # admin.init_db owns the revisions table
+    conn.execute("CREATE TABLE revisions (name TEXT PRIMARY KEY, rev INTEGER NOT NULL)")
+    init_routing(conn)
+    return conn
+
+
+def grid(width, height, seed=3):
+    """A floor plan with random corridor lengths and a few one-way edges."""
+    rng = random.Random(seed)
+    nodes = [{"id": f"N{x}-{y}", "kind": "corridor", "floor": 0, "x": x, "y": y, "label": None}
+             for x in range(width) for y in range(height)]
+    edges = []
+    for x in range(width):
+        for y in range(height):
+            for dx, dy in ((1, 0), (0, 1)):
+                if x + dx < width and y + dy < height:
+                    a, b = f"N{x}-{y}", f"N{x + dx}-{y + dy}"
+                    weight = rng.uniform(1, 10)
+                    edges.append({"src": a, "dst": b, "weight": weight, "kind": "walk", "video": None, "instruction": None})
+                    if rng.random() > 0.1:
+                        edges.append({"src": b, "dst": a, "weight": weight, "kind": "walk", "video": None,
+                                      "instruction": None})
+    return nodes, edges
+
+
+def test_all_pairs_and_landmark_astar_agree(monkeypatch):
+    nodes, edges = grid(12, 10)
+    monkeypatch.setattr(routing, 'ROUTE_ALL_PAIRS_LIMIT', 10_000)
+    trees = Graph(nodes, edges).prepare()
+    monkeypatch.setattr(routing, 'ROUTE_ALL_PAIRS_LIMIT', 0)
+    alt = Graph(nodes, edges).prepare()
+    assert trees._trees is not None and alt._trees is None
+
+    rng = random.Random(5)
+    ids = [n["id"] for n in nodes]
+    for _ in range(300):
+        source, target = rng.choice(ids), rng.choice(ids)
+        expected, found = trees.shortest_path(source, target), alt.shortest_path(source, target)
+        if expected is None:
+            assert found is None
+            continue
+        assert abs(found[0] - expected[0]) < 1e-9
+        # Ties could pick different paths; both must cost the same
+        assert abs(sum(alt.edges[(alt.index[a], alt.index[b])]["weight"]
+                       for a, b in zip(found[1], found[1][1:])) - expected[0]) < 1e-9
+
+
+def test_import_graph_bumps_revision_and_routes():
+    conn = make_db()
+    assert graph_revision(conn) == 0
+    report = import_graph(conn, {
+        "nodes": [{"id": "ENTRANCE", "kind": "entrance", "x": 0, "y": 0},
+                  {"id": "J-307", "kind": "room", "x": 3, "y": 4}],
+        "edges": [{"from": "ENTRANCE", "to": "J-307", "video": "in.mp4", "reverse_video": "out.mp4"}],
+    })
+    assert report == {"nodes": 2, "edges": 2}
+    assert graph_revision(conn) == 1
+
+    route = load_graph(conn).prepare().route("entrance", "j-307")
+    assert route["distance"] == 5
+    assert [step["video"] for step in route["steps"]] == ["in.mp4"]
+
+
+def test_router_checks_revision_at_most_every_ttl():
+    calls = {"revision": 0, "loads": 0}
+    revision = [1]
+
+    def read_revision():
+        calls["revision"] += 1
+        return revision[0]
+
+    def loader():
+        calls["loads"] += 1
+        return Graph([{"id": "A", "kind": "room", "floor": 0, "label": None}], [])
+
+    router = Router(loader, revision=read_revision, ttl=3600)
+    for _ in range(10):
+        router.graph()
+    assert calls == {"revision": 1, "loads": 1}
+
+    revision[0] = 2
+    router.graph()
+    assert calls["loads"] == 1
+    router.invalidate()
+    router.graph()
+    assert calls == {"revision": 2, "loads": 2}
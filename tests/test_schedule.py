@@ -0,0 +1,125 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schedule import ScheduleIndex, Timeline, sweep_overlaps  # noqa: E402
+
+
+def brute_overlapping(items, start, end):
+    return [entry_id for s, e, entry_id in sorted(items) if s < end and e > start]
+
+
+def test_timeline_queries():
+    timeline = Timeline()
+    timeline.add(0, 600, 'long')
+    timeline.add(60, 120, 'a')
+    timeline.add(120, 180, 'b')
+    timeline.add(300, 360, 'c')
+
+    assert timeline.at(90) == ['long', 'a']
+    assert timeline.at(120) == ['long', 'b']
+    assert timeline.overlapping(100, 130) == ['long', 'a', 'b']
+    assert timeline.overlaps(590, 700)
+    assert not timeline.overlaps(600, 700)
+    assert timeline.next_after(120) == (300, 360, 'c')
+    assert timeline.next_after(300) is None
+    assert timeline.first() == (0, 600, 'long')
+
+
+def test_timeline_edits_between_queries():
+    timeline = Timeline()
+    for i in range(50):
+        timeline.add(i * 10, i * 10 + 5, f'e{i}')
+    assert timeline.at(12) == ['e1']
+
+    timeline.remove(10, 15, 'e1')
+    timeline.add(11, 40, 'moved')
+    assert timeline.at(12) == ['moved']
+    assert timeline.overlapping(0, 25) == ['e0', 'moved', 'e2']
+    timeline.remove(11, 40, 'moved')
+    assert not timeline.overlaps(6, 20)
+
+
+def test_timeline_matches_brute_force():
+    rng = random.Random(7)
+    timeline, live = Timeline(), set()
+    for step in range(3000):
+        if live and rng.random() < 0.4:
+            item = rng.choice(sorted(live))
+            timeline.remove(*item)
+            live.discard(item)
+        else:
+            start = rng.randrange(1000)
+            item = (start, start + rng.randrange(1, 90), f'e{step}')
+            timeline.add(*item)
+            live.add(item)
+        start = rng.randrange(1100)
+        end = start + rng.randrange(1, 60)
+        assert timeline.overlapping(start, end) == brute_overlapping(live, start, end)
+        assert timeline.overlaps(start, end) == bool(brute_overlapping(live, start, end))
+    assert timeline.items == sorted(live)
+
+
+def test_sweep_overlaps_finds_every_pair():
+    intervals = [(0, 60, 'a'), (30, 90, 'b'), (60, 120, 'c'), (100, 110, 'd'), (200, 210, 'e')]
+    found = {frozenset(pair) for pair in sweep_overlaps(intervals)}
+    assert found == {frozenset('ab'), frozenset('bc'), frozenset('cd')}
+
+
+def test_sweep_overlaps_touching_intervals_do_not_clash():
+    assert list(sweep_overlaps([(0, 60, 'a'), (60, 120, 'b')])) == []
+
+
+def make_index():
+    index = ScheduleIndex()
+    index.set_rooms([{"id": "J-307", "name": "HOD ROOM"}, {"id": "J-308", "name": "LAB 1"}])
+    index.sync("timetable", [
+        {"id": "t1", "day": "Monday", "start_time": "09:00", "end_time": "10:00", "room": "J-307", "teacher": "Rao"},
+        {"id": "t2", "day": "Monday", "start_time": "10:00", "end_time": "11:00", "room": "LAB 1", "teacher": "Iyer"},
+    ])
+    index.sync("exams", [
+        {"id": "x1", "date": "2030-01-08", "start_time": "09:00", "end_time": "12:00", "room": "J-308"},
+    ])
+    return index
+
+
+def test_conflicts_for_room_by_id_or_name():
+    index = make_index()
+    row = {"id": "new", "day": "Monday", "start_time": "09:30", "end_time": "10:30", "room": "hod room", "teacher": "Das"}
+    assert [(c["reason"], c["entry"]["id"]) for c in index.conflicts_for("timetable", row)] == [("room", "t1")]
+
+
+def test_conflicts_for_teacher_and_edit_of_itself():
+    index = make_index()
+    row = {"id": "new", "day": "Monday", "start_time": "10:30", "end_time": "11:30", "room": "J-999", "teacher": "IYER"}
+    assert [(c["reason"], c["entry"]["id"]) for c in index.conflicts_for("timetable", row)] == [("teacher", "t2")]
+    # Moving an entry within its own slot is not a clash with itself
+    assert index.conflicts_for("timetable", {**index.entry("timetable", "t2"), "end_time": "10:45"}) == []
+
+
+def test_exam_clashes_with_exams_and_weekly_classes():
+    index = make_index()
+    # 2030-01-07 is a Monday
+    monday = {"id": "x2", "date": "2030-01-07", "start_time": "09:30", "end_time": "10:30", "room": "J-307"}
+    assert [(c["kind"], c["entry"]["id"]) for c in index.conflicts_for("exams", monday)] == [("timetable", "t1")]
+    same_room = {"id": "x3", "date": "2030-01-08", "start_time": "11:00", "end_time": "13:00", "room": "LAB 1"}
+    assert [(c["kind"], c["entry"]["id"]) for c in index.conflicts_for("exams", same_room)] == [("exams", "x1")]
+
+
+def test_set_rooms_replaces_entries_under_the_new_name():
+    index = make_index()
+    index.set_rooms([{"id": "J-307", "name": "STAFF ROOM"}, {"id": "J-308", "name": "LAB 1"}])
+    row = {"id": "new", "day": "Monday", "start_time": "09:00", "end_time": "09:30", "room": "staff room", "teacher": "Das"}
+    assert [c["entry"]["id"] for c in index.conflicts_for("timetable", row)] == ["t1"]
+
+
+def test_validate_reports_each_clash_once():
+    index = make_index()
+    index.upsert("timetable", {"id": "t3", "day": "Monday", "start_time": "09:30", "end_time": "10:30",
+                               "room": "J-307", "teacher": "Iyer"})
+    found = sorted((c["reason"], sorted(e["id"] for e in c["entries"])) for c in index.validate())
+    assert found == [("room", ["t1", "t3"]), ("teacher", ["t2", "t3"])]
+    index.remove("timetable", "t3")
+    assert index.validate() == []
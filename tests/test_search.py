@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import init_search, search_rooms  # noqa: E402
+
+
+def make_db(rooms):
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE rooms (id TEXT PRIMARY KEY, name TEXT NOT NULL, video TEXT NOT NULL)")
+    conn.executemany("INSERT INTO rooms VALUES (?, ?, '')", rooms)
+    assert init_search(conn)
+    return conn
+
+
+def ids(rows):
+    return [row[0] for row in rows]
+
+
+def test_stored_keys_and_queries_compact_alike():
+    conn = make_db([('J-307', 'Lab One'), ('K-110', 'Staff Room')])
+    assert ids(search_rooms(conn, 'lab one')) == ['J-307']
+    assert ids(search_rooms(conn, 'LAB-1')) == ['J-307']
+    assert ids(search_rooms(conn, 'j three oh seven')) == ['J-307']
+    # Rooms written after init go through the same triggers
+    conn.execute("INSERT INTO rooms VALUES ('Z-9', 'Room Three', '')")
+    assert ids(search_rooms(conn, 'room 3')) == ['Z-9']
+
+
+def test_unsearchable_query_matches_nothing():
+    conn = make_db([('J-307', 'Lab One'), ('K-110', 'Staff Room')])
+    assert search_rooms(conn, 'कक्ष') == []
+    assert search_rooms(conn, '--') == []
+    assert ids(search_rooms(conn, '')) == ['J-307', 'K-110']
@@ -0,0 +1,79 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schedule import ScheduleIndex  # noqa: E402
+from snapshot import Snapshot, SnapshotStore, write_snapshot  # noqa: E402
+
+COLLECTIONS = {
+    "rooms": [
+        {"id": "J-307", "name": "HOD ROOM", "video": "J-307.mp4"},
+        {"id": "J-308", "name": "Lab One", "video": "J-308.mp4", "floor": 3},
+    ],
+    "timetable": [
+        {"id": "t1", "day": "Monday", "period": "1", "subject": "Maths", "teacher": "Rao", "room": "J-307",
+         "start_time": "09:00", "end_time": "10:00"},
+        {"id": "t2", "day": "Monday", "period": "2", "subject": "Physics", "teacher": "Rao", "room": "LAB ONE",
+         "start_time": "10:00", "end_time": "11:00"},
+    ],
+    "exams": [
+        {"id": "x1", "name": "Midterm", "date": datetime(2030, 1, 8), "room": "J-308",
+         "start_time": "09:00", "end_time": "12:00"},
+    ],
+}
+
+
+def test_round_trip_rows(tmp_path):
+    path = str(tmp_path / 'kiosk.snap')
+    meta = write_snapshot(path, COLLECTIONS, version=7)
+    snapshot = Snapshot(path)
+
+    assert snapshot.version == 7 and meta["counts"] == {"rooms": 2, "timetable": 2, "exams": 1}
+    assert snapshot.rows('rooms') == COLLECTIONS["rooms"]
+    assert snapshot.rows('timetable') == COLLECTIONS["timetable"]
+    # Non-string values go through JSON; dates come back as YYYY-MM-DD like the loaders produce
+    assert snapshot.rows('exams')[0]["date"] == '2030-01-08'
+    assert snapshot.rows('missing') == []
+
+
+def test_search_by_compacted_prefix(tmp_path):
+    path = str(tmp_path / 'kiosk.snap')
+    write_snapshot(path, COLLECTIONS)
+    snapshot = Snapshot(path)
+
+    assert [room["id"] for room in snapshot.search('j 30')] == ['J-307', 'J-308']
+    assert [room["id"] for room in snapshot.search('lab-one')] == ['J-308']
+    assert snapshot.search('--') == []
+
+
+def test_schedule_index_matches_a_fresh_one(tmp_path):
+    path = str(tmp_path / 'kiosk.snap')
+    write_snapshot(path, COLLECTIONS)
+    snapshot = Snapshot(path)
+    fresh = ScheduleIndex()
+    fresh.set_rooms(snapshot.rows('rooms'))
+    fresh.sync('timetable', snapshot.rows('timetable'))
+    fresh.sync('exams', snapshot.rows('exams'))
+
+    restored = snapshot.schedule_index()
+    assert sorted(restored.timelines()) == sorted(fresh.timelines())
+    when = datetime(2030, 1, 7, 10, 30)
+    assert restored.room_status('lab one', when) == fresh.room_status('lab one', when)
+    assert restored.teacher_status('Rao', when)["now"] == [snapshot.rows('timetable')[1]]
+    assert snapshot.schedule_index() is restored
+
+
+def test_store_swaps_to_a_newer_file(tmp_path):
+    path = str(tmp_path / 'kiosk.snap')
+    store = SnapshotStore(path, check_interval=0)
+    assert store.get() is None
+
+    write_snapshot(path, COLLECTIONS, version=1)
+    old = store.get()
+    assert old.version == 1
+    write_snapshot(path, {**COLLECTIONS, "rooms": COLLECTIONS["rooms"][:1]}, version=2)
+    assert store.get().version == 2
+    # The old mapping stays readable for whoever still holds it
+    assert len(old.rows('rooms')) == 2
@@ -0,0 +1,45 @@
+import os
+import sys
+
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profiling import init_profiling  # noqa: E402
+from sqlite_pool import SQLitePool  # noqa: E402
+
+
+def make_app(tmp_path):
+    app = Flask(__name__)
+    init_profiling(app)
+    db = SQLitePool(str(tmp_path / 'test.db'), app)
+    with db.write() as conn:
+        conn.execute("CREATE TABLE rooms (id TEXT PRIMARY KEY)")
+    return app, db
+
+
+def test_connection_execute_is_timed(tmp_path):
+    app, db = make_app(tmp_path)
+
+    @app.route('/rooms')
+    def rooms():
+        return {"count": db.read().execute("SELECT COUNT(*) FROM rooms").fetchone()[0]}
+
+    response = app.test_client().get('/rooms')
+    assert response.status_code == 200
+    assert 'sqlite;dur=' in response.headers['Server-Timing']
+
+
+def test_connection_executemany_and_executescript_are_timed(tmp_path):
+    app, db = make_app(tmp_path)
+
+    @app.route('/write')
+    def write():
+        with db.write() as conn:
+            conn.executemany("INSERT INTO rooms (id) VALUES (?)", [('a',), ('b',)])
+            conn.executescript("DELETE FROM rooms WHERE id = 'a';")
+        return {"ok": True}
+
+    response = app.test_client().get('/write')
+    assert 'sqlite;dur=' in response.headers['Server-Timing']
+    assert 'desc="2x"' in response.headers['Server-Timing']
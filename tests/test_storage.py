@@ -0,0 +1,114 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import DELETE, NotFound, SQLiteStorage, StorageError, copy  # noqa: E402
+
+
+def make_store(tmp_path, name='store.db'):
+    return SQLiteStorage(str(tmp_path / name))
+
+
+def lesson(day, room, start, end, **extra):
+    return {"day": day, "period": "1", "subject": "Maths", "teacher": "Rao", "room": room,
+            "start_time": start, "end_time": end, **extra}
+
+
+def test_writes_bump_one_revision_per_commit(tmp_path):
+    store = make_store(tmp_path)
+    assert store.revision() == 0
+    store.rooms.create('J-307', {"name": "HOD ROOM", "video": "a.mp4", "floor": 3})
+    rev = store.timetable.commit([("create", "t1", lesson("Monday", "J-307", "09:00", "10:00"), None),
+                                  ("create", "t2", lesson("Monday", "J-307", "10:00", "11:00"), None)])
+    assert rev == store.revision() == 2
+
+    room = store.rooms.get('J-307')
+    # Fields outside the table's columns round-trip through the extra column
+    assert room["floor"] == 3 and room["rev"] == 1
+    store.rooms.update('J-307', {"floor": DELETE})
+    assert "floor" not in store.rooms.get('J-307')
+    assert [e[1:] for e in store.read_changes(0)[0]] == [("rooms", "J-307"), ("timetable", "t1"),
+                                                           ("timetable", "t2"), ("rooms", "J-307")]
+
+
+def test_update_of_missing_row_and_failed_check_write_nothing(tmp_path):
+    store = make_store(tmp_path)
+    with pytest.raises(NotFound):
+        store.rooms.update('nope', {"name": "X"})
+
+    def refuse(ops):
+        raise StorageError("clash")
+
+    with pytest.raises(StorageError):
+        store.timetable.create('t1', lesson("Monday", "J-307", "09:00", "10:00"), check=refuse)
+    assert store.timetable.get('t1') is None and store.revision() == 0
+
+
+def test_write_many_reports_failed_chunks(tmp_path):
+    store = make_store(tmp_path)
+    store.timetable.chunk_size = 2
+    ops = [("create", f"t{i}", lesson("Monday", "J-307", "09:00", "10:00"), None) for i in range(3)]
+    ops.insert(1, ("update", "missing", {"day": "Friday"}, None))
+    failed = store.timetable.write_many(ops)
+    assert sorted(failed) == [0, 1]
+    assert [row["id"] for row in store.timetable.stream()] == ["t1", "t2"]
+
+
+def test_rows_at_returns_rows_with_their_revision(tmp_path):
+    store = make_store(tmp_path)
+    store.rooms.create('J-307', {"name": "HOD ROOM", "video": "a.mp4"})
+    store.rooms.create('J-308', {"name": "LAB", "video": "b.mp4"})
+    rev, rows, exact = store.rows_at('rooms')
+    assert (rev, exact) == (2, True)
+    assert sorted(row["name"] for row in rows) == ["HOD ROOM", "LAB"]
+
+
+def test_views_follow_edits(tmp_path):
+    store = make_store(tmp_path)
+    store.timetable.create('t1', lesson("Monday", "J-307", "10:00", "11:00"))
+    store.timetable.create('t2', lesson("Monday", " j-307 ", "09:00", "10:00"))
+    store.timetable.create('t3', lesson("Tuesday", "J-308", "09:00", "10:00"))
+    store.exams.create('x1', {"name": "Midterm", "date": "2030-01-08", "room": "J-307",
+                              "start_time": "09:00", "end_time": "12:00"})
+
+    assert [row["id"] for row in store.view('room:j-307')] == ['t2', 't1']
+    assert [row["id"] for row in store.view('day:Tuesday')] == ['t3']
+    assert [row["id"] for row in store.view('room:j-307:2030-W02')] == ['x1']
+    assert store.view('room:j-307:2030-W03') == []
+
+    store.timetable.update('t1', {"room": "J-308"})
+    assert [row["id"] for row in store.view('room:j-307')] == ['t2']
+    assert store.view('unknown:x') is None
+    assert store.check_views() == []
+
+
+def test_password_reset_codes_are_single_use(tmp_path):
+    store = make_store(tmp_path)
+    uid = store.users.register('a@b.c', None, {"username": "a", "password": "old", "role": "admin"})
+    link = store.users.reset_link('a@b.c', 'http://kiosk/reset_password')
+    code = link.split('oobCode=')[1]
+
+    with pytest.raises(StorageError):
+        store.users.reset_password(code + 'x', 'new')
+    assert store.users.reset_password(code, 'new') == uid
+    assert store.users.get(uid)["password"] == 'new'
+    with pytest.raises(StorageError):
+        store.users.reset_password(code, 'again')
+    with pytest.raises(NotFound):
+        store.users.reset_link('nobody@b.c', 'http://kiosk/reset_password')
+
+
+def test_copy_streams_every_collection(tmp_path):
+    source, target = make_store(tmp_path, 'a.db'), make_store(tmp_path, 'b.db')
+    source.rooms.create('J-307', {"name": "HOD ROOM", "video": "a.mp4"})
+    source.timetable.write_many([("create", f"t{i}", lesson("Monday", "J-307", "09:00", "10:00"), None)
+                                 for i in range(5)])
+    source.users.register('a@b.c', None, {"username": "a", "password": "h", "role": "admin"})
+
+    report = copy(source, target)
+    assert report["rows"] == 7 and report["skipped"] == 0
+    assert len(list(target.timetable.stream())) == 5
+    assert target.users.account('a@b.c')["password"] == "h"
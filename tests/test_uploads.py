@@ -0,0 +1,109 @@
+import base64
+import hashlib
+import os
+import sys
+import time
+
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uploads  # noqa: E402
+from uploads import init_uploads  # noqa: E402
+
+VIDEO = os.urandom(3000)
+
+
+def make_app(tmp_path):
+    app = Flask(__name__)
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    os.makedirs(app.config['UPLOAD_FOLDER'])
+    completed = []
+    init_uploads(app, lambda: None, lambda room_id, filename: completed.append((room_id, filename)),
+                 filename='{room_id}.mp4')
+    return app, completed
+
+
+def start(client, data=VIDEO, sha256=None):
+    response = client.post('/uploads', json={"room_id": "J-307", "size": len(data), "sha256": sha256})
+    assert response.status_code == 201
+    return response.json["upload_id"]
+
+
+def patch(client, upload_id, offset, chunk, checksum=None):
+    headers = {'Upload-Offset': str(offset)}
+    if checksum is not None:
+        headers['Upload-Checksum'] = f"sha256 {base64.b64encode(checksum).decode()}"
+    return client.patch(f'/uploads/{upload_id}', data=chunk, headers=headers)
+
+
+def test_resume_from_reported_offset(tmp_path):
+    app, completed = make_app(tmp_path)
+    client = app.test_client()
+    upload_id = start(client, sha256=hashlib.sha256(VIDEO).hexdigest())
+
+    assert patch(client, upload_id, 0, VIDEO[:1000]).headers['Upload-Offset'] == '1000'
+    # A retried chunk at a stale offset is refused, and the client asks where to resume
+    assert patch(client, upload_id, 0, VIDEO[:1000]).status_code == 409
+    offset = int(client.head(f'/uploads/{upload_id}').headers['Upload-Offset'])
+    assert offset == 1000
+    assert patch(client, upload_id, offset, VIDEO[offset:]).status_code == 204
+
+    response = client.post(f'/uploads/{upload_id}/finalize')
+    assert response.json == {"success": True, "room_id": "J-307", "video": "J-307.mp4"}
+    assert completed == [("J-307", "J-307.mp4")]
+    with open(tmp_path / 'uploads' / 'J-307.mp4', 'rb') as f:
+        assert f.read() == VIDEO
+    assert os.listdir(tmp_path / 'uploads' / '.partial') == []
+
+
+def test_chunk_checksum_mismatch_is_rolled_back(tmp_path):
+    app, _ = make_app(tmp_path)
+    client = app.test_client()
+    upload_id = start(client)
+
+    response = patch(client, upload_id, 0, VIDEO[:500], checksum=hashlib.sha256(b'other').digest())
+    assert response.status_code == 460
+    assert client.head(f'/uploads/{upload_id}').headers['Upload-Offset'] == '0'
+    assert patch(client, upload_id, 0, VIDEO[:500], checksum=hashlib.sha256(VIDEO[:500]).digest()).status_code == 204
+
+
+def test_finalize_checks_size_and_whole_file_checksum(tmp_path):
+    app, completed = make_app(tmp_path)
+    client = app.test_client()
+    upload_id = start(client, sha256=hashlib.sha256(b'not the video').hexdigest())
+
+    patch(client, upload_id, 0, VIDEO[:10])
+    assert client.post(f'/uploads/{upload_id}/finalize').status_code == 409
+    patch(client, upload_id, 10, VIDEO[10:])
+    assert client.post(f'/uploads/{upload_id}/finalize').status_code == 460
+    assert completed == []
+
+
+def test_oversized_chunk_is_refused(tmp_path):
+    app, _ = make_app(tmp_path)
+    client = app.test_client()
+    upload_id = start(client)
+    assert patch(client, upload_id, 0, VIDEO + b'x').status_code == 413
+    assert client.head(f'/uploads/{upload_id}').headers['Upload-Offset'] == '0'
+
+
+def test_stale_partials_expire_by_last_chunk(tmp_path):
+    app, _ = make_app(tmp_path)
+    client = app.test_client()
+    stale, active = start(client), start(client)
+    partial = tmp_path / 'uploads' / '.partial'
+    old = time.time() - uploads.UPLOAD_EXPIRY - 60
+    for upload_id in (stale, active):
+        for ext in ('part', 'json'):
+            os.utime(partial / f'{upload_id}.{ext}', (old, old))
+    # A recent chunk keeps an old upload alive
+    patch(client, active, 0, VIDEO[:100])
+    (partial / 'notes.txt').write_text('not an upload')
+
+    start(client)
+    names = os.listdir(partial)
+    assert f'{stale}.part' not in names and f'{stale}.json' not in names
+    assert f'{active}.part' in names and f'{active}.json' in names
+    assert 'notes.txt' in names
+    assert client.get(f'/uploads/{stale}').status_code == 404
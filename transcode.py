@@ -0,0 +1,303 @@
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing, contextmanager
+
+# Transcoding configuration
+FFMPEG_BIN = os.getenv('FFMPEG_BIN', 'ffmpeg')
+FFPROBE_BIN = os.getenv('FFPROBE_BIN', 'ffprobe')
+TRANSCODE_DB = os.getenv('TRANSCODE_DB', 'jobs.db')
+TRANSCODE_WORKERS = int(os.getenv('TRANSCODE_WORKERS', 2))
+TRANSCODE_MAX_ATTEMPTS = 3
+TRANSCODE_RETRY_DELAY = 30      # seconds, doubled on every attempt
+TRANSCODE_POLL_INTERVAL = 2
+TRANSCODE_STALE_AFTER = 3600    # running jobs older than this are assumed lost
+HLS_SEGMENT_SECONDS = 4
+
+# (height, video kbit/s, x264 crf); only heights up to the source height are produced
+RENDITIONS = [
+    (360, 600, 28),
+    (480, 1000, 26),
+    (720, 2200, 24),
+]
+AUDIO_BITRATE = 96
+
+
+class TranscodeError(Exception):
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+# ---------------- WORKER (runs in the process pool) ---------------- #
+def _run(args):
+    result = subprocess.run(args, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise TranscodeError(f"{os.path.basename(args[0])} failed: {result.stderr.strip()[-500:]}")
+    return result.stdout
+
+
+def _probe_size(path):
+    """Return (width, height) of the first video stream, or (None, None)."""
+    try:
+        out = _run([FFPROBE_BIN, '-v', 'error', '-select_streams', 'v:0',
+                    '-show_entries', 'stream=width,height', '-of', 'json', path])
+        stream = json.loads(out)['streams'][0]
+        return stream['width'], stream['height']
+    except (TranscodeError, OSError, KeyError, IndexError, ValueError):
+        return None, None
+
+
+def transcode(source, tmp_dir):
+    """Produce MP4 renditions, HLS playlists and a poster for source in tmp_dir.
+
+    tmp_dir belongs to one job (see TranscodeQueue.work_dir), so two jobs for
+    the same room never touch each other's files; the queue moves it into
+    place with publish() once the job turns out to be the room's latest.
+    """
+    if not shutil.which(FFMPEG_BIN):
+        raise TranscodeError(f"{FFMPEG_BIN} not found", retry=False)
+    if not os.path.exists(source):
+        raise TranscodeError(f"source video missing: {source}", retry=False)
+
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        return _render(source, tmp_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def _render(source, tmp_dir):
+    _, source_height = _probe_size(source)
+    targets = [r for r in RENDITIONS if not source_height or r[0] <= source_height] or RENDITIONS[:1]
+
+    renditions = []
+    master = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for height, bitrate, crf in targets:
+        name = f"{height}p"
+        mp4 = os.path.join(tmp_dir, f"{name}.mp4")
+        _run([FFMPEG_BIN, '-y', '-v', 'error', '-i', source,
+              '-vf', f'scale=-2:{height}', '-c:v', 'libx264', '-preset', 'veryfast',
+              '-crf', str(crf), '-maxrate', f'{bitrate}k', '-bufsize', f'{bitrate * 2}k',
+              '-c:a', 'aac', '-b:a', f'{AUDIO_BITRATE}k', '-movflags', '+faststart', mp4])
+        _run([FFMPEG_BIN, '-y', '-v', 'error', '-i', mp4, '-c', 'copy', '-f', 'hls',
+              '-hls_time', str(HLS_SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+              '-hls_segment_filename', os.path.join(tmp_dir, f'{name}_%03d.ts'),
+              os.path.join(tmp_dir, f'{name}.m3u8')])
+
+        width, _ = _probe_size(mp4)
+        bandwidth = (bitrate + AUDIO_BITRATE) * 1000
+        resolution = f",RESOLUTION={width}x{height}" if width else ""
+        master += [f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth}{resolution}", f"{name}.m3u8"]
+        renditions.append({"height": height, "width": width, "bitrate": bitrate,
+                           "file": f"{name}.mp4", "size": os.path.getsize(mp4)})
+
+    with open(os.path.join(tmp_dir, 'master.m3u8'), 'w') as f:
+        f.write('\n'.join(master) + '\n')
+    _run([FFMPEG_BIN, '-y', '-v', 'error', '-ss', '1', '-i', source, '-frames:v', '1',
+          '-vf', 'scale=-2:480', os.path.join(tmp_dir, 'poster.jpg')])
+
+    return {
+        "renditions": renditions,
+        "hls": "master.m3u8",
+        "poster": "poster.jpg",
+        "source_size": os.path.getsize(source),
+    }
+
+
+def publish(tmp_dir, out_dir):
+    """Replace out_dir with a finished tmp_dir, so readers never see a half-written set of renditions."""
+    old_dir = f"{tmp_dir}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.rename(out_dir, old_dir)
+    os.rename(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+# ---------------- QUEUE ---------------- #
+class TranscodeQueue:
+    """SQLite-backed transcoding job queue drained into a local process pool.
+
+    Jobs survive restarts; several web workers can share one queue because a
+    job is claimed with a conditional UPDATE before it is submitted. A new
+    video for a room marks the room's running jobs "superseded"; their output
+    is discarded when they finish instead of replacing the newer renditions.
+    """
+
+    def __init__(self, upload_folder, on_done=None, db_path=TRANSCODE_DB, workers=TRANSCODE_WORKERS):
+        self.upload_folder = upload_folder
+        self.on_done = on_done
+        self.db_path = db_path
+        self.workers = workers
+        self._pool = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = {}
+        self._created = False
+
+    @contextmanager
+    def _connect(self):
+        """One transaction on a fresh connection, closed afterwards (sqlite3's own `with` only commits)."""
+        with closing(sqlite3.connect(self.db_path, timeout=10)) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            if not self._created:
+                # Created on first use, so importing an app doesn't create the database
+                with conn:
+                    self._create(conn)
+                self._created = True
+            with conn:
+                yield conn
+
+    def _create(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS transcode_jobs (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            room_id TEXT NOT NULL,
+                            source TEXT NOT NULL,
+                            status TEXT NOT NULL DEFAULT 'pending',
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            next_attempt_at REAL NOT NULL DEFAULT 0,
+                            error TEXT,
+                            result TEXT,
+                            created_at REAL NOT NULL,
+                            started_at REAL,
+                            finished_at REAL
+                        )''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_transcode_jobs_status "
+                     "ON transcode_jobs (status, next_attempt_at)")
+
+    def output_dir(self, room_id):
+        return os.path.join(self.upload_folder, 'renditions', room_id)
+
+    def work_dir(self, room_id, job_id):
+        return f"{self.output_dir(room_id)}.{job_id}.tmp"
+
+    def _supersede(self, conn, room_id):
+        conn.execute("DELETE FROM transcode_jobs WHERE room_id = ? AND status = 'pending'", (room_id,))
+        conn.execute("UPDATE transcode_jobs SET status = 'superseded', finished_at = ? "
+                     "WHERE room_id = ? AND status = 'running'", (time.time(), room_id))
+
+    def enqueue(self, room_id, source):
+        """Queue a transcode of source, superseding any pending or running job for the room."""
+        with self._connect() as conn:
+            self._supersede(conn, room_id)
+            cursor = conn.execute("INSERT INTO transcode_jobs (room_id, source, created_at) VALUES (?, ?, ?)",
+                                  (room_id, os.path.abspath(source), time.time()))
+            job_id = cursor.lastrowid
+        self.start()
+        self._wake.set()
+        return job_id
+
+    def remove(self, room_id):
+        """Drop pending and running jobs and generated renditions for a deleted room."""
+        with self._connect() as conn:
+            self._supersede(conn, room_id)
+        shutil.rmtree(self.output_dir(room_id), ignore_errors=True)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                with self._connect() as conn:
+                    conn.execute("UPDATE transcode_jobs SET status = 'pending' "
+                                 "WHERE status = 'running' AND started_at < ?",
+                                 (time.time() - TRANSCODE_STALE_AFTER,))
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._thread = threading.Thread(target=self._dispatch, name='transcode-dispatch', daemon=True)
+                self._thread.start()
+
+    def _dispatch(self):
+        while True:
+            self._wake.wait(TRANSCODE_POLL_INTERVAL)
+            self._wake.clear()
+            while len(self._running) < self.workers:
+                job = self._claim()
+                if job is None:
+                    break
+                job_id, room_id, source = job
+                future = self._pool.submit(transcode, source, self.work_dir(room_id, job_id))
+                self._running[job_id] = future
+                future.add_done_callback(lambda f, j=job_id, r=room_id: self._finish(j, r, f))
+
+    def _claim(self):
+        with self._connect() as conn:
+            row = conn.execute('''SELECT id, room_id, source FROM transcode_jobs
+                                  WHERE status = 'pending' AND next_attempt_at <= ?
+                                  ORDER BY id LIMIT 1''', (time.time(),)).fetchone()
+            if row is None:
+                return None
+            claimed = conn.execute('''UPDATE transcode_jobs
+                                      SET status = 'running', attempts = attempts + 1, started_at = ?
+                                      WHERE id = ? AND status = 'pending' ''', (time.time(), row[0])).rowcount
+        return row if claimed else self._claim()
+
+    def _finish(self, job_id, room_id, future):
+        self._running.pop(job_id, None)
+        now = time.time()
+        tmp_dir = self.work_dir(room_id, job_id)
+        try:
+            result = future.result()
+        except Exception as e:
+            retry = getattr(e, 'retry', True)
+            with self._connect() as conn:
+                attempts = conn.execute("SELECT attempts FROM transcode_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+                # A superseded job stays superseded instead of being retried
+                if retry and attempts < TRANSCODE_MAX_ATTEMPTS:
+                    conn.execute('''UPDATE transcode_jobs SET status = 'pending', error = ?, next_attempt_at = ?
+                                    WHERE id = ? AND status = 'running' ''',
+                                 (str(e), now + TRANSCODE_RETRY_DELAY * 2 ** (attempts - 1), job_id))
+                else:
+                    conn.execute('''UPDATE transcode_jobs SET status = 'failed', error = ?, finished_at = ?
+                                    WHERE id = ? AND status = 'running' ''', (str(e), now, job_id))
+            print(f"❌ Transcode job {job_id} ({room_id}) failed: {e}")
+        else:
+            with self._connect() as conn:
+                latest = conn.execute('''UPDATE transcode_jobs SET status = 'done', error = NULL, result = ?, finished_at = ?
+                                          WHERE id = ? AND status = 'running' ''',
+                                      (json.dumps(result), now, job_id)).rowcount
+                # Published before the commit: enqueue() waits on this transaction, so a newer
+                # job can't be superseded-checked and published in between
+                if latest:
+                    publish(tmp_dir, self.output_dir(room_id))
+            if not latest:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                print(f"⚠️ Transcode job {job_id} ({room_id}) was superseded; output discarded")
+            elif self.on_done:
+                try:
+                    self.on_done(room_id, result)
+                except Exception as e:
+                    print(f"❌ Saving renditions for {room_id} failed: {e}")
+        self._wake.set()
+
+    def stats(self, window=3600):
+        """Job counts per status plus throughput over the last window seconds."""
+        since = time.time() - window
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM transcode_jobs GROUP BY status").fetchall())
+            done, avg_seconds = conn.execute('''SELECT COUNT(*), AVG(finished_at - started_at) FROM transcode_jobs
+                                                WHERE status = 'done' AND finished_at >= ?''', (since,)).fetchone()
+            retried = conn.execute("SELECT COUNT(*) FROM transcode_jobs WHERE attempts > 1").fetchone()[0]
+        return {
+            "pending": counts.get('pending', 0),
+            "running": counts.get('running', 0),
+            "done": counts.get('done', 0),
+            "failed": counts.get('failed', 0),
+            "superseded": counts.get('superseded', 0),
+            "retried": retried,
+            "jobs_per_hour": round(done * 3600 / window, 2),
+            "avg_seconds": round(avg_seconds or 0, 1),
+        }
+
+    def recent(self, limit=20):
+        with self._connect() as conn:
+            rows = conn.execute('''SELECT id, room_id, status, attempts, error, created_at, started_at, finished_at
+                                   FROM transcode_jobs ORDER BY id DESC LIMIT ?''', (limit,)).fetchall()
+        keys = ("id", "room_id", "status", "attempts", "error", "created_at", "started_at", "finished_at")
+        return [dict(zip(keys, row)) for row in rows]
@@ -0,0 +1,265 @@
+import base64
+import fcntl
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from flask import Blueprint, current_app, jsonify, request, url_for
+from werkzeug.utils import secure_filename
+
+# Chunked upload configuration
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024        # suggested client chunk size
+UPLOAD_READ_SIZE = 256 * 1024              # bytes held in memory while streaming
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', 2 * 1024 ** 3))
+UPLOAD_EXPIRY = 24 * 3600                  # abandoned partial uploads are removed after this
+
+upload_bp = Blueprint('uploads', __name__)
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _upload_dir():
+    return os.path.join(current_app.root_path, current_app.config.get('UPLOAD_FOLDER', 'static/uploads'))
+
+
+def _partial_path(upload_id, ext):
+    if not UPLOAD_ID_RE.match(upload_id or ''):
+        raise UploadError('Unknown upload', 404)
+    return os.path.join(_upload_dir(), '.partial', f"{upload_id}.{ext}")
+
+
+def _load_meta(upload_id):
+    try:
+        with open(_partial_path(upload_id, 'json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadError('Unknown upload', 404)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def video_filename(room_id):
+    pattern = current_app.extensions['uploads']['filename']
+    return secure_filename(pattern.format(room_id=room_id))
+
+
+def save_video(file_storage, room_id):
+    """Stream a regular multipart upload to a temp file and atomically rename it."""
+    filename = video_filename(room_id)
+    dest = os.path.join(_upload_dir(), filename)
+    tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+    try:
+        file_storage.save(tmp, buffer_size=UPLOAD_READ_SIZE)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return filename
+
+
+def create_upload(room_id, size, sha256=None):
+    if not room_id:
+        raise UploadError('room_id is required')
+    if size <= 0 or size > UPLOAD_MAX_SIZE:
+        raise UploadError(f'size must be between 1 and {UPLOAD_MAX_SIZE} bytes', 413)
+
+    os.makedirs(os.path.join(_upload_dir(), '.partial'), exist_ok=True)
+    _expire_partials()
+    upload_id = uuid.uuid4().hex
+    meta = {"room_id": room_id, "size": size, "sha256": (sha256 or '').lower() or None,
+            "created": time.time()}
+    open(_partial_path(upload_id, 'part'), 'wb').close()
+    with open(_partial_path(upload_id, 'json'), 'w') as f:
+        json.dump(meta, f)
+    return upload_id
+
+
+def append_chunk(upload_id, offset, stream, chunk_sha256=None):
+    """Append the request body at offset, returning the new offset.
+
+    Each upload has its own file lock, so uploads for different rooms never
+    wait on each other and a duplicate PATCH for the same upload is rejected.
+    """
+    meta = _load_meta(upload_id)
+    digest = hashlib.sha256()
+    with open(_partial_path(upload_id, 'part'), 'r+b') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError('Another chunk is being written for this upload', 409)
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise UploadError(f'Upload-Offset mismatch, expected {current}', 409)
+
+        f.seek(current)
+        written = 0
+        for chunk in iter(lambda: stream.read(UPLOAD_READ_SIZE), b''):
+            written += len(chunk)
+            if current + written > meta["size"]:
+                f.truncate(current)
+                raise UploadError('Chunk exceeds declared upload size', 413)
+            digest.update(chunk)
+            f.write(chunk)
+
+        if chunk_sha256 and digest.digest() != chunk_sha256:
+            f.truncate(current)
+            raise UploadError('Chunk checksum mismatch', 460)
+        f.flush()
+        return current + written
+
+
+def upload_offset(upload_id):
+    meta = _load_meta(upload_id)
+    return os.path.getsize(_partial_path(upload_id, 'part')), meta
+
+
+def finalize_upload(upload_id, room_id=None):
+    """Verify a completed upload and atomically move it to the room's video file."""
+    offset, meta = upload_offset(upload_id)
+    if room_id is not None and meta["room_id"] != room_id:
+        raise UploadError('Upload belongs to a different room', 409)
+    if offset != meta["size"]:
+        raise UploadError(f'Upload incomplete ({offset}/{meta["size"]} bytes)', 409)
+
+    part = _partial_path(upload_id, 'part')
+    with open(part, 'rb') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError('A chunk is still being written for this upload', 409)
+        checksum = _file_sha256(part)
+        if meta["sha256"] and checksum != meta["sha256"]:
+            raise UploadError('Upload checksum mismatch', 460)
+
+        filename = video_filename(meta["room_id"])
+        os.replace(part, os.path.join(_upload_dir(), filename))
+    os.remove(_partial_path(upload_id, 'json'))
+    return filename
+
+
+def cancel_upload(upload_id):
+    for ext in ('part', 'json'):
+        try:
+            os.remove(_partial_path(upload_id, ext))
+        except FileNotFoundError:
+            pass
+
+
+def _last_activity(upload_id):
+    # Every chunk touches the .part; the .json only dates the upload's start
+    for ext in ('part', 'json'):
+        try:
+            return os.path.getmtime(_partial_path(upload_id, ext))
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _expire_partials():
+    """Drop uploads with no chunk for UPLOAD_EXPIRY seconds, .part and .json together."""
+    partial_dir = os.path.join(_upload_dir(), '.partial')
+    cutoff = time.time() - UPLOAD_EXPIRY
+    upload_ids = {os.path.splitext(name)[0] for name in os.listdir(partial_dir)}
+    for upload_id in filter(UPLOAD_ID_RE.match, upload_ids):
+        last = _last_activity(upload_id)
+        if last is not None and last < cutoff:
+            cancel_upload(upload_id)
+
+
+def _parse_checksum(header):
+    # tus checksum extension: "sha256 <base64 digest>"
+    if not header:
+        return None
+    algorithm, _, value = header.partition(' ')
+    if algorithm.lower() != 'sha256':
+        raise UploadError('Unsupported checksum algorithm', 400)
+    try:
+        return base64.b64decode(value, validate=True)
+    except ValueError:
+        raise UploadError('Malformed Upload-Checksum header', 400)
+
+
+# ---------------- ROUTES ---------------- #
+@upload_bp.before_request
+def check_access():
+    return current_app.extensions['uploads']['guard']()
+
+
+@upload_bp.errorhandler(UploadError)
+def upload_error(e):
+    return jsonify({"success": False, "message": str(e)}), e.status
+
+
+@upload_bp.route('/uploads', methods=['POST'])
+def init():
+    data = request.get_json(silent=True) or {}
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        raise UploadError('size must be an integer')
+    upload_id = create_upload(str(data.get('room_id', '')).strip(), size, data.get('sha256'))
+    response = jsonify({"success": True, "upload_id": upload_id, "offset": 0,
+                        "chunk_size": UPLOAD_CHUNK_SIZE})
+    response.status_code = 201
+    response.headers['Location'] = url_for('uploads.status', upload_id=upload_id)
+    return response
+
+
+@upload_bp.route('/uploads/<upload_id>', methods=['HEAD', 'GET'])
+def status(upload_id):
+    offset, meta = upload_offset(upload_id)
+    response = jsonify({"success": True, "offset": offset, "size": meta["size"], "room_id": meta["room_id"]})
+    response.headers['Upload-Offset'] = str(offset)
+    response.headers['Upload-Length'] = str(meta["size"])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@upload_bp.route('/uploads/<upload_id>', methods=['PATCH'])
+def patch(upload_id):
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        raise UploadError('Upload-Offset header required')
+    checksum = _parse_checksum(request.headers.get('Upload-Checksum'))
+    new_offset = append_chunk(upload_id, offset, request.stream, checksum)
+    response = current_app.response_class(status=204)
+    response.headers['Upload-Offset'] = str(new_offset)
+    return response
+
+
+@upload_bp.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize(upload_id):
+    meta = _load_meta(upload_id)
+    filename = finalize_upload(upload_id)
+    current_app.extensions['uploads']['on_complete'](meta["room_id"], filename)
+    return jsonify({"success": True, "room_id": meta["room_id"], "video": filename})
+
+
+@upload_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancel(upload_id):
+    cancel_upload(upload_id)
+    return jsonify({"success": True})
+
+
+def init_uploads(app, guard, on_complete, filename='room_{room_id}.mp4'):
+    """Register the chunked upload API.
+
+    guard() returns None to allow the request or a response to reject it;
+    on_complete(room_id, filename) records a video finalized through the API.
+    """
+    app.extensions['uploads'] = {"guard": guard, "on_complete": on_complete, "filename": filename}
+    app.register_blueprint(upload_bp)
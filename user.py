@@ -1,45 +1,58 @@
 import os
-from flask import Flask, render_template
-import firebase_admin
-from firebase_admin import credentials, firestore
+import time
+from flask import Flask, render_template, jsonify, make_response, request, Response, stream_with_context, url_for
 from datetime import datetime
 from dotenv import load_dotenv
+from cache import collection_cache
+from video import init_video
+from fanout import fetch_all
+from schedule import ScheduleIndex, DAYS
+from materialize import room_key, week_view_id
+from changes import ChangeFeed
+from pagecache import PageCache, digest, render_rows
+from snapshot import SnapshotStore
+from search import compact
+from tables import TABLES, index_for, init_tables, query_table
+from profiling import init_profiling
+from storage import open_storage, storage_backend
+from startup import init_startup, STARTUP_WARM
 
 # Load .env
 load_dotenv()
 
 app = Flask(__name__)
+app.config['UPLOAD_FOLDER'] = 'static/uploads'
+init_video(app)
+# Kiosks have no admin session, so profiles need ?__profile=<PROFILE_TOKEN>
+init_profiling(app)
+init_tables(app)
+
+# KIOSK_MODE=snapshot serves read-only from the snapshot file and never touches Firebase or storage
+KIOSK_MODE = os.getenv("KIOSK_MODE", "live").lower()
+snapshot_store = SnapshotStore()
 
 # Resolve Firebase credential path
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 cred_filename = os.getenv("FIREBASE_CRED")
-cred_path = os.path.join(BASE_DIR, cred_filename)
-
-if not cred_filename or not os.path.exists(cred_path):
-    raise RuntimeError(f"Firebase credential file not found: {cred_path}")
+cred_path = os.path.join(BASE_DIR, cred_filename or "")
 
-# Firebase Setup (initialize only once)
-if not firebase_admin._apps:
-    cred = credentials.Certificate(cred_path)
-    firebase_admin.initialize_app(cred)
+# Storage Setup (connects on first use). STORAGE_BACKEND=sqlite needs no credentials;
+# Firestore without them makes start() check for a snapshot
+local = storage_backend() == "sqlite"
+online = KIOSK_MODE != "snapshot" and (local or bool(cred_filename) and os.path.exists(cred_path))
+store = open_storage(**({} if local else {"cred": cred_path})) if online else None
 
-db = firestore.client()
 
+# ---------------- DATA LOADERS ---------------- #
+def rooms_from_rows(rows):
+    return list(rows)
 
-@app.route('/')
-@app.route('/user')
-def user():
-    # Fetch all rooms
-    rooms_ref = db.collection("rooms").stream()
-    rooms = [{"id": doc.id, **doc.to_dict()} for doc in rooms_ref]
 
-    # Fetch timetable
-    timetable_ref = db.collection("timetable").stream()
+def timetable_from_rows(rows):
     timetable = []
-    for entry in timetable_ref:
-        d = entry.to_dict()
+    for d in rows:
         timetable.append({
-            "id": entry.id,
+            "id": d["id"],
             "day": d.get("day", ""),
             "period": d.get("period", ""),
             "subject": d.get("subject", ""),
@@ -48,12 +61,12 @@ def user():
             "start_time": d.get("start_time", ""),
             "end_time": d.get("end_time", "")
         })
+    return timetable
 
-    # Fetch exams
-    exams_ref = db.collection("exams").stream()
+
+def exams_from_rows(rows):
     exams = []
-    for ex in exams_ref:
-        d = ex.to_dict()
+    for d in rows:
         date_val = d.get("date")
 
         if isinstance(date_val, datetime):
@@ -62,21 +75,365 @@ def user():
             date_str = str(date_val) if date_val else ""
 
         exams.append({
-            "id": ex.id,
+            "id": d["id"],
             "name": d.get("name", ""),
             "date": date_str,
             "room": d.get("room", ""),
             "start_time": d.get("start_time", ""),
             "end_time": d.get("end_time", "")
         })
+    return exams
+
+
+LOADERS = {
+    "rooms": rooms_from_rows,
+    "timetable": timetable_from_rows,
+    "exams": exams_from_rows,
+}
+
+
+def snapshot_rows(name):
+    snapshot = snapshot_store.get()
+    if snapshot is None:
+        raise RuntimeError(f"No kiosk snapshot at {snapshot_store.path}")
+    return snapshot.rows(name)
+
+
+def load_collection(name):
+    rev, rows, exact = store.rows_at(name)
+    rows = LOADERS[name](rows)
+    # Rows that may be newer than rev are versioned by content, so a fragment never sits under the wrong revision
+    return {"rev": rev, "version": f"r{rev}" if exact else f"d{digest(rows)}", "rows": rows}
+
+
+def from_snapshot(name):
+    snapshot = snapshot_store.get()
+    return {"rev": None, "version": f"s{snapshot.version}" if snapshot else None, "rows": snapshot_rows(name)}
+
+
+def cached_collection(name):
+    """{"rev", "version", "rows"} for a collection.
+
+    rev is None when unknown (snapshot, listeners); version identifies the
+    rows for the page cache. The change feed is polled first (at most once per
+    SYNC_POLL_INTERVAL), so writes made by app.py or admin.py in other processes
+    drop this process's cached rows instead of waiting out CACHE_TTL.
+    """
+    if store is None:
+        return from_snapshot(name)
+    try:
+        feed.poll()
+        return collection_cache.get(name, lambda: load_collection(name))
+    except Exception as e:
+        if snapshot_store.get() is None:
+            raise
+        print(f"⚠️ Reading {name} from {store.backend} failed, using snapshot: {e}")
+        return from_snapshot(name)
+
+
+def get_collection(name):
+    """Read a collection through the shared cache, falling back to the snapshot offline."""
+    return cached_collection(name)["rows"]
+
+
+def watched(transform):
+    # Listener updates carry no revision, so the rows' digest versions them
+    def to_value(stored):
+        rows = transform(stored)
+        return {"rev": None, "version": f"d{digest(rows)}", "rows": rows}
+    return to_value
+
+
+# Keep the cache warm from Firestore listeners instead of TTL polling
+CACHE_LISTEN = os.getenv("CACHE_LISTEN", "").lower() in ("1", "true", "yes")
+
+
+# Rendered /user page and its sections, per data version
+page_cache = PageCache(app)
+
+
+@app.route('/')
+@app.route('/user')
+def user():
+    # Read the three collections concurrently; a slow section renders empty
+    result = fetch_all({name: lambda name=name: cached_collection(name) for name in LOADERS},
+                       defaults={name: {"rev": None, "version": None, "rows": []} for name in LOADERS})
+    revs = [result[name]["rev"] for name in LOADERS]
+    # The oldest collection decides where delta sync starts; unknown means Refresh reloads
+    rev = None if None in revs else min(revs)
+    versions = {name: result[name]["version"] for name in LOADERS}
+
+    def section(name, rows):
+        if versions[name] is None:
+            return render_rows(name, rows)
+        return page_cache.fragment(name, versions[name], lambda: render_rows(name, rows))
+
+    def render():
+        # Only the first window of each table is in the page; the rest comes from /tables/<name>
+        first = {name: index_for(name, versions[name], lambda name=name: result[name]["rows"]).query()
+                 for name in LOADERS}
+        return render_template('user.html', fragments={name: section(name, first[name][0]) for name in LOADERS},
+                               tables={name: {"api": url_for('table', name=name), "total": first[name][1]}
+                                       for name in LOADERS},
+                               degraded=result.degraded, rev=rev)
+
+    timing = {'Server-Timing': result.server_timing()}
+    if result.degraded or None in versions.values():
+        # Partial pages are never cached
+        response = make_response(render())
+        response.headers.update(timing)
+        return response
+    return page_cache.page("user", '-'.join(versions[name] for name in LOADERS), render, headers=timing)
+
+
+# ---------------- SCHEDULE LOOKUPS ---------------- #
+schedule_index = ScheduleIndex()
+
+def get_schedule():
+    """Return the schedule index, applying whatever changed since the last read."""
+    if store is None:
+        # Offline the snapshot's prebuilt index serves as is; a new snapshot brings a new one
+        snapshot = snapshot_store.get()
+        if snapshot is None:
+            raise RuntimeError(f"No kiosk snapshot at {snapshot_store.path}")
+        return snapshot.schedule_index(), snapshot.rows("rooms")
+    rooms = get_collection("rooms")
+    schedule_index.set_rooms(rooms)
+    schedule_index.sync("timetable", get_collection("timetable"))
+    schedule_index.sync("exams", get_collection("exams"))
+    return schedule_index, rooms
+
+
+def _requested_time():
+    at = request.args.get('at')
+    return datetime.fromisoformat(at) if at else datetime.now()
+
+
+@app.route('/schedule/room/<room>')
+def room_schedule(room):
+    """What is in a room now and next (?at=YYYY-MM-DDTHH:MM to ask about another time)."""
+    try:
+        when = _requested_time()
+    except ValueError:
+        return jsonify({"success": False, "message": "at must be an ISO date/time"}), 400
+    index, _ = get_schedule()
+    return jsonify({"success": True, **index.room_status(room, when)})
+
+
+@app.route('/schedule/teacher/<teacher>')
+def teacher_schedule(teacher):
+    try:
+        when = _requested_time()
+    except ValueError:
+        return jsonify({"success": False, "message": "at must be an ISO date/time"}), 400
+    index, _ = get_schedule()
+    return jsonify({"success": True, **index.teacher_status(teacher, when)})
+
+
+@app.route('/schedule/free')
+def free_rooms():
+    """Rooms free between ?start and ?end on ?day (or ?date, which also checks exams)."""
+    date = request.args.get('date')
+    try:
+        day = DAYS[datetime.strptime(date, '%Y-%m-%d').weekday()] if date else \
+            request.args.get('day', DAYS[datetime.now().weekday()])
+        index, rooms = get_schedule()
+        free = index.free_rooms(rooms, day, request.args.get('start', ''), request.args.get('end', ''), date)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "day": day, "rooms": free})
+
+
+# ---------------- DAY VIEWS ---------------- #
+def view_rows(kind, view_id, matches):
+    """Rows of one schedule view (a single document read on Firestore, an indexed
+    query on SQLite), or the filtered collection when offline or when the
+    Firestore views haven't been built yet."""
+    if store is not None:
+        try:
+            rows = collection_cache.get(f"view:{view_id}", lambda: store.view(view_id))
+            if rows is not None:
+                return rows
+        except Exception as e:
+            print(f"⚠️ Reading view {view_id} failed, using {kind}: {e}")
+    return [row for row in get_collection(kind) if matches(row)]
+
+
+def _requested_date():
+    date = request.args.get('date')
+    return datetime.strptime(date, '%Y-%m-%d') if date else datetime.now()
+
+
+@app.route('/schedule/day')
+def day_schedule():
+    """Classes and exams on ?date=YYYY-MM-DD (default today)."""
+    try:
+        date = _requested_date()
+    except ValueError:
+        return jsonify({"success": False, "message": "date must be YYYY-MM-DD"}), 400
+    day, date_str = DAYS[date.weekday()], date.strftime('%Y-%m-%d')
+    return jsonify({
+        "success": True,
+        "day": day,
+        "date": date_str,
+        "timetable": view_rows("timetable", f"day:{day}", lambda r: r.get("day") == day),
+        "exams": view_rows("exams", f"date:{date_str}", lambda r: r.get("date") == date_str),
+    })
+
+
+@app.route('/schedule/room/<room>/week')
+def room_week(room):
+    """A room's weekly timetable and its exams in the week of ?date=YYYY-MM-DD."""
+    try:
+        date = _requested_date()
+    except ValueError:
+        return jsonify({"success": False, "message": "date must be YYYY-MM-DD"}), 400
+    key = room_key(room)
+    week = date.isocalendar()[:2]
+
+    def in_week(row):
+        try:
+            return datetime.strptime(row.get("date", ''), '%Y-%m-%d').isocalendar()[:2] == week
+        except ValueError:
+            return False
+
+    return jsonify({
+        "success": True,
+        "room": room,
+        "week": f"{week[0]}-W{week[1]:02d}",
+        "timetable": view_rows("timetable", f"room:{key}", lambda r: room_key(r.get("room")) == key),
+        "exams": view_rows("exams", week_view_id(room, date),
+                           lambda r: room_key(r.get("room")) == key and in_week(r)),
+    })
+
+
+# ---------------- DELTA SYNC ---------------- #
+SYNC_HEARTBEAT = float(os.getenv('SYNC_HEARTBEAT', 15))
+SYNC_STREAM_SECONDS = float(os.getenv('SYNC_STREAM_SECONDS', 300))   # EventSource reconnects after this
+def feed_row(collection, row):
+    return LOADERS[collection]([row])[0]
+
+
+def feed_changed(collections):
+    # Keep this process's cached collections and day views in step with the feed
+    collection_cache.invalidate(*collections)
+    if {"timetable", "exams"} & set(collections):
+        collection_cache.invalidate("view")
+
+
+feed = ChangeFeed(store, feed_row, on_change=feed_changed) if store is not None else None
+
+
+@app.route('/sync')
+def sync():
+    """Rooms, timetable and exam rows added, changed or deleted since ?since=<rev>."""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({"success": False, "message": "since must be a revision number"}), 400
+    if feed is None:
+        return jsonify({"success": False, "message": "Delta sync needs live storage"}), 503
+    return jsonify({"success": True, **feed.since(since)})
+
+
+@app.route('/sync/stream')
+def sync_stream():
+    """Server-Sent Events version of /sync: one "changes" event per batch of changes."""
+    # EventSource sends the last event ID back when it reconnects
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({"success": False, "message": "since must be a revision number"}), 400
+    if feed is None:
+        return jsonify({"success": False, "message": "Delta sync needs live storage"}), 503
+
+    def events(rev):
+        deadline = time.monotonic() + SYNC_STREAM_SECONDS
+        yield "retry: 3000\n\n"
+        while time.monotonic() < deadline:
+            delta = feed.wait(rev, SYNC_HEARTBEAT)
+            if delta["changes"] or delta["reset"]:
+                rev = delta["rev"]
+                yield f"id: {rev}\nevent: changes\ndata: {app.json.dumps(delta)}\n\n"
+                if delta["reset"]:
+                    return
+            else:
+                # A comment line keeps proxies from closing an idle connection
+                yield ": keepalive\n\n"
+
+    return Response(stream_with_context(events(since)), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/search')
+def search():
+    """Room search by ID or name prefix, served from the snapshot's index when offline."""
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', 20, type=int)
+    if store is None:
+        snapshot = snapshot_store.get()
+        if snapshot is None:
+            return jsonify({"success": False, "message": "No snapshot to search"}), 503
+        return jsonify({"rooms": snapshot.search(query, limit)})
+    needle = compact(query)
+    rooms = [r for r in get_collection("rooms")
+             if needle and (compact(r.get("id")).startswith(needle) or compact(r.get("name")).startswith(needle))]
+    return jsonify({"rooms": rooms[:limit]})
+
+
+@app.route('/tables/<name>')
+def table(name):
+    """One page of a table: ?q= words, ?sort=[-]field, field filters, ?offset= and ?limit=."""
+    if name not in TABLES:
+        return jsonify({"success": False, "message": "Unknown table"}), 404
+    data = cached_collection(name)
+    try:
+        return jsonify(query_table(name, data["version"], lambda: data["rows"], request.args))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    snapshot = snapshot_store.get()
+    return jsonify({**collection_cache.stats(), "online": store is not None,
+                    "backend": store.backend if store is not None else None,
+                    "snapshot": snapshot.version if snapshot else None, "pages": page_cache.stats(),
+                    "startup": startup.stats()})
+
+
+# ---------------- STARTUP ---------------- #
+def start():
+    if KIOSK_MODE == "snapshot" and snapshot_store.get() is None:
+        raise RuntimeError(f"KIOSK_MODE=snapshot but no snapshot at {snapshot_store.path}")
+    if KIOSK_MODE != "snapshot" and store is None:
+        if snapshot_store.get() is None:
+            raise RuntimeError(f"Firebase credential file not found: {cred_path}")
+        print(f"⚠️ Firebase credential file not found, serving from snapshot {snapshot_store.path}")
+    if store is not None and CACHE_LISTEN:
+        for name, transform in LOADERS.items():
+            if not store.watch(collection_cache, name, watched(transform)):
+                print(f"⚠️ CACHE_LISTEN needs Firestore; {name} is re-read after the cache TTL")
+                break
+
+
+def connect():
+    if store is not None:
+        store.connect()
+
+
+startup = init_startup(app, start, warm={
+    "storage": connect,
+    "user page": '/user',
+    "schedule": get_schedule,
+})
+
 
-    return render_template(
-        'user.html',
-        rooms=rooms,
-        timetable=timetable,
-        exams=exams
-    )
+def create_app(warm=STARTUP_WARM):
+    """Check the data source and warm caches before serving, e.g. gunicorn 'user:create_app()'."""
+    startup.run(warm)
+    return app
 
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5002)
+    create_app().run(debug=True, port=5002)
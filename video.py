@@ -0,0 +1,80 @@
+import mimetypes
+import os
+from flask import Blueprint, abort, current_app, request, send_file, url_for
+from werkzeug.utils import safe_join
+
+# Video delivery configuration
+# VIDEO_ACCEL: "" (Flask sends the file), "nginx" (X-Accel-Redirect) or "apache" (X-Sendfile)
+VIDEO_ACCEL = os.getenv('VIDEO_ACCEL', '').lower()
+VIDEO_ACCEL_PREFIX = os.getenv('VIDEO_ACCEL_PREFIX', '/protected-uploads/')
+VIDEO_MAX_AGE = 365 * 24 * 3600
+VIDEO_MIMETYPES = {
+    '.mp4': 'video/mp4',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+    '.jpg': 'image/jpeg',
+}
+
+video_bp = Blueprint('video', __name__)
+
+
+def _upload_dir():
+    return os.path.join(current_app.root_path, current_app.config.get('UPLOAD_FOLDER', 'static/uploads'))
+
+
+def file_version(path):
+    """Short version tag for path from its mtime and size, so no video bytes are read.
+
+    Uploads and renditions are written elsewhere and renamed into place, so a
+    replaced file always gets a new mtime.
+    """
+    st = os.stat(path)
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def video_url(filename):
+    """URL for a room video, versioned by file_version() so it can be cached forever."""
+    if not filename:
+        return ''
+    path = safe_join(_upload_dir(), filename)
+    if path and os.path.isfile(path):
+        return url_for('video.stream', filename=filename, v=file_version(path))
+    return url_for('video.stream', filename=filename)
+
+
+@video_bp.route('/video/<path:filename>')
+def stream(filename):
+    """Serve a room video with Range, ETag and Last-Modified support."""
+    path = safe_join(_upload_dir(), filename)
+    if not path or not os.path.isfile(path):
+        abort(404)
+
+    etag = file_version(path)
+    # Rendition directories also hold HLS playlists/segments and poster images
+    mimetype = VIDEO_MIMETYPES.get(os.path.splitext(filename)[1].lower()) \
+        or mimetypes.guess_type(filename)[0] or 'video/mp4'
+    if VIDEO_ACCEL == 'nginx':
+        # Let the front proxy serve (and range-slice) the bytes
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = VIDEO_ACCEL_PREFIX + filename
+        response.set_etag(etag)
+        response.last_modified = os.path.getmtime(path)
+    else:
+        # send_file handles Range/If-Range/If-None-Match and hands the open
+        # file to the server's wsgi.file_wrapper, so gunicorn & co. can sendfile().
+        # With USE_X_SENDFILE (VIDEO_ACCEL=apache) it emits X-Sendfile instead.
+        response = send_file(path, mimetype=mimetype, etag=etag, conditional=True)
+
+    if request.args.get('v') == etag:
+        response.headers['Cache-Control'] = f'public, max-age={VIDEO_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = 'public, no-cache'
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def init_video(app):
+    if VIDEO_ACCEL == 'apache':
+        app.config['USE_X_SENDFILE'] = True
+    app.register_blueprint(video_bp)
+    app.add_template_global(video_url)